@@ -8,26 +8,382 @@ from ifcopenshell.util.placement import get_local_placement
 import numpy as np
 
 
-def createIFC(data_path, target_path):
+class IfcEntityPool(object):
+    """
+    Interning layer for the IFC builder
+    Identical geometric primitives (points, directions, placements, profiles and
+    wall representation maps) are created once and referenced by every element
+    that needs them instead of being written again for each wall, floor and space.
+    @Param ifc_file: ifcopenshell file the entities are created in
+    @Param enabled: if False every request creates a new entity (unshared layout)
+    @Param precision: number of decimals used when comparing coordinates
+    """
+
+    def __init__(self, ifc_file, enabled=True, precision=6):
+        self.ifc_file = ifc_file
+        self.enabled = enabled
+        self.precision = precision
+        self._entities = {}
+
+    def _get(self, name, values, create):
+        if not self.enabled:
+            return create()
+        precision = self.precision
+        key = (name,) + tuple(round(float(v), precision) for v in values)
+        entity = self._entities.get(key)
+        if entity is None:
+            entity = create()
+            self._entities[key] = entity
+        return entity
+
+    def __len__(self):
+        return len(self._entities)
+
+    def clear(self):
+        """Forget all pooled entities, later requests create new ones"""
+        self._entities = {}
+
+    def point(self, coords):
+        """IfcCartesianPoint (2D or 3D)"""
+        coords = [float(c) for c in coords]
+        return self._get("IfcCartesianPoint", coords,
+                         lambda: self.ifc_file.createIfcCartesianPoint(coords))
+
+    def direction(self, ratios):
+        """IfcDirection"""
+        ratios = [float(r) for r in ratios]
+        return self._get("IfcDirection", ratios,
+                         lambda: self.ifc_file.createIfcDirection(ratios))
+
+    def axis2d(self, location=(0.0, 0.0)):
+        """IfcAxis2Placement2D without RefDirection"""
+        return self._get("IfcAxis2Placement2D", location,
+                         lambda: self.ifc_file.createIfcAxis2Placement2D(self.point(location), None))
+
+    def axis3d(self, location=(0.0, 0.0, 0.0), axis=(0.0, 0.0, 1.0), ref_direction=(1.0, 0.0, 0.0)):
+        """IfcAxis2Placement3D, Z up and X forward unless given"""
+        values = tuple(location) + tuple(axis) + tuple(ref_direction)
+        return self._get("IfcAxis2Placement3D", values, lambda: self.ifc_file.createIfcAxis2Placement3D(
+            self.point(location),
+            self.direction(axis),
+            self.direction(ref_direction)
+        ))
+
+    def rectangle_profile(self, xdim, ydim):
+        """IfcRectangleProfileDef centred on the 2D origin"""
+        return self._get("IfcRectangleProfileDef", (xdim, ydim),
+                         lambda: self.ifc_file.createIfcRectangleProfileDef(
+                             "AREA", None, self.axis2d(), float(xdim), float(ydim)))
+
+    def extrusion(self, xdim, ydim, depth, location=(0.0, 0.0, 0.0)):
+        """IfcExtrudedAreaSolid of a rectangle profile extruded along Z"""
+        values = (xdim, ydim, depth) + tuple(location)
+        return self._get("IfcExtrudedAreaSolid", values, lambda: self.ifc_file.createIfcExtrudedAreaSolid(
+            self.rectangle_profile(xdim, ydim),
+            self.axis3d(location),
+            self.direction((0.0, 0.0, 1.0)),
+            float(depth)
+        ))
+
+    def mapped_item(self, context, xdim, ydim, depth):
+        """
+        IfcMappedItem instancing a box of the given size
+        Walls with identical length, thickness and height all reference the
+        same IfcRepresentationMap and only differ by their local placement.
+        """
+        def create():
+            representation_map = self.ifc_file.createIfcRepresentationMap(
+                self.axis3d(),
+                self.ifc_file.createIfcShapeRepresentation(
+                    context, "Body", "SweptSolid",
+                    [self.extrusion(xdim, ydim, depth)]
+                )
+            )
+            return self.ifc_file.createIfcMappedItem(representation_map, self.transformation_operator())
+
+        return self._get("IfcMappedItem", (context.id(), xdim, ydim, depth), create)
+
+    def transformation_operator(self):
+        """Identity IfcCartesianTransformationOperator3D used by mapped items"""
+        return self._get("IfcCartesianTransformationOperator3D", (),
+                         lambda: self.ifc_file.createIfcCartesianTransformationOperator3D(
+                             None, None, self.point((0.0, 0.0, 0.0)), None, None))
+
+
+class IfcStreamEntity(object):
+    """
+    Entity created by IfcStreamFile
+    Only holds its attribute values until it has been written, after that it
+    can still be referenced by later entities through its id.
+    """
+    __slots__ = ("_id", "_declaration", "_values")
+
+    def __init__(self, entity_id, declaration, values):
+        object.__setattr__(self, "_id", entity_id)
+        object.__setattr__(self, "_declaration", declaration)
+        object.__setattr__(self, "_values", values)
+
+    def id(self):
+        return self._id
+
+    def __getattr__(self, name):
+        try:
+            return self._values[self._declaration["index"][name]]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        if self._values is None:
+            raise RuntimeError(f"#{self._id} has already been written")
+        self._values[self._declaration["index"][name]] = value
+
+    def to_string(self):
+        """STEP line of the entity, formatted like ifcopenshell does"""
+        arguments = []
+        for value, kind in zip(self._values, self._declaration["kinds"]):
+            arguments.append("*" if kind == "derived" else format_step_value(value, kind == "enum"))
+        return "#%d=%s(%s)" % (self._id, self._declaration["name"].upper(), ",".join(arguments))
+
+
+class IfcStreamFile(object):
+    """
+    Write-only stand-in for ifcopenshell.file used by createIFC(stream=True)
+    The base file (owner history, contexts and spatial hierarchy) is written first.
+    createIfc* calls then return IfcStreamEntity objects numbered after the base
+    entities, flush() appends them to disk and drops their attribute values, so
+    memory stays bounded by the flush interval and the entity pool however many
+    plans are exported. ifcopenshell does not give memory of removed entities back,
+    which is why elements are not created in an ifcopenshell.file in this mode.
+    @Param base_file: ifcopenshell file holding the spatial hierarchy, not changed afterwards
+    @Param output_path: IFC file to write
+    """
+
+    def __init__(self, base_file, output_path):
+        self.schema = ifcopenshell.ifcopenshell_wrapper.schema_by_name(base_file.schema)
+        self.stream = open(output_path, "w")
+        # Header and hierarchy as produced by ifcopenshell, without the closing ENDSEC;
+        text = base_file.to_string()
+        self.stream.write(text[:text.rindex("ENDSEC;")])
+        self.next_id = base_file.get_max_id() + 1
+        self.pending = []
+        self._declarations = {}
+
+    def __getattr__(self, name):
+        if name.startswith("create"):
+            return lambda *args: self.create_entity(name[len("create"):], *args)
+        raise AttributeError(name)
+
+    def _declaration(self, type):
+        declaration = self._declarations.get(type)
+        if declaration is None:
+            entity = self.schema.declaration_by_name(type)
+            attributes = entity.all_attributes()
+            kinds = []
+            for attribute, derived in zip(attributes, entity.derived()):
+                attribute_type = attribute.type_of_attribute()
+                if derived:
+                    kinds.append("derived")
+                elif isinstance(attribute_type, ifcopenshell.ifcopenshell_wrapper.named_type) and \
+                        isinstance(attribute_type.declared_type(), ifcopenshell.ifcopenshell_wrapper.enumeration_type):
+                    kinds.append("enum")
+                else:
+                    kinds.append("value")
+            declaration = self._declarations[type] = {
+                "name": entity.name(),
+                "index": {attribute.name(): i for i, attribute in enumerate(attributes)},
+                "kinds": kinds,
+            }
+        return declaration
+
+    def create_entity(self, type, *args):
+        """Create an entity, same positional arguments as ifcopenshell.file.create_entity"""
+        declaration = self._declaration(type)
+        values = list(args) + [None] * (len(declaration["kinds"]) - len(args))
+        entity = IfcStreamEntity(self.next_id, declaration, values)
+        self.next_id += 1
+        self.pending.append(entity)
+        return entity
+
+    def flush(self):
+        """Write all entities created since the last flush"""
+        self.stream.write("".join(entity.to_string() + ";\n" for entity in self.pending))
+        for entity in self.pending:
+            object.__setattr__(entity, "_values", None)
+        self.pending = []
+
+    def close(self):
+        self.flush()
+        self.stream.write("ENDSEC;\nEND-ISO-10303-21;\n")
+        self.stream.close()
+
+
+def format_step_value(value, enum=False):
+    """
+    Format an attribute value as STEP (ISO 10303-21)
+    @Param value: None, bool, int, float, str, entity or list of those
+    @Param enum: format strings as enumeration (.VALUE.)
+    @Return STEP text
+    """
+    if value is None:
+        return "$"
+    if isinstance(value, bool):
+        return ".T." if value else ".F."
+    if isinstance(value, str):
+        if enum:
+            return "." + value.upper() + "."
+        return "'" + encode_step_string(value) + "'"
+    if isinstance(value, (int, np.integer)):
+        return str(int(value))
+    if isinstance(value, (float, np.floating)):
+        # Shortest repr that round trips, written like ifcopenshell: 1. 0.5 1.E-05
+        mantissa, _, exponent = repr(float(value)).upper().partition("E")
+        if "." not in mantissa:
+            mantissa += "."
+        elif mantissa.endswith(".0"):
+            mantissa = mantissa[:-1]
+        return mantissa + ("E" + exponent if exponent else "")
+    if isinstance(value, (list, tuple)):
+        return "(" + ",".join(format_step_value(v, enum) for v in value) + ")"
+    return "#%d" % value.id()
+
+
+def encode_step_string(text):
+    """Escape quotes and backslashes, non ASCII characters as \\X2\\ / \\X4\\ hex"""
+    text = text.replace("\\", "\\\\").replace("'", "''")
+    if text.isascii():
+        return text
+    encoded = []
+    for char in text:
+        if char.isascii():
+            encoded.append(char)
+        elif ord(char) > 0xFFFF:
+            encoded.append("\\X4\\%08X\\X0\\" % ord(char))
+        else:
+            encoded.append("\\X2\\%04X\\X0\\" % ord(char))
+    return "".join(encoded)
+
+
+def createIFC(data_path, target_path, share_entities=True, stream=False, flush_every=1000, pool_limit=100000):
     """
     Create IFC file from generated geometry data
-    @Param data_path: Path to data directory (e.g., "Data/0/")
+    @Param data_path: Path to data directory (e.g., "Data/0/") or a list of them,
+                      several plans are merged into one storey
     @Param target_path: Output IFC file path (without extension)
+    @Param share_entities: Reuse identical geometric primitives, see IfcEntityPool
+    @Param stream: Write elements to disk while they are created, see IfcStreamFile
+    @Param flush_every: Number of elements between two writes when streaming
+    @Param pool_limit: Maximum number of pooled primitives kept when streaming,
+                       the pool starts over when it grows larger
     """
-    # Read geometry data
-    def read_from_file(file_path):
-        with open(file_path + '.txt', 'r') as f:
-            return json.loads(f.read())
-    
-    # Read transform
-    transform = read_from_file(data_path + "transform")
-    position = transform.get("position", [0, 0, 0])
-    rotation = transform.get("rotation", [0, 0, 0])
-    shape = transform.get("shape", [0, 0, 0])
+    data_paths = [data_path] if isinstance(data_path, str) else list(data_path)
+    createStoreysIFC([("Ground Floor", 0.0, data_paths)], target_path, share_entities,
+                     stream, flush_every, pool_limit)
+
+
+def createStoreysIFC(storeys, target_path, share_entities=True, stream=False, flush_every=1000, pool_limit=100000):
+    """
+    Create IFC file with one IfcBuildingStorey per entry from generated geometry data
+    All storeys share one entity pool, so identical walls on different floors
+    reference the same primitives.
+    @Param storeys: list of (name, elevation, data paths) tuples
+    @Param target_path: Output IFC file path (without extension)
+    @Param share_entities: Reuse identical geometric primitives, see IfcEntityPool
+    @Param stream: Write elements to disk while they are created, see IfcStreamFile
+    @Param flush_every: Number of elements between two writes when streaming
+    @Param pool_limit: Maximum number of pooled primitives kept when streaming,
+                       the pool starts over when it grows larger
+    """
+    output_path = get_output_path(target_path)
     
     # Create IFC file
     ifc_file = ifcopenshell.file()
+    pool = IfcEntityPool(ifc_file, enabled=share_entities)
+    hierarchy = create_spatial_hierarchy(ifc_file, pool, [(name, elevation) for name, elevation, _ in storeys])
+    
+    if stream:
+        # Elements go to the stream, pooled hierarchy primitives stay usable
+        target_file = IfcStreamFile(ifc_file, output_path)
+        pool.ifc_file = target_file
+    else:
+        target_file = ifc_file
+    
+    # Several plans on one storey get a prefix so element names stay unique
+    def elements(storey, data_paths):
+        for plan_idx, path in enumerate(data_paths):
+            prefix = f"Plan_{plan_idx}_" if len(data_paths) > 1 else ""
+            yield from create_plan_elements(target_file, pool, path, hierarchy, storey, prefix)
+    
+    storey_elements = []
+    if stream:
+        try:
+            count = 0
+            for storey, (_, _, data_paths) in zip(hierarchy["storeys"], storeys):
+                storey_elements.append([])
+                for element in elements(storey, data_paths):
+                    storey_elements[-1].append(element)
+                    count += 1
+                    if count % flush_every == 0:
+                        target_file.flush()
+                        if len(pool) > pool_limit:
+                            pool.clear()
+            
+            # Link all elements to their storey, written elements are referenced by id
+            for storey, all_elements in zip(hierarchy["storeys"], storey_elements):
+                if all_elements:
+                    create_containment(target_file, hierarchy, all_elements, storey)
+        finally:
+            target_file.close()
+    else:
+        for storey, (_, _, data_paths) in zip(hierarchy["storeys"], storeys):
+            storey_elements.append(list(elements(storey, data_paths)))
+        
+        # Link all elements to their storey
+        for storey, all_elements in zip(hierarchy["storeys"], storey_elements):
+            if all_elements:
+                create_containment(ifc_file, hierarchy, all_elements, storey)
+        ifc_file.write(output_path)
+    print(f"Created IFC file at {output_path}")
+
+
+def get_output_path(target_path):
+    """
+    Get absolute .ifc path of a target path, always inside the project directory
+    @Param target_path: Output IFC file path (without extension)
+    @Return output path
+    """
+    # Remove leading slash if present and create in current directory
+    clean_path = target_path.lstrip('/')
+    if not clean_path:
+        clean_path = "floorplan"
+    output_path = os.path.join(os.getcwd(), clean_path + ".ifc")
     
+    # Ensure directory exists
+    output_dir = os.path.dirname(output_path)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+    return output_path
+
+
+def create_containment(ifc_file, hierarchy, elements, storey):
+    """Link elements to a storey"""
+    return ifc_file.createIfcRelContainedInSpatialStructure(
+        ifcopenshell.guid.new(),
+        hierarchy["owner_history"],
+        None, None,
+        elements,
+        storey
+    )
+
+
+def create_spatial_hierarchy(ifc_file, pool, storeys=(("Ground Floor", 0.0),)):
+    """
+    Create owner history, representation contexts, units and the
+    Project → Site → Building → BuildingStorey hierarchy
+    @Param ifc_file: ifcopenshell file
+    @Param pool: IfcEntityPool of ifc_file
+    @Param storeys: list of (name, elevation) tuples
+    @Return dict with owner_history, project, body_context, site, building and storeys
+    """
     # Create owner history (simplified)
     person = ifc_file.createIfcPerson()
     organization = ifc_file.createIfcOrganization()
@@ -45,11 +401,7 @@ def createIFC(data_path, target_path):
     # Main Model context
     model_context = ifc_file.createIfcGeometricRepresentationContext(
         None, "Model", 3, 1.0E-5,
-        ifc_file.createIfcAxis2Placement3D(
-            ifc_file.createIfcCartesianPoint([0.0, 0.0, 0.0]),
-            ifc_file.createIfcDirection([0.0, 0.0, 1.0]),
-            ifc_file.createIfcDirection([1.0, 0.0, 0.0])
-        ),
+        pool.axis3d(),
         None
     )
     
@@ -104,11 +456,7 @@ def createIFC(data_path, target_path):
     # Create site
     site_placement = ifc_file.createIfcLocalPlacement(
         None,  # Parent placement (None = global)
-            ifc_file.createIfcAxis2Placement3D(
-                ifc_file.createIfcCartesianPoint([0.0, 0.0, 0.0]),
-                ifc_file.createIfcDirection([0.0, 0.0, 1.0]),
-                ifc_file.createIfcDirection([1.0, 0.0, 0.0])
-            )
+        pool.axis3d()
     )
     
     # Create site - try correct parameter order
@@ -132,11 +480,7 @@ def createIFC(data_path, target_path):
     # Create building
     building_placement = ifc_file.createIfcLocalPlacement(
         site.ObjectPlacement,
-            ifc_file.createIfcAxis2Placement3D(
-                ifc_file.createIfcCartesianPoint([0.0, 0.0, 0.0]),
-                ifc_file.createIfcDirection([0.0, 0.0, 1.0]),
-                ifc_file.createIfcDirection([1.0, 0.0, 0.0])
-            )
+        pool.axis3d()
     )
     
     building = ifc_file.createIfcBuilding(
@@ -148,29 +492,28 @@ def createIFC(data_path, target_path):
         None, None, None
     )
     
-    # Create building storey
-    storey_placement = ifc_file.createIfcLocalPlacement(
-        building.ObjectPlacement,
-            ifc_file.createIfcAxis2Placement3D(
-                ifc_file.createIfcCartesianPoint([0.0, 0.0, 0.0]),
-                ifc_file.createIfcDirection([0.0, 0.0, 1.0]),
-                ifc_file.createIfcDirection([1.0, 0.0, 0.0])
-            )
-    )
-    
-    # IfcBuildingStorey has 10 attributes
-    storey = ifc_file.createIfcBuildingStorey(
-        ifcopenshell.guid.new(),  # 1 GlobalId
-        owner_history,            # 2 OwnerHistory
-        "Ground Floor",           # 3 Name
-        None,                     # 4 Description
-        None,                     # 5 ObjectType
-        storey_placement,         # 6 ObjectPlacement
-        None,                     # 7 Representation
-        None,                     # 8 LongName
-        None,                     # 9 CompositionType
-        0.0                       # 10 Elevation
-    )
+    # Create building storeys, placed at their elevation
+    building_storeys = []
+    for name, elevation in storeys:
+        storey_placement = ifc_file.createIfcLocalPlacement(
+            building.ObjectPlacement,
+            pool.axis3d((0.0, 0.0, float(elevation)))
+        )
+        
+        # IfcBuildingStorey has 10 attributes
+        storey = ifc_file.createIfcBuildingStorey(
+            ifcopenshell.guid.new(),  # 1 GlobalId
+            owner_history,            # 2 OwnerHistory
+            name,                     # 3 Name
+            None,                     # 4 Description
+            None,                     # 5 ObjectType
+            storey_placement,         # 6 ObjectPlacement
+            None,                     # 7 Representation
+            None,                     # 8 LongName
+            None,                     # 9 CompositionType
+            float(elevation)          # 10 Elevation
+        )
+        building_storeys.append(storey)
     
     # CRITICAL: Add spatial hierarchy relationships (IFCRELAGGREGATES)
     # These link Project → Site → Building → BuildingStorey
@@ -194,122 +537,121 @@ def createIFC(data_path, target_path):
         [building]
     )
     
-    # Building aggregates BuildingStorey
+    # Building aggregates BuildingStoreys
     ifc_file.createIfcRelAggregates(
         ifcopenshell.guid.new(),
         owner_history,
         None, None,
         building,
-        [storey]
+        building_storeys
     )
     
-    # Collect all elements to link to storey
-    all_elements = []
+    return {
+        "owner_history": owner_history,
+        "project": project,
+        "body_context": body_context,
+        "site": site,
+        "building": building,
+        "storeys": building_storeys,
+    }
+
+
+def create_plan_elements(ifc_file, pool, data_path, hierarchy, storey, prefix=""):
+    """
+    Create walls, floor slab and spaces of one generated plan
+    Elements are yielded as soon as they are created so callers can write them out
+    @Param ifc_file: ifcopenshell file
+    @Param pool: IfcEntityPool of ifc_file
+    @Param data_path: Path to data directory (e.g., "Data/0/")
+    @Param hierarchy: dict from create_spatial_hierarchy
+    @Param storey: IfcBuildingStorey the elements are placed on
+    @Param prefix: prepended to element names
+    @Return generator of IfcWallStandardCase, IfcSlab and IfcSpace elements
+    """
+    # Read geometry data
+    def read_from_file(file_path):
+        with open(file_path + '.txt', 'r') as f:
+            return json.loads(f.read())
+    
+    # Read transform
+    transform = read_from_file(data_path + "transform")
+    position = transform.get("position", [0, 0, 0])
+    
+    owner_history = hierarchy["owner_history"]
+    body_context = hierarchy["body_context"]
     
     # Read wall data
     try:
         wall_verts = read_from_file(data_path + "wall_verts")
-        wall_faces = read_from_file(data_path + "wall_faces")
+        
+        # Compute placement and extrusion data of every wall face in one pass
+        segments, segment_ids = get_wall_segments(wall_verts, position)
+        geometry = get_wall_geometry(segments)
+        
+        origins = segments[:, 0].tolist()
+        directions = geometry["direction"].tolist()
+        lengths = geometry["length"].tolist()
+        heights = geometry["height"].tolist()
         
         # Create walls
-        for wall_idx, wall_segments in enumerate(wall_verts):
-            for segment_idx, segment in enumerate(wall_segments):
-                if len(segment) >= 4:
-                    # Extract points from segment (4 vertices per wall face)
-                    points = []
-                    for vert in segment:
-                        if isinstance(vert, list) and len(vert) >= 3:
-                            # Apply position offset
-                            points.append([
-                                vert[0] + position[0],
-                                vert[1] + position[1],
-                                vert[2] + position[2]
-                            ])
-                    
-                    if len(points) >= 4:
-                        # Calculate wall direction for proper orientation
-                        p_bottom_start = points[0]
-                        p_bottom_end = points[2]
-                        wall_dir_x = p_bottom_end[0] - p_bottom_start[0]
-                        wall_dir_y = p_bottom_end[1] - p_bottom_start[1]
-                        dir_length_xy = np.sqrt(wall_dir_x**2 + wall_dir_y**2)
-                        
-                        if dir_length_xy > 0.001:
-                            wall_dir_x /= dir_length_xy
-                            wall_dir_y /= dir_length_xy
-                        else:
-                            wall_dir_x, wall_dir_y = 1.0, 0.0
-                        
-                        # Create wall placement with rotation to match wall direction
-                        # The RefDirection should point along the wall length direction
-                        wall_placement = ifc_file.createIfcLocalPlacement(
-                            storey.ObjectPlacement,
-                            ifc_file.createIfcAxis2Placement3D(
-                                ifc_file.createIfcCartesianPoint([float(points[0][0]), float(points[0][1]), float(points[0][2])]),
-                                ifc_file.createIfcDirection([0.0, 0.0, 1.0]),  # Z up
-                                ifc_file.createIfcDirection([float(wall_dir_x), float(wall_dir_y), 0.0])  # Wall direction
-                            )
-                        )
-                        
-                        # Create wall using IfcWallStandardCase
-                        wall = ifc_file.createIfcWallStandardCase(
-                            ifcopenshell.guid.new(),
-                            owner_history,
-                            f"Wall_{wall_idx}_{segment_idx}",
-                            None, None,
-                            wall_placement,
-                            None,
-                            None
-                        )
-                        
-                        # Create shape representation for wall (use Body context for web viewers)
-                        wall_shape = create_wall_shape(ifc_file, points, body_context)
-                        if wall_shape:
-                            wall.Representation = ifc_file.createIfcProductDefinitionShape(
-                                None, None, [wall_shape]
-                            )
-                        else:
-                            print(f"Warning: Failed to create shape for Wall_{wall_idx}_{segment_idx}")
-                            continue  # Skip this wall if shape creation failed
-                        
-                        all_elements.append(wall)
+        for i, (wall_idx, segment_idx) in enumerate(segment_ids.tolist()):
+            wall_dir_x, wall_dir_y = directions[i]
+            
+            # Create wall placement with rotation to match wall direction
+            # The RefDirection should point along the wall length direction
+            wall_placement = ifc_file.createIfcLocalPlacement(
+                storey.ObjectPlacement,
+                pool.axis3d(
+                    origins[i],
+                    (0.0, 0.0, 1.0),  # Z up
+                    (wall_dir_x, wall_dir_y, 0.0)  # Wall direction
+                )
+            )
+            
+            # Create wall using IfcWallStandardCase
+            wall = ifc_file.createIfcWallStandardCase(
+                ifcopenshell.guid.new(),
+                owner_history,
+                f"{prefix}Wall_{wall_idx}_{segment_idx}",
+                None, None,
+                wall_placement,
+                None,
+                None
+            )
+            
+            # Create shape representation for wall (use Body context for web viewers)
+            wall_shape = create_wall_box_shape(ifc_file, lengths[i], heights[i], body_context, pool)
+            if wall_shape:
+                wall.Representation = ifc_file.createIfcProductDefinitionShape(
+                    None, None, [wall_shape]
+                )
+            else:
+                print(f"Warning: Failed to create shape for Wall_{wall_idx}_{segment_idx}")
+                continue  # Skip this wall if shape creation failed
+            
+            yield wall
     except Exception as e:
         print(f"Warning: Could not create walls: {e}")
     
-    # Get Body context for web viewers (defined once, used for all shapes)
-    body_context = [ctx for ctx in project.RepresentationContexts if hasattr(ctx, 'ContextIdentifier') and ctx.ContextIdentifier == "Body"][0]
-    
     # Read floor data
     try:
         floor_verts = read_from_file(data_path + "floor_verts")
-        floor_faces = read_from_file(data_path + "floor_faces")
         
         # Create floor slab
         if floor_verts:
             # Flatten floor vertices
-            floor_points = []
-            for vert in floor_verts:
-                if isinstance(vert, list) and len(vert) >= 3:
-                    floor_points.append([
-                        vert[0] + position[0],
-                        vert[1] + position[1],
-                        vert[2] + position[2]
-                    ])
+            floor_points = get_points(floor_verts, position)
             
-            if floor_points:
+            if len(floor_points):
                 slab_placement = ifc_file.createIfcLocalPlacement(
                     storey.ObjectPlacement,
-            ifc_file.createIfcAxis2Placement3D(
-                ifc_file.createIfcCartesianPoint([0.0, 0.0, 0.0]),
-                ifc_file.createIfcDirection([0.0, 0.0, 1.0]),
-                ifc_file.createIfcDirection([1.0, 0.0, 0.0])
-            )
+                    pool.axis3d()
                 )
                 
                 slab = ifc_file.createIfcSlab(
                     ifcopenshell.guid.new(),
                     owner_history,
-                    "Floor",
+                    f"{prefix}Floor",
                     None, None,
                     slab_placement,
                     None,
@@ -317,49 +659,37 @@ def createIFC(data_path, target_path):
                 )
                 
                 # Create floor shape (use Body context for web viewers)
-                floor_shape = create_floor_shape(ifc_file, floor_points, body_context)
+                floor_shape = create_floor_shape(ifc_file, floor_points, body_context, pool)
                 if floor_shape:
                     slab.Representation = ifc_file.createIfcProductDefinitionShape(
                         None, None, [floor_shape]
                     )
                 
-                all_elements.append(slab)
+                yield slab
     except Exception as e:
         print(f"Warning: Could not create floor: {e}")
     
     # Read room data
     try:
         rooms_verts = read_from_file(data_path + "rooms_verts")
-        rooms_faces = read_from_file(data_path + "rooms_faces")
         
         # Create spaces (rooms)
         for room_idx, room_verts in enumerate(rooms_verts):
             if room_verts:
                 # Extract room boundary points
-                room_points = []
-                for vert in room_verts:
-                    if isinstance(vert, list) and len(vert) >= 3:
-                        room_points.append([
-                            vert[0] + position[0],
-                            vert[1] + position[1],
-                            vert[2] + position[2]
-                        ])
+                room_points = get_points(room_verts, position)
                 
-                if room_points:
+                if len(room_points):
                     space_placement = ifc_file.createIfcLocalPlacement(
                         storey.ObjectPlacement,
-                        ifc_file.createIfcAxis2Placement3D(
-                            ifc_file.createIfcCartesianPoint([float(room_points[0][0]), float(room_points[0][1]), float(room_points[0][2])]),
-                            ifc_file.createIfcDirection([0.0, 0.0, 1.0]),
-                            ifc_file.createIfcDirection([1.0, 0.0, 0.0])
-                        )
+                        pool.axis3d(room_points[0][:3])
                     )
                     
                     # IfcSpace has 11 attributes - PredefinedType enum: INTERNAL, EXTERNAL, or None
                     space = ifc_file.createIfcSpace(
                         ifcopenshell.guid.new(),  # 1 GlobalId
                         owner_history,            # 2 OwnerHistory
-                        f"Room_{room_idx}",       # 3 Name
+                        f"{prefix}Room_{room_idx}",  # 3 Name
                         None,                     # 4 Description
                         None,                     # 5 ObjectType
                         space_placement,          # 6 ObjectPlacement
@@ -371,112 +701,128 @@ def createIFC(data_path, target_path):
                     )
                     
                     # Create space shape
-                    space_shape = create_space_shape(ifc_file, room_points, body_context)
+                    space_shape = create_space_shape(ifc_file, room_points, body_context, pool)
                     if space_shape:
                         space.Representation = ifc_file.createIfcProductDefinitionShape(
                             None, None, [space_shape]
                         )
                     
-                    all_elements.append(space)
+                    yield space
     except Exception as e:
         print(f"Warning: Could not create rooms: {e}")
+
+
+def get_points(verts, position=(0, 0, 0)):
+    """
+    Convert a list of vertices to an (N, 3) array
+    Entries that are not [x, y, z, ...] lists are skipped.
+    @Param verts: list of vertices as read from a data file
+    @Param position: offset added to every vertex
+    @Return (N, 3) float array
+    """
+    points = [vert[:3] for vert in verts if isinstance(vert, list) and len(vert) >= 3]
+    if not points:
+        return np.empty((0, 3))
+    return np.asarray(points, dtype=float) + np.asarray(position[:3], dtype=float)
+
+
+def get_wall_segments(wall_verts, position=(0, 0, 0)):
+    """
+    Collect all wall faces into one array
+    Faces are [bottom_start, top_start, bottom_end, top_end] as written by
+    transform.create_nx4_verts_and_faces, faces with less than 4 vertices are skipped.
+    @Param wall_verts: wall data [[face, face, ...], ...] as read from wall_verts.txt
+    @Param position: offset added to every vertex
+    @Return segments as (N, 4, 3) array, (N, 2) array of (wall index, face index)
+    """
+    segments = []
+    segment_ids = []
+    for wall_idx, wall_segments in enumerate(wall_verts):
+        try:
+            # Regular walls convert directly: (faces, vertices, xyz)
+            faces = np.asarray(wall_segments, dtype=float)
+            regular = faces.ndim == 3 and faces.shape[1] >= 4 and faces.shape[2] >= 3
+        except ValueError:
+            regular = False
+        
+        if regular:
+            segments.append(faces[:, :4, :3])
+            segment_ids.extend((wall_idx, segment_idx) for segment_idx in range(len(faces)))
+            continue
+        
+        for segment_idx, segment in enumerate(wall_segments):
+            points = get_points(segment)
+            if len(points) >= 4:
+                segments.append(points[None, :4])
+                segment_ids.append((wall_idx, segment_idx))
     
-    # Link all elements to storey
-    if all_elements:
-        ifc_file.createIfcRelContainedInSpatialStructure(
-            ifcopenshell.guid.new(),
-            owner_history,
-            None, None,
-            all_elements,
-            storey
-        )
-    
-    # Write IFC file - always use project directory
-    # Remove leading slash if present and create in current directory
-    clean_path = target_path.lstrip('/')
-    if not clean_path:
-        clean_path = "floorplan"
-    output_path = os.path.join(os.getcwd(), clean_path + ".ifc")
-    
-    # Ensure directory exists
-    output_dir = os.path.dirname(output_path)
-    if output_dir and not os.path.exists(output_dir):
-        os.makedirs(output_dir, exist_ok=True)
+    if not segments:
+        return np.empty((0, 4, 3)), np.empty((0, 2), dtype=int)
     
-    ifc_file.write(output_path)
-    print(f"Created IFC file at {output_path}")
+    segments = np.concatenate(segments, axis=0) + np.asarray(position[:3], dtype=float)
+    return segments, np.asarray(segment_ids, dtype=int)
+
+
+def get_wall_geometry(segments):
+    """
+    Calculate placement and extrusion data of all wall faces at once
+    @Param segments: (N, 4, 3) array from get_wall_segments
+    @Return dict of arrays: length (N,), height (N,), direction (N, 2) unit vector in XY
+    """
+    # Points format: [bottom_left, top_left, bottom_right, top_right]
+    p_bottom_start = segments[:, 0]
+    p_top_start = segments[:, 1]
+    p_bottom_end = segments[:, 2]
+    
+    # Wall length (distance between bottom corners)
+    delta = p_bottom_end - p_bottom_start
+    length = np.sqrt((delta ** 2).sum(axis=1))
+    
+    # Wall height (difference in Z between bottom and top), 1.0 for flat faces
+    height = np.abs(p_top_start[:, 2] - p_bottom_start[:, 2])
+    height[height <= 0.01] = 1.0
+    
+    # Wall direction in XY plane, X axis for faces without horizontal extent
+    dir_length_xy = np.sqrt(delta[:, 0] ** 2 + delta[:, 1] ** 2)
+    direction = np.tile([1.0, 0.0], (len(segments), 1))
+    valid = dir_length_xy > 0.001
+    direction[valid] = delta[valid, :2] / dir_length_xy[valid, None]
+    
+    return {"length": length, "height": height, "direction": direction}
 
 
-def create_wall_shape(ifc_file, points, context):
+def create_wall_shape(ifc_file, points, context, pool=None):
     """Create shape representation for a wall segment"""
     if len(points) < 4:
         return None
     
+    geometry = get_wall_geometry(np.asarray([points[:4]], dtype=float)[:, :, :3])
+    return create_wall_box_shape(ifc_file, geometry["length"][0], geometry["height"][0], context, pool)
+
+
+def create_wall_box_shape(ifc_file, length, height, context, pool=None, width=0.3):
+    """Create shape representation for a wall of known length and height"""
+    if pool is None:
+        pool = IfcEntityPool(ifc_file, enabled=False)
+    
     try:
-        # Points format: [bottom_left, top_left, bottom_right, top_right]
-        p_bottom_start = points[0]  # Bottom left
-        p_bottom_end = points[2]    # Bottom right
-        p_top_start = points[1]     # Top left
-        
-        # Calculate wall length (distance between bottom corners)
-        length = np.sqrt((p_bottom_end[0] - p_bottom_start[0])**2 + 
-                        (p_bottom_end[1] - p_bottom_start[1])**2 + 
-                        (p_bottom_end[2] - p_bottom_start[2])**2)
-        
-        # Calculate wall height (difference in Z between bottom and top)
-        height = abs(p_top_start[2] - p_bottom_start[2]) if abs(p_top_start[2] - p_bottom_start[2]) > 0.01 else 1.0
-        
-        width = 0.3  # Default wall thickness (increased for better visibility)
-        
-        # Calculate wall direction in XY plane (for orientation)
-        wall_dir_x = p_bottom_end[0] - p_bottom_start[0]
-        wall_dir_y = p_bottom_end[1] - p_bottom_start[1]
-        dir_length_xy = np.sqrt(wall_dir_x**2 + wall_dir_y**2)
-        
-        if dir_length_xy > 0.001:
-            # Normalize XY direction
-            wall_dir_x /= dir_length_xy
-            wall_dir_y /= dir_length_xy
-        else:
-            wall_dir_x, wall_dir_y = 1.0, 0.0
-        
         # Create wall using standard orientation: profile in X-Y plane, extrude along Z
-        # Profile: length × thickness in X-Y plane
-        # Then we'll rotate it to match wall direction using placement
-        
-        profile = ifc_file.createIfcRectangleProfileDef(
-            "AREA", None,
-            ifc_file.createIfcAxis2Placement2D(
-                ifc_file.createIfcCartesianPoint([0.0, 0.0]),
-                None
-            ),
-            length,  # XDim: wall length
-            width    # YDim: wall thickness
-        )
-        
-        # Position: profile in X-Y plane
-        # Standard orientation: Axis = Z (up), RefDirection = X (forward)
-        # Profile XDim → X, Profile YDim → Y, then extrude along Z
-        # The wall placement will handle the rotation/positioning
-        position = ifc_file.createIfcAxis2Placement3D(
-            ifc_file.createIfcCartesianPoint([0.0, 0.0, 0.0]),
-            ifc_file.createIfcDirection([0.0, 0.0, 1.0]),  # Z up
-            ifc_file.createIfcDirection([1.0, 0.0, 0.0])   # X forward (standard)
-        )
-        
-        # Extrude along Z for wall height
-        swept_solid = ifc_file.createIfcExtrudedAreaSolid(
-            profile,
-            position,
-            ifc_file.createIfcDirection([0.0, 0.0, 1.0]),  # Extrude along Z
-            height  # Extrusion depth = wall height
-        )
+        # Profile: length × thickness (width) in X-Y plane, extruded along Z for wall height
+        # The wall placement handles the rotation/positioning, so every wall with the
+        # same length, thickness and height is an instance of one shared box
+        if pool.enabled:
+            return ifc_file.createIfcShapeRepresentation(
+                context,
+                "Body",
+                "MappedRepresentation",
+                [pool.mapped_item(context, length, width, height)]
+            )
         
         return ifc_file.createIfcShapeRepresentation(
             context,
             "Body",
             "SweptSolid",
-            [swept_solid]
+            [pool.extrusion(length, width, height)]
         )
     except Exception as e:
         print(f"Warning: Could not create wall shape: {e}")
@@ -485,11 +831,14 @@ def create_wall_shape(ifc_file, points, context):
         return None
 
 
-def create_floor_shape(ifc_file, points, context):
+def create_floor_shape(ifc_file, points, context, pool=None):
     """Create shape representation for floor"""
     if len(points) < 3:
         return None
     
+    if pool is None:
+        pool = IfcEntityPool(ifc_file, enabled=False)
+    
     try:
         # Get bounding box
         bbox = get_bounding_box(points)
@@ -499,24 +848,7 @@ def create_floor_shape(ifc_file, points, context):
         height = 0.1  # Thin floor slab
         
         # Create extruded area solid (rectangle profile)
-        swept_solid = ifc_file.createIfcExtrudedAreaSolid(
-            ifc_file.createIfcRectangleProfileDef(
-                "AREA", None,
-                ifc_file.createIfcAxis2Placement2D(
-                    ifc_file.createIfcCartesianPoint([0.0, 0.0]),
-                    None  # RefDirection (optional)
-                ),
-                width,
-                depth
-            ),
-            ifc_file.createIfcAxis2Placement3D(
-                ifc_file.createIfcCartesianPoint([float(bbox[0][0]), float(bbox[0][1]), float(min_z)]),
-                ifc_file.createIfcDirection([0.0, 0.0, 1.0]),
-                ifc_file.createIfcDirection([1.0, 0.0, 0.0])
-            ),
-            ifc_file.createIfcDirection([0.0, 0.0, 1.0]),
-            height
-        )
+        swept_solid = pool.extrusion(width, depth, height, (bbox[0][0], bbox[0][1], min_z))
         
         return ifc_file.createIfcShapeRepresentation(
             context,
@@ -529,11 +861,14 @@ def create_floor_shape(ifc_file, points, context):
         return None
 
 
-def create_space_shape(ifc_file, points, context):
+def create_space_shape(ifc_file, points, context, pool=None):
     """Create shape representation for a space (room)"""
     if len(points) < 3:
         return None
     
+    if pool is None:
+        pool = IfcEntityPool(ifc_file, enabled=False)
+    
     try:
         # Create a simple box representation for the space
         bbox = get_bounding_box(points)
@@ -542,24 +877,7 @@ def create_space_shape(ifc_file, points, context):
         min_z = bbox[0][2]
         height = 2.5  # Default ceiling height
         
-        swept_solid = ifc_file.createIfcExtrudedAreaSolid(
-            ifc_file.createIfcRectangleProfileDef(
-                "AREA", None,
-                ifc_file.createIfcAxis2Placement2D(
-                    ifc_file.createIfcCartesianPoint([0.0, 0.0]),
-                    None  # RefDirection (optional)
-                ),
-                width,
-                depth
-            ),
-            ifc_file.createIfcAxis2Placement3D(
-                ifc_file.createIfcCartesianPoint([float(bbox[0][0]), float(bbox[0][1]), float(min_z)]),
-                ifc_file.createIfcDirection([0.0, 0.0, 1.0]),
-                ifc_file.createIfcDirection([1.0, 0.0, 0.0])
-            ),
-            ifc_file.createIfcDirection([0.0, 0.0, 1.0]),
-            height
-        )
+        swept_solid = pool.extrusion(width, depth, height, (bbox[0][0], bbox[0][1], min_z))
         
         return ifc_file.createIfcShapeRepresentation(
             context,
@@ -574,22 +892,22 @@ def create_space_shape(ifc_file, points, context):
 
 def get_bounding_box(points):
     """Calculate bounding box of points"""
-    if not points:
+    if len(points) == 0:
         return [[0, 0, 0], [1, 1, 1]]
     
-    min_coords = [float('inf'), float('inf'), float('inf')]
-    max_coords = [float('-inf'), float('-inf'), float('-inf')]
-    
-    for p in points:
-        if len(p) >= 3:
-            min_coords[0] = min(min_coords[0], p[0])
-            min_coords[1] = min(min_coords[1], p[1])
-            min_coords[2] = min(min_coords[2], p[2])
-            max_coords[0] = max(max_coords[0], p[0])
-            max_coords[1] = max(max_coords[1], p[1])
-            max_coords[2] = max(max_coords[2], p[2])
-    
-    return [min_coords, max_coords]
+    points = np.asarray(points, dtype=float)[:, :3]
+    return [points.min(axis=0).tolist(), points.max(axis=0).tolist()]
+
+
+def get_result_cache():
+    """
+    Result cache configured in config.result_cache
+    @Return utils.result_cache.ResultCache or None
+    """
+    if not config.result_cache:
+        return None
+    from utils.result_cache import ResultCache
+    return ResultCache(**config.result_cache)
 
 
 def createFloorPlanIFC(image_path=config.image_path, target_path=config.target_path, SR_Check=True):
@@ -597,16 +915,50 @@ def createFloorPlanIFC(image_path=config.image_path, target_path=config.target_p
     Main function to create IFC file from floorplan image
     @Param image_path: Path to input floorplan image
     @Param target_path: Output IFC file path (without extension)
-    @Param SR_Check: Whether to use super-resolution
+    @Param SR_Check: Whether to use super-resolution, adaptive when config.SR_policy is set
     """
-    SR = [config.SR_scale, config.SR_method]
+    SR = [config.SR_scale, config.SR_method] if SR_Check else None
     CubiCasa = config.CubiCasa
     
     # Generate geometry data files
-    data_path = execution.simple_single(image_path, CubiCasa, SR)
+    data_path = execution.simple_single(image_path, True, CubiCasa=CubiCasa, SR=SR, SR_policy=config.SR_policy,
+                                        cache=get_result_cache())
     
     # Create IFC file from data
     createIFC(data_path, target_path)
     
     print(f"Created IFC file at {target_path}.ifc")
 
+
+def createBuildingIFC(floors, target_path=config.target_path, SR_Check=True, processes=None, stream=False,
+                      share_entities=True, flush_every=1000, pool_limit=100000):
+    """
+    Create one IFC file with a storey per floorplan image
+    Detection runs for all floors at once in a process pool (see
+    execution.multiple_parallel), the storeys share one entity pool.
+    Call from a script with a if __name__ == "__main__" guard.
+    @Param floors: list of (image path, elevation in meters), e.g. [("Images/ground.png", 0.0), ("Images/first.png", 3.0)]
+    @Param target_path: Output IFC file path (without extension)
+    @Param SR_Check: Whether to use super-resolution, adaptive when config.SR_policy is set
+    @Param processes: Number of detection processes, default number of cores
+    @Param stream: Write elements to disk while they are created, see createIFC
+    @Param share_entities: Reuse identical geometric primitives, see IfcEntityPool
+    @Param flush_every: Number of elements between two writes when streaming
+    @Param pool_limit: Maximum number of pooled primitives kept when streaming
+    """
+    SR = [config.SR_scale, config.SR_method] if SR_Check else None
+    CubiCasa = config.CubiCasa
+    
+    # Generate geometry data files of all floors in parallel
+    image_paths = [image_path for image_path, _ in floors]
+    data_paths = execution.multiple_parallel(image_paths, False, CubiCasa=CubiCasa, SR=SR, processes=processes,
+                                             SR_policy=config.SR_policy, cache=get_result_cache())
+    
+    # One storey per floor, ordered as given
+    storeys = []
+    for floor_idx, ((_, elevation), data_path) in enumerate(zip(floors, data_paths)):
+        name = "Ground Floor" if floor_idx == 0 else f"Floor {floor_idx}"
+        storeys.append((name, elevation, [data_path]))
+    
+    createStoreysIFC(storeys, target_path, share_entities=share_entities, stream=stream,
+                     flush_every=flush_every, pool_limit=pool_limit)
@@ -10,7 +10,7 @@ from utils.FloorplanToBlenderLib import *
 # Other necessary libraries
 import numpy as np
 from torch.utils.data import DataLoader
-from utils.loaders import FloorplanSVG, DictToTensor, Compose, RotateNTurns
+from utils.loaders import FloorplanSVG, DictToTensor, Compose, RotateNTurns, get_loader, iter_samples
 
 def randomPixelAcc(data_path,number=100,seed=4):
     import torch
@@ -34,8 +34,7 @@ def randomPixelAcc(data_path,number=100,seed=4):
     fo = open(text, "w")
     textfile = []
     
-    for i in range(len(data_iter)):
-        val=next(data_iter)
+    for i, val in enumerate(data_iter):
         split = [21,12, 11]
         tens=m.get_evaluation_tensors(val, model, split)
         textfile.append("Image"+str(i)+": without post process--->"+str(m.pixel_accuracy(tens[0][1], tens[1][1]))+". With post process--->"+str(m.pixel_accuracy(tens[0][1], tens[2][1])))
@@ -50,40 +49,21 @@ def getfromCubiCasa(data_path,number,seed):
     
     # # Text file for DataLoader creation
 
-    cat=['high_quality_architectural','high_quality','colorful']
     # path to cubicasa dataset
     data_path = data_path
 
-    import re
-    import os
-    import numpy as np
-    import magic
-    import pandas as pd
-    import random
-    
-    sizes=[]
-    print(data_path)
-    for i in cat:
-        files=os.listdir(data_path+i)
-        for j in files:
-            main=os.listdir(data_path+i+'/'+j)
-            for k in main:
-                if k=='F1_original.png':
-                    t = magic.from_file(data_path+i+'/'+j+'/'+k)
-                    t = re.search('(\d+) x (\d+)', t).groups()
-                    t = [int(t[0]),int(t[1])]                                                                                                   
-                    sizes.append([t,data_path+'/'+i+'/'+j+'/'])
-    
-    sizes=pd.DataFrame(sizes)
+    from utils.loaders.dataset_index import load_index
 
-    points=np.array([[sizes[0][i][0],sizes[0][i][1],i] for i in range(5000) if sizes[0][i][0]<800 and sizes[0][i][1]<800])
+    print(data_path)
+    # Sizes come from the saved index, built from the png headers on first use
+    index = load_index(data_path)
+    points = index.filter(width_below=800, height_below=800)
 
-    random.seed(seed)
-    s = random.sample(range(len(points)), 100)
+    s = points.sample(number, seed)
 
     text = 'images.txt'
     fo = open(text, "w")
-    textfile = list(sizes[1][points[:,2][s]])
+    textfile = s.folders()
     for i in textfile:
         fo.write(i)
         fo.write('\n')
@@ -92,8 +72,9 @@ def getfromCubiCasa(data_path,number,seed):
     data_folder = ""
     data_file = text
     normal_set = FloorplanSVG(data_folder, data_file, format='txt', original_size=False)
-    data_loader = DataLoader(normal_set, batch_size=1, num_workers=0)
-    data_iter = iter(data_loader)
+    # Plans are parsed by all cores and batched, then handed out one by one
+    data_loader = get_loader(normal_set, batch_size=4)
+    data_iter = iter_samples(data_loader)
     
     return data_iter
 
@@ -127,57 +108,44 @@ from torch.utils.data import DataLoader
 from torch.utils.data import DataLoader
 from floortrans.loaders.house import House
 from floortrans.models import get_model
-from floortrans.loaders import FloorplanSVG, DictToTensor, Compose, RotateNTurns
+from floortrans.loaders import FloorplanSVG, DictToTensor, Compose, RotateNTurns, get_loader, iter_samples
 from floortrans.plotting import segmentation_plot, polygons_to_image, draw_junction_from_dict, discrete_cmap
 discrete_cmap()
 from floortrans.post_prosessing import split_prediction, get_polygons, split_validation
 from mpl_toolkits.axes_grid1 import AxesGrid
+from utils.evaluation import Evaluation
 import time
 
-room_classes = ["Background", "Outdoor", "Wall", "Kitchen", "Living Room" ,"Bed Room", "Bath",
-                "Entry", "Railing", "Storage", "Garage", "Undefined"]
-icon_classes = ["No Icon", "Window", "Door", "Closet", "Electrical Applience" ,"Toilet", "Sink",
-                "Sauna Bench", "Fire Place", "Bathtub", "Chimney"]
-
 
 
 Path_pb = ["EDSR_x2.pb","ESPCN_x2.pb","LapSRN_x2.pb","FSRCNN_x2.pb"]
 meth = ["edsr","espcn","lapsrn","fsrcnn"] 
-checkpoint = [False,False,False,False]
-checkcount = [0,0,0,0]
 order = [2,3]
 
 for j in order:
     data_folder = '/home/ubuntu/2Dto3D/CubiCasa5k/data/cubicasa5k/'
     data_file = text
     normal_set = FloorplanSVG(data_folder, data_file, format='txt', original_size=True)
-    data_loader = DataLoader(normal_set, batch_size=1, num_workers=0)
-    data_iter = iter(data_loader)
-    reports = []
+    data_loader = get_loader(normal_set, batch_size=4)
+    data_iter = iter_samples(data_loader)
+    # Confusion matrices of every plan are appended to the summary file, an
+    # interrupted run continues with the plans that are not in it
+    evaluation = Evaluation("reports_"+meth[j]+"_100_Labels.jsonl")
         
     print(meth[j] +" has begun")
     st_j = time.time()
     
     count = 0
     failures = []
-    length = len(data_loader)
- 
-    if checkpoint[j]==True:
-        
-        file_name = "reports_"+meth[j]+"_100_Labels.pkl"
-        open_file = open(file_name, "rb")
-        reports = pickle.load(open_file)
-        open_file.close()
-        
-        length = 100 - checkcount[j]
-        for i in range(checkcount[j]):
-            val = next(data_iter)
-        count = checkcount[j]
+    length = len(normal_set)
         
     for i in range(length):
         val = next(data_iter)
         junctions = val['heatmaps']
         folder = val['folder'][0]
+        if evaluation.is_done(folder, False) and evaluation.is_done(folder, True):
+            count = count + 1
+            continue
         image = val['image'].cuda()
 
         st = time.time()
@@ -202,6 +170,9 @@ for j in order:
         resized = cv.resize(np.moveaxis(image[0].cpu().data.numpy(), 0, -1)/ 2 + 0.5,dsize=None,fx=2,fy=2)
         count = count + 1
         for sr in [False,True]:
+            # Groups of a plan are evaluated once, also when a run is resumed
+            if evaluation.is_done(folder, sr):
+                continue
             # CubiCasa
             (resized - 0.5)*2
             rot = RotateNTurns()
@@ -269,48 +240,13 @@ for j in order:
                 failures.append(count)
                 continue
 
-            from sklearn import metrics
-            import pandas as pd
-            # Flatten the pixels of the predicted and ground truth label images
-            y_true = label_np[0].flatten()
-            y_pred = pol_room_seg.flatten()
-
-            room_labels = [0,1,2,3,4,5,6,7,8,9,10,11]
-            cm_r = pd.DataFrame(metrics.confusion_matrix(y_true, y_pred,labels=room_labels),columns=room_classes)
-
-            # Print the precision and recall, among other metrics
-            cr = metrics.classification_report(y_true, y_pred,labels=room_labels,target_names=room_classes,zero_division=1,output_dict=True)
-            cr_r = pd.DataFrame(cr)
-
-            from sklearn import metrics
-            import pandas as pd
-
-            # Flatten the pixels of the predicted and ground truth label images
-            y_true = label_np[1].flatten()
-            y_pred = pol_icon_seg.flatten()
-
-            icon_labels = [0,1,2,3,4,5,6,7,8,9,10]
-            cm_i = pd.DataFrame(metrics.confusion_matrix(y_true, y_pred,labels=icon_labels),columns=icon_classes)
-
-            # Print the precision and recall, among other metrics
-            cr = metrics.classification_report(y_true, y_pred,labels=icon_labels,target_names=icon_classes,zero_division=1,output_dict=True)
-            cr_i = pd.DataFrame(cr)
-            reports.append([count, sr, label_np[0],label_np[1],pol_room_seg,pol_icon_seg])
-
-            file_name = "reports_"+meth[j]+"_100_Labels.pkl"
-
-
-            open_file = open(file_name, "wb")
-            pickle.dump(reports, open_file)
-            open_file.close()
+            # Confusion matrices of the plan, the scores are computed from their sums
+            evaluation.add(folder, label_np[0], pol_room_seg, label_np[1], pol_icon_seg, group=sr, count=count)
         print("ITER"+str(count)+": TimeElapsed---->",time.time()-st)
 
-    file_name = "reports_"+meth[j]+"_100_Labels.pkl"
-
-
-    open_file = open(file_name, "wb")
-    pickle.dump(reports, open_file)
-    open_file.close()
+    for sr in [False,True]:
+        print(meth[j] + (" super resolution" if sr else " original"))
+        print(evaluation.report(sr))
 
     file_name = "failure_"+meth[j]+"_100_Labels.pkl"
 
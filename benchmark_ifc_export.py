@@ -0,0 +1,46 @@
+"""
+Benchmark IFC export with and without shared geometric entities
+Exports every sample plan in Data/ twice and reports file size and write time
+"""
+import os
+import shutil
+import time
+import FloorplanToIFC as ifc
+
+
+def benchmark_ifc_export(data_root="Data/", output_dir="ifc_benchmark", repeats=5):
+    """
+    Measure file size and export time of createIFC on the sample plans
+    @Param data_root: Directory holding generated plan data (Data/0/, Data/1/, ...)
+    @Param output_dir: Temporary output directory (relative to working directory)
+    @Param repeats: Number of exports per plan and mode, fastest one is reported
+    @Return list of (plan, mode, size in bytes, seconds)
+    """
+    plans = sorted(d for d in os.listdir(data_root) if os.path.isdir(os.path.join(data_root, d)))
+    results = []
+    for plan in plans:
+        data_path = os.path.join(data_root, plan) + "/"
+        for share_entities in [False, True]:
+            mode = "shared" if share_entities else "unshared"
+            target = os.path.join(output_dir, plan + "_" + mode)
+            best = float("inf")
+            for _ in range(repeats):
+                start = time.perf_counter()
+                ifc.createIFC(data_path, target, share_entities=share_entities)
+                best = min(best, time.perf_counter() - start)
+            size = os.path.getsize(os.path.join(os.getcwd(), target + ".ifc"))
+            results.append((plan, mode, size, best))
+
+    shutil.rmtree(os.path.join(os.getcwd(), output_dir), ignore_errors=True)
+    return results
+
+
+if __name__ == "__main__":
+    results = benchmark_ifc_export()
+    print("\nplan  mode       size (bytes)  time (ms)")
+    for plan, mode, size, seconds in results:
+        print(f"{plan:<5} {mode:<10} {size:>12}  {seconds * 1000:>9.1f}")
+
+    unshared = sum(r[2] for r in results if r[1] == "unshared")
+    shared = sum(r[2] for r in results if r[1] == "shared")
+    print(f"\nTotal size: {unshared} -> {shared} bytes ({100.0 * (1 - shared / unshared):.1f}% smaller)")
@@ -0,0 +1,97 @@
+"""
+Benchmark CPU inference modes of hg_furukawa_original
+Runs every mode of model/inference_modes.py on the example images and reports
+time per image and agreement with the fp32 model through metrics.runningScore
+"""
+import time
+import cv2
+import numpy as np
+import torch
+from model import hg_furukawa_original
+from model.inference_modes import MODES, get_inference_model
+from utils.metrics import runningScore
+
+IMAGES = ["Images/example.png", "Images/example2.png", "Images/example3.png", "Images/example4.png"]
+
+
+def load_model(checkpoint="model_best_val_loss_var.pkl", n_classes=44):
+    """
+    Trained model on the CPU, same setup as generate.generate_all_files
+    @Param checkpoint: path of the trained weights
+    @Param n_classes: number of output channels
+    @Return model in eval mode
+    """
+    model = hg_furukawa_original(51)
+    model.conv4_ = torch.nn.Conv2d(256, n_classes, bias=True, kernel_size=1)
+    model.upsample = torch.nn.ConvTranspose2d(n_classes, n_classes, kernel_size=4, stride=4)
+    model.load_state_dict(torch.load(checkpoint, map_location="cpu")["model_state"])
+    return model.eval()
+
+
+def load_image(path):
+    """
+    Read an image as model input
+    @Param path: image path
+    @Return (1, 3, H, W) tensor normalised to [-1, 1]
+    """
+    img = cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2RGB)
+    img = 2 * (img / 255.0) - 1
+    return torch.tensor(np.moveaxis(img, -1, 0)[None].astype(np.float32))
+
+
+def compare_inference_modes(model, images, modes=MODES, split=[21, 12, 11], repeats=1):
+    """
+    Accuracy and speed of every inference mode against the fp32 model
+    Room and icon segmentations of each mode are scored with runningScore
+    using the fp32 segmentation as ground truth, heatmaps by their mean
+    absolute difference.
+    @Param model: trained hg_furukawa_original
+    @Param images: list of (1, 3, H, W) tensors, also used to calibrate int8_static
+    @Param modes: modes to compare
+    @Param split: heatmap, room and icon channel counts
+    @Param repeats: runs per image, the fastest is timed
+    @Return dict mode -> {seconds, heatmap_error, rooms, icons} with the
+            runningScore scores of rooms and icons
+    """
+    heatmap_end, rooms_end = split[0], split[0] + split[1]
+    with torch.no_grad():
+        reference = [model(img) for img in images]
+
+    report = {}
+    for mode in modes:
+        inference_model = get_inference_model(model, mode, calibration=images)
+        rooms_score, icons_score = runningScore(split[1]), runningScore(split[2])
+        heatmap_error, seconds = 0.0, 0.0
+
+        with torch.no_grad():
+            for img, ref in zip(images, reference):
+                best = float("inf")
+                for _ in range(repeats):
+                    start = time.perf_counter()
+                    pred = inference_model(img)
+                    best = min(best, time.perf_counter() - start)
+                seconds += best
+
+                heatmap_error += (pred[:, :heatmap_end] - ref[:, :heatmap_end]).abs().mean().item()
+                rooms_score.update(ref[:, heatmap_end:rooms_end].argmax(1).numpy(),
+                                   pred[:, heatmap_end:rooms_end].argmax(1).numpy())
+                icons_score.update(ref[:, rooms_end:].argmax(1).numpy(),
+                                   pred[:, rooms_end:].argmax(1).numpy())
+
+        report[mode] = {
+            "seconds": seconds / len(images),
+            "heatmap_error": heatmap_error / len(images),
+            "rooms": rooms_score.get_scores()[0],
+            "icons": icons_score.get_scores()[0],
+        }
+    return report
+
+
+if __name__ == "__main__":
+    report = compare_inference_modes(load_model(), [load_image(path) for path in IMAGES])
+
+    print("\nmode         time (s)  heatmap err  rooms acc  rooms mIoU  icons acc  icons mIoU")
+    for mode, r in report.items():
+        print(f"{mode:<12} {r['seconds']:>8.3f}  {r['heatmap_error']:>11.5f}  "
+              f"{r['rooms']['Overall Acc']:>9.4f}  {r['rooms']['Mean IoU']:>10.4f}  "
+              f"{r['icons']['Overall Acc']:>9.4f}  {r['icons']['Mean IoU']:>10.4f}")
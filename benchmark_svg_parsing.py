@@ -0,0 +1,80 @@
+'''
+Benchmark of SVG parsing
+Compares the full minidom DOM House used to read model.svg with the streaming
+iter_groups reader over the plans of a CubiCasa split: time and peak memory
+of reading the groups, and time of building the House.
+'''
+import time
+import tracemalloc
+from xml.dom import minidom
+import cv2
+from numpy import genfromtxt
+from utils.loaders.svg_utils import iter_groups
+from utils.loaders.house import House
+
+data_path = '/home/ubuntu/2Dto3D/CubiCasa5k/data/cubicasa5k/'
+split = 'val.txt'
+max_plans = None
+
+
+def read_minidom(path):
+    svg = minidom.parse(path)
+    count = 0
+    for e in svg.getElementsByTagName('g'):
+        class_name = e.getAttribute('class')
+        if (e.getAttribute('id') in ('Wall', 'Railing', 'Window', 'Door')
+                or 'FixedFurniture ' in class_name or 'Space ' in class_name):
+            count += 1
+    return count
+
+
+def read_stream(path):
+    return sum(1 for _ in iter_groups(path))
+
+
+def measure(func, path):
+    '''
+    Time and peak traced memory of a call
+    @Return result, seconds, peak bytes
+    '''
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(path)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def benchmark_svg_parsing(data_folder=data_path, data_file=split, max_plans=max_plans):
+    '''
+    Parse the plans of a split both ways
+    @Return dict reader -> total seconds, max peak bytes; House seconds
+    '''
+    folders = genfromtxt(data_folder + data_file, dtype='str').reshape(-1)[:max_plans]
+    results = {"minidom": [0.0, 0], "stream": [0.0, 0]}
+    house_seconds = 0.0
+    for folder in folders:
+        path = data_folder + folder + '/model.svg'
+        counts = []
+        for name, func in (("minidom", read_minidom), ("stream", read_stream)):
+            count, seconds, peak = measure(func, path)
+            counts.append(count)
+            results[name][0] += seconds
+            results[name][1] = max(results[name][1], peak)
+        assert counts[0] == counts[1], folder
+
+        height, width = cv2.imread(data_folder + folder + '/F1_scaled.png').shape[:2]
+        start = time.perf_counter()
+        House(path, height, width)
+        house_seconds += time.perf_counter() - start
+
+    return len(folders), results, house_seconds
+
+
+if __name__ == "__main__":
+    n, results, house_seconds = benchmark_svg_parsing()
+    print(f"{n} plans\n\nreader    time (s)  peak memory (MB)")
+    for name, (seconds, peak) in results.items():
+        print(f"{name:<8} {seconds:>9.3f}  {peak / 1024 ** 2:>16.2f}")
+    print(f"\nHouse with stream reader: {house_seconds:.3f} s, {house_seconds / max(n, 1) * 1000:.1f} ms per plan")
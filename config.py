@@ -9,4 +9,19 @@ blender_script_path = program_path+"/floorplan_to_3dObject_in_blender.py"
 SR_scale = 2
 SR_method = 'lapsrn'
 
+# Adaptive super-resolution (see utils/super_resolution.py choose_super_resolution)
+# None always applies SR_method, to enable it set the thresholds, e.g.
+# SR_policy = {"skip_thickness": 6.0, "bicubic_thickness": 4.0, "min_size": 768, "max_size": 2048}
+# Lines of at least skip_thickness px on images with a shorter side of min_size px skip SR,
+# lines of at least bicubic_thickness px use bicubic upsampling, thinner lines use SR_method,
+# images with a shorter side of max_size px are never upsampled
+SR_policy = None
+
+# On-disk cache of SR images, predictions and polygons (see utils/result_cache.py)
+# Converting the same image again with the same settings skips SR, inference and post-processing,
+# least recently used entries are removed above max_bytes. None always recomputes, to enable it
+# set a directory and size, e.g.
+# result_cache = {"cache_dir": program_path + "/cache/", "max_bytes": 2 * 1024 ** 3}
+result_cache = None
+
 CubiCasa = True
\ No newline at end of file
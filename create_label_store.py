@@ -0,0 +1,20 @@
+'''
+Create label stores
+Parses the House of every plan of the CubiCasa splits once and writes images,
+segmentation tensors and heatmap points to memory mapped stores, read with
+FloorplanSVG(data_path, split, format='memmap').
+'''
+import time
+from utils.loaders.label_store import build_label_store
+
+data_path = '/home/ubuntu/2Dto3D/CubiCasa5k/data/cubicasa5k/'
+splits = ['train.txt', 'val.txt', 'test.txt']
+# Evaluation uses F1_original sized plans
+original_size_splits = ['val.txt', 'test.txt']
+
+if __name__ == "__main__":
+    for split in splits:
+        for original_size in [False] + ([True] if split in original_size_splits else []):
+            start = time.perf_counter()
+            path = build_label_store(data_path, split, original_size=original_size, info=True)
+            print(f"{path} in {time.perf_counter() - start:.1f} s")
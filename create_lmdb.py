@@ -0,0 +1,17 @@
+'''
+Create LMDB
+Parses the House of every plan of the CubiCasa splits once and adds images,
+segmentation tensors and heatmap points to the cubi_lmdb/ database, read with
+FloorplanSVG(data_path, split, format='lmdb').
+'''
+import time
+from utils.loaders.lmdb_store import build_lmdb
+
+data_path = '/home/ubuntu/2Dto3D/CubiCasa5k/data/cubicasa5k/'
+splits = ['train.txt', 'val.txt', 'test.txt']
+
+if __name__ == "__main__":
+    for split in splits:
+        start = time.perf_counter()
+        path = build_lmdb(data_path, split, info=True)
+        print(f"{split} added to {path} in {time.perf_counter() - start:.1f} s")
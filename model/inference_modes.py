@@ -0,0 +1,171 @@
+import copy
+import warnings
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+from model.hg_furukawa_original import Residual
+
+'''
+Inference modes
+Faster CPU variants of a trained hg_furukawa_original, all built from a copy
+of the fp32 model:
+  fp32         unchanged model
+  fold_bn      BatchNorm layers that follow a convolution are folded into it
+  bf16         bfloat16 autocast, outputs are returned as float32
+  int8_weight  Residual convolutions keep int8 weights with per channel scales
+  int8_static  Residual blocks run quantized with int8 activations, needs calibration images
+Accuracy against fp32 is reported by benchmark_inference_modes.py.
+'''
+
+MODES = ["fp32", "fold_bn", "bf16", "int8_weight", "int8_static"]
+
+
+def get_inference_model(model, mode="fp32", calibration=None):
+    """
+    Build an inference variant of a model
+    @Param model: trained hg_furukawa_original
+    @Param mode: one of MODES
+    @Param calibration: list of (1, 3, H, W) images, needed by int8_static
+    @Return model in eval mode, the original model is not changed
+    """
+    if mode == "fp32":
+        return copy.deepcopy(model).eval()
+    if mode == "fold_bn":
+        return fold_batchnorm(model)
+    if mode == "bf16":
+        return BFloat16Model(copy.deepcopy(model))
+    if mode == "int8_weight":
+        return quantize_weights(fold_batchnorm(model))
+    if mode == "int8_static":
+        if not calibration:
+            raise ValueError("int8_static needs calibration images")
+        return quantize_static(model, calibration)
+    raise ValueError(f"Unknown inference mode {mode}, use one of {MODES}")
+
+
+def fold_batchnorm(model):
+    """
+    Fold BatchNorm layers into the convolutions in front of them
+    The pre-activation bn of a Residual block follows an addition, not a
+    convolution, and stays as it is.
+    @Param model: hg_furukawa_original
+    @Return folded copy in eval mode
+    """
+    model = copy.deepcopy(model).eval()
+
+    pairs = [(model, "conv1_", "bn1"), (model, "conv2_", "bn2"), (model, "conv3_", "bn3")]
+    for module in model.modules():
+        if isinstance(module, Residual):
+            pairs += [(module, "conv1", "bn1"), (module, "conv2", "bn2")]
+
+    for module, conv, bn in pairs:
+        setattr(module, conv, fuse_conv_bn_eval(getattr(module, conv), getattr(module, bn)))
+        setattr(module, bn, nn.Identity())
+    return model
+
+
+class BFloat16Model(nn.Module):
+    """
+    Runs a model under bfloat16 autocast on the CPU
+    @Param model: model to wrap
+    """
+
+    def __init__(self, model):
+        super(BFloat16Model, self).__init__()
+        self.model = model.eval()
+
+    def forward(self, x):
+        with torch.autocast("cpu", dtype=torch.bfloat16):
+            out = self.model(x)
+        return out.float()
+
+
+class Int8WeightConv2d(nn.Module):
+    """
+    Conv2d with int8 weights and one scale per output channel
+    Weights are dequantized on every forward, activations stay float. Quarters
+    the weight memory, which matters with one model per worker process.
+    @Param conv: nn.Conv2d to quantize
+    """
+
+    def __init__(self, conv):
+        super(Int8WeightConv2d, self).__init__()
+        weight = conv.weight.detach()
+        scale = weight.abs().amax(dim=(1, 2, 3), keepdim=True).clamp(min=1e-12) / 127
+        self.register_buffer("weight_int8", torch.round(weight / scale).to(torch.int8))
+        self.register_buffer("scale", scale)
+        self.register_buffer("bias", None if conv.bias is None else conv.bias.detach().clone())
+        self.stride = conv.stride
+        self.padding = conv.padding
+        self.dilation = conv.dilation
+        self.groups = conv.groups
+
+    def forward(self, x):
+        weight = self.weight_int8.to(x.dtype) * self.scale
+        return F.conv2d(x, weight, self.bias, self.stride, self.padding, self.dilation, self.groups)
+
+
+def quantize_weights(model):
+    """
+    Replace the convolutions of all Residual blocks with Int8WeightConv2d
+    This is the dynamic mode: no calibration, scales come from the weights only.
+    torch's dynamic quantized Conv2d loses too much accuracy to be usable here.
+    @Param model: hg_furukawa_original, preferably with folded BatchNorm
+    @Return model, changed in place
+    """
+    for module in model.modules():
+        if isinstance(module, Residual):
+            for name, child in list(module.named_children()):
+                if isinstance(child, nn.Conv2d):
+                    setattr(module, name, Int8WeightConv2d(child))
+    return model.eval()
+
+
+def get_quantized_engine():
+    """Best available quantized backend for this CPU"""
+    engines = torch.backends.quantized.supported_engines
+    for engine in ["x86", "fbgemm", "qnnpack"]:
+        if engine in engines:
+            return engine
+    raise RuntimeError("No quantized engine available")
+
+
+def quantize_static(model, calibration):
+    """
+    Static int8 quantization of all Residual blocks
+    Every block is traced with torch.fx, BatchNorm and ReLU are fused into the
+    convolutions and activation ranges are observed on the calibration images.
+    The stem and the output head stay fp32, they hold few weights and decide
+    heatmap precision.
+    @Param model: hg_furukawa_original
+    @Param calibration: list of (1, 3, H, W) images, a few typical plans are enough
+    @Return quantized copy in eval mode
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    engine = get_quantized_engine()
+    torch.backends.quantized.engine = engine
+    qconfig_mapping = get_default_qconfig_mapping(engine)
+    model = copy.deepcopy(model).eval()
+
+    # Find every Residual with its parent, inputs are only needed for tracing
+    blocks = [(parent, name, child) for parent in model.modules()
+              for name, child in parent.named_children() if isinstance(child, Residual)]
+
+    with warnings.catch_warnings():
+        # prepare_fx / convert_fx warn about the deprecated eager quantization API
+        warnings.simplefilter("ignore")
+        for parent, name, block in blocks:
+            example = (torch.zeros(1, block.numIn, 8, 8),)
+            setattr(parent, name, prepare_fx(block, qconfig_mapping, example))
+
+        with torch.no_grad():
+            for img in calibration:
+                model(img)
+
+        for parent, name, _ in blocks:
+            setattr(parent, name, convert_fx(getattr(parent, name)))
+
+    return model.eval()
@@ -0,0 +1,79 @@
+"""
+Parity test of BatchAugmentation against the per plan augmentations
+Compose([RandomCropToSizeTorch or ResizePaddedTorch, RandomRotations('cubi'),
+DictToTensor(), ColorJitterTorch()]) under the same seeds
+"""
+import random
+import numpy as np
+import pytest
+import torch
+from utils.loaders.augmentations import (Compose, RandomCropToSizeTorch, ResizePaddedTorch, RandomRotations,
+                                         DictToTensor, ColorJitterTorch, BatchAugmentation)
+
+SIZE = (64, 64)
+
+
+def random_sample(rng, i):
+    """cubi sample of FloorplanSVG(is_transform=False) with random content"""
+    height, width = rng.randint(30, 120), rng.randint(30, 120)
+    heatmaps = {}
+    for _ in range(rng.randint(0, 15)):
+        heatmaps.setdefault(int(rng.randint(0, 21)), []).append((int(rng.randint(0, width)),
+                                                                  int(rng.randint(0, height))))
+    label = np.stack((rng.randint(0, 12, (height, width)), rng.randint(0, 11, (height, width))))
+    return {'image': torch.from_numpy(rng.randint(0, 256, (3, height, width)).astype(np.float32)),
+            'label': torch.from_numpy(label.astype(np.float32)),
+            'heatmaps': heatmaps, 'scale': float(rng.uniform(0.3, 1.0)), 'folder': '/plan%d/' % i}
+
+
+def augment_sample(sample, resize_probability, jitter):
+    """The plan augmented on its own, the crop or resize drawn like BatchAugmentation"""
+    if random.random() < resize_probability:
+        first = ResizePaddedTorch((0, 0), size=SIZE, data_format='dict')
+    else:
+        first = RandomCropToSizeTorch(size=SIZE, fill=(0, 0), data_format='dict')
+    augmentations = [first, RandomRotations(format='cubi'), DictToTensor()]
+    if jitter:
+        augmentations.append(ColorJitterTorch())
+    return Compose(augmentations)(dict(sample))
+
+
+def seed(n):
+    random.seed(n)
+    torch.manual_seed(n)
+
+
+@pytest.mark.parametrize("jitter", [False, True])
+@pytest.mark.parametrize("resize_probability", [0.0, 0.5, 1.0])
+def test_per_sample_parity(resize_probability, jitter):
+    rng = np.random.RandomState(0)
+    for n in range(6):
+        samples = [random_sample(rng, i) for i in range(4)]
+        augmentation = BatchAugmentation(SIZE, resize_probability=resize_probability,
+                                         jitter=ColorJitterTorch() if jitter else None, img_norm=False)
+        seed(n)
+        batch = augmentation(samples)
+        seed(n)
+        expected = [augment_sample(s, resize_probability, jitter) for s in samples]
+
+        assert batch['folder'] == [s['folder'] for s in samples]
+        for i, e in enumerate(expected):
+            # Jitter of a batch and of a single plan differ by float rounding of the mean
+            assert torch.allclose(batch['image'][i], e['image'], rtol=0, atol=1e-3)
+            assert torch.equal(batch['label'][i], e['label'])
+
+
+def test_on_device_finish():
+    rng = np.random.RandomState(1)
+    samples = [random_sample(rng, i) for i in range(3)]
+    seed(0)
+    expected = BatchAugmentation(SIZE)(samples)
+    seed(0)
+    augmentation = BatchAugmentation(SIZE, on_device=True)
+    batch = augmentation(samples)
+    assert torch.allclose(augmentation.finish(batch['image'], batch['jitter']), expected['image'], atol=1e-5)
+
+
+def test_square_size():
+    with pytest.raises(ValueError):
+        BatchAugmentation((64, 96))
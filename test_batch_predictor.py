@@ -0,0 +1,46 @@
+"""
+Test of BatchPredictor on images of mixed sizes
+Results of predict_all come back in input order, cropped to the image or the
+requested size, and match predict for images that need no padding
+"""
+import torch
+from utils.inference import BatchPredictor, predict
+from test_inference_export import create_model
+
+# (height, width) of the images, two buckets of 64 x 128 and 128 x 128
+SIZES = [(128, 128), (64, 128), (100, 70), (64, 100), (128, 128), (64, 128)]
+# Requested prediction sizes, None keeps the image size
+OUTPUT_SIZES = [None, (32, 40), None, (90, 90), (128, 128), None]
+
+
+def create_images():
+    torch.manual_seed(2)
+    return [torch.rand(1, 3, h, w) * 2 - 1 for h, w in SIZES]
+
+
+def test_predict_all():
+    model = create_model()
+    images = create_images()
+    sizes = [s or tuple(img.shape[2:]) for s, img in zip(OUTPUT_SIZES, images)]
+    predictor = BatchPredictor(model, batch_size=2)
+    assert len({padded for padded, _ in predictor.get_batches(images)}) == 2
+
+    predictions = predictor.predict_all(images, sizes)
+    for img, size, prediction in zip(images, sizes, predictions):
+        assert prediction.shape == (1, 44) + tuple(size)
+        if img.shape[2] % 64 == 0 and img.shape[3] % 64 == 0:
+            with torch.no_grad():
+                expected = predict(model, img, 44, size, tile_size=None)
+            assert torch.allclose(prediction, expected, atol=1e-4), (prediction - expected).abs().max()
+
+
+def test_predict_order():
+    model = create_model()
+    images = create_images()
+    # Every image predicted on its own, in the same padded size
+    predictor = BatchPredictor(model)
+    singles = [predictor.predict_all([img])[0] for img in images]
+    batched = BatchPredictor(model, batch_size=3).predict_all(images)
+    for img, single, prediction in zip(images, singles, batched):
+        assert prediction.shape[2:] == img.shape[2:]
+        assert torch.allclose(prediction, single, atol=1e-4)
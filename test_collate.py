@@ -0,0 +1,63 @@
+"""
+Test of PaddedCollate and iter_samples
+Plans handed out by iter_samples of a batched loader must equal the batches
+of one plan of the default collate, for loaded and for augmented samples
+"""
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+from utils.loaders.augmentations import DictToTensor, ResizePaddedTorch
+from utils.loaders.collate import PaddedCollate, get_loader, iter_samples
+
+
+def random_sample(rng, i):
+    """cubi sample of FloorplanSVG(is_transform=False) with random content"""
+    height, width = rng.randint(20, 90), rng.randint(20, 90)
+    heatmaps = {}
+    for _ in range(rng.randint(0, 10)):
+        heatmaps.setdefault(int(rng.randint(0, 21)), []).append((int(rng.randint(0, width)),
+                                                                  int(rng.randint(0, height))))
+    label = np.stack((rng.randint(0, 12, (height, width)), rng.randint(0, 11, (height, width))))
+    return {'image': torch.from_numpy(rng.randint(0, 256, (3, height, width)).astype(np.float32)),
+            'label': torch.from_numpy(label.astype(np.float32)),
+            'heatmaps': heatmaps, 'scale': float(rng.uniform(0.3, 1.0)), 'folder': '/plan%d/' % i}
+
+
+def points(heatmaps):
+    return sorted((c, tuple(p)) for c, coords in heatmaps.items() for p in coords)
+
+
+def test_iter_samples_round_trip():
+    rng = np.random.RandomState(0)
+    dataset = [random_sample(rng, i) for i in range(7)]
+    expected = DataLoader([{k: v for k, v in s.items() if k != 'heatmaps'} for s in dataset], batch_size=1)
+
+    samples = list(iter_samples(get_loader(dataset, batch_size=3, num_workers=0)))
+    assert len(samples) == len(dataset)
+    for sample, single, plan in zip(samples, expected, dataset):
+        assert torch.equal(sample['image'], single['image'])
+        assert torch.equal(sample['label'], single['label'])
+        assert sample['folder'] == single['folder']
+        assert torch.equal(sample['scale'], single['scale'])
+        assert points(sample['heatmaps']) == points(plan['heatmaps'])
+
+
+def test_float_points():
+    rng = np.random.RandomState(1)
+    resize = ResizePaddedTorch((0, 0), size=(64, 64), data_format='dict')
+    plans = [resize(random_sample(rng, i)) for i in range(3)]
+    batch = PaddedCollate()(plans)
+    assert batch['points'].dtype == torch.float32
+    for sample, plan in zip(iter_samples([batch]), plans):
+        assert points(sample['heatmaps']) == points(plan['heatmaps'])
+
+
+def test_image_and_label_only():
+    rng = np.random.RandomState(2)
+    plans = [DictToTensor()(random_sample(rng, i)) for i in range(3)]
+    batch = PaddedCollate()(plans)
+    assert 'points' not in batch and 'scale' not in batch
+    assert batch['folder'] == [None] * 3
+    for sample, plan in zip(iter_samples([batch]), plans):
+        assert torch.equal(sample['image'][0], plan['image'])
+        assert torch.equal(sample['label'][0], plan['label'])
@@ -0,0 +1,87 @@
+"""
+Parity test of the exported inference graph against the eager path
+utils.inference.predict + post_prosessing.split_prediction on a randomly
+initialised hg_furukawa_original, for the eager module, TorchScript and ONNX
+"""
+import os
+import tempfile
+import numpy as np
+import pytest
+import torch
+from model import hg_furukawa_original
+from utils.inference import FloorplanInference, predict, trace_inference, export_onnx
+from utils.post_prosessing import split_prediction
+
+SPLIT = [21, 12, 11]
+
+
+def create_model(n_classes=44):
+    """Random hg_furukawa_original with BatchNorm statistics of the inputs it sees"""
+    torch.manual_seed(0)
+    model = hg_furukawa_original(51)
+    model.conv4_ = torch.nn.Conv2d(256, n_classes, bias=True, kernel_size=1)
+    model.upsample = torch.nn.ConvTranspose2d(n_classes, n_classes, kernel_size=4, stride=4)
+    model.train()
+    with torch.no_grad():
+        for _ in range(2):
+            model(torch.rand(1, 3, 128, 128) * 2 - 1)
+    return model.eval()
+
+
+def create_image(height, width):
+    """Random (1, 3, H, W) RGB image with values 0-255"""
+    torch.manual_seed(1)
+    return torch.randint(0, 256, (1, 3, height, width)).float()
+
+
+def eager_prediction(model, img):
+    """Heatmaps, rooms and icons the way generate.py computes them"""
+    size = (img.shape[2], img.shape[3])
+    prediction = predict(model, 2 * (img / 255.0) - 1, sum(SPLIT), size, tile_size=None)
+    return split_prediction(prediction, size, SPLIT)
+
+
+def assert_close(expected, actual, atol=1e-4):
+    for e, a in zip(expected, actual):
+        a = a.squeeze(0).detach().numpy() if torch.is_tensor(a) else a.squeeze(0)
+        assert e.shape == a.shape, (e.shape, a.shape)
+        assert np.allclose(e, a, atol=atol), np.abs(e - a).max()
+
+
+def test_module_parity():
+    model = create_model()
+    img = create_image(130, 170)
+    with torch.no_grad():
+        assert_close(eager_prediction(model, img), FloorplanInference(model, SPLIT)(img))
+
+
+def test_torchscript_parity():
+    model = create_model()
+    traced = trace_inference(model, SPLIT)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "floorplan.pt")
+        traced.save(path)
+        traced = torch.jit.load(path)
+        # Other sizes than the traced one, odd and multiple of 64
+        for height, width in [(130, 170), (128, 192)]:
+            img = create_image(height, width)
+            with torch.no_grad():
+                assert_close(eager_prediction(model, img), traced(img))
+
+
+def test_onnx_parity():
+    pytest.importorskip("onnx")
+    onnxruntime = pytest.importorskip("onnxruntime")
+    model = create_model()
+    img = create_image(130, 170)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = export_onnx(model, os.path.join(tmp, "floorplan.onnx"), SPLIT)
+        session = onnxruntime.InferenceSession(path, providers=["CPUExecutionProvider"])
+        outputs = session.run(None, {"image": img.numpy()})
+    assert_close(eager_prediction(model, img), outputs, atol=1e-3)
+
+
+if __name__ == "__main__":
+    test_module_parity()
+    test_torchscript_parity()
+    test_onnx_parity()
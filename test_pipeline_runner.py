@@ -0,0 +1,42 @@
+"""
+Test of PipelineRunner error handling
+A failing stage must stop the run with its error instead of leaving decoder
+threads blocked on the full queue
+"""
+import threading
+import pytest
+from utils.FloorplanToBlenderLib.pipeline import PipelineRunner
+
+
+class FailingInference(PipelineRunner):
+    """Decodes instantly, inference raises like a CUDA out of memory error"""
+
+    def decode(self, imgpath):
+        return None, (1, 1), None, False
+
+    def infer(self, items):
+        raise RuntimeError("CUDA out of memory")
+
+
+def run_with_timeout(runner, image_paths, timeout=60):
+    result = {}
+
+    def target():
+        try:
+            runner.run(image_paths)
+        except Exception as e:
+            result['error'] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "run did not finish"
+    return result
+
+
+@pytest.mark.parametrize("batch_size", [1, 3])
+def test_inference_error_finishes(batch_size):
+    runner = FailingInference(model=object(), io_workers=2, post_workers=1, queue_size=2,
+                              batch_size=batch_size)
+    result = run_with_timeout(runner, ["plan%d.png" % i for i in range(20)])
+    assert isinstance(result.get('error'), RuntimeError)
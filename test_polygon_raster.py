@@ -0,0 +1,77 @@
+"""
+Parity test of the scanline polygon rasterization of polygons_to_tensor
+Room masks must match shp_mask off the polygon boundary, icon and wall
+masks must match skimage draw.polygon
+"""
+import numpy as np
+import shapely
+from shapely.geometry import Polygon
+from shapely.ops import unary_union
+from skimage import draw
+from utils.plotting import shp_mask, fill_polygon
+from utils.metrics import polygons_to_tensor, polygons_to_label_map
+
+HEIGHT, WIDTH = 90, 120
+
+
+def random_rooms(rng, n):
+    """Unions of integer rectangles, like the merged room polygons of get_polygons"""
+    rects = []
+    for _ in range(n):
+        x, y = rng.randint(-10, WIDTH), rng.randint(-10, HEIGHT)
+        w, h = rng.randint(2, 50), rng.randint(2, 50)
+        rects.append(Polygon([(x, y), (x + w, y), (x + w, y + h), (x, y + h)]))
+    union = unary_union(rects)
+    return list(union.geoms) if hasattr(union, 'geoms') else [union]
+
+
+def random_quad(rng):
+    """Convex quadrilateral, as the wall, icon and opening polygons"""
+    center = rng.uniform(-10, WIDTH + 10, 2)
+    angles = np.sort(rng.uniform(0, 2 * np.pi, 4))
+    radius = rng.uniform(2, 30)
+    points = center + radius * np.column_stack((np.cos(angles), np.sin(angles)))
+    if rng.rand() < 0.5:
+        points = np.round(points)
+    return points
+
+
+def test_rooms_shp_mask():
+    rng = np.random.RandomState(0)
+    xx, yy = np.meshgrid(np.arange(WIDTH), np.arange(HEIGHT))
+    for _ in range(40):
+        for pol in random_rooms(rng, rng.randint(1, 5)):
+            expected = shp_mask(pol, np.arange(WIDTH), np.arange(HEIGHT))
+            mask = fill_polygon(np.zeros((HEIGHT, WIDTH), dtype=bool), pol, True, top_left=True)
+            boundary = shapely.intersects_xy(pol.boundary, xx, yy)
+            assert np.array_equal(mask[~boundary], expected[~boundary])
+
+
+def test_quads_draw_polygon():
+    rng = np.random.RandomState(1)
+    for _ in range(300):
+        pol = random_quad(rng)
+        expected = np.zeros((HEIGHT, WIDTH), dtype=bool)
+        rr, cc = draw.polygon(pol[:, 1], pol[:, 0], (HEIGHT, WIDTH))
+        expected[rr, cc] = True
+        mask = fill_polygon(np.zeros((HEIGHT, WIDTH), dtype=bool), pol, True)
+        assert np.array_equal(mask, expected), pol
+
+
+def test_label_map_argmax():
+    rng = np.random.RandomState(2)
+    for _ in range(10):
+        room_polygons, room_types = [], []
+        for room_class in rng.choice(np.arange(1, 12), 4, replace=False):
+            rooms = random_rooms(rng, 2)
+            room_polygons += rooms
+            room_types += [{'type': 'room', 'class': int(room_class)}] * len(rooms)
+        polygons = [random_quad(rng) for _ in range(8)]
+        types = [{'type': 'icon', 'class': int(rng.randint(0, 11))} if i % 2 else
+                 {'type': 'wall', 'class': 2} for i in range(8)]
+
+        tensor = polygons_to_tensor(polygons, types, room_polygons, room_types, (HEIGHT, WIDTH))
+        label_map = polygons_to_label_map(polygons, types, room_polygons, room_types, (HEIGHT, WIDTH))
+        assert label_map.dtype == np.uint8
+        assert np.array_equal(label_map[0], np.argmax(tensor[:12], axis=0))
+        assert np.array_equal(label_map[1], np.argmax(tensor[12:], axis=0))
@@ -0,0 +1,24 @@
+"""
+Parity test of svg_utils.render_heatmaps against cv2.filter2D of single pixel
+maps, including kernels larger than the maps
+"""
+import cv2
+import numpy as np
+from utils.loaders.svg_utils import render_heatmaps, get_gaussian2D
+
+
+def test_filter2d_parity():
+    rng = np.random.RandomState(0)
+    for _ in range(300):
+        height, width = rng.randint(1, 50), rng.randint(1, 50)
+        kernel = get_gaussian2D(rng.randint(1, 46))
+        n = rng.randint(1, 6)
+        points = np.column_stack((rng.randint(0, 2, n), rng.randint(0, width, n), rng.randint(0, height, n)))
+
+        heatmaps = render_heatmaps(points, 2, height, width, kernel)
+        for channel in range(2):
+            pixels = np.zeros((height, width))
+            for c, x, y in points:
+                if c == channel:
+                    pixels[y, x] = 1
+            assert np.allclose(heatmaps[channel], cv2.filter2D(pixels, -1, kernel), atol=1e-3)
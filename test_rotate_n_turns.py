@@ -0,0 +1,88 @@
+"""
+Test of the RotateNTurns heatmap channel permutations
+Tables must be permutations that compose like rotations and move the
+direction dependent channels the same way rot_tensor moves the image
+"""
+import torch
+from utils.loaders.augmentations import RotateNTurns
+
+TURNS = [0, 1, 2, -1]
+
+# Direction (dy, dx) of the direction dependent heatmap channels
+DIRECTIONS = {
+    # Opening corners: left, right, up, down
+    13: (0, -1), 14: (0, 1), 15: (-1, 0), 16: (1, 0),
+    # Icon corners: upper left, upper right, lower left, lower right
+    17: (-1, -1), 18: (-1, 1), 19: (1, -1), 20: (1, 1),
+}
+
+
+def channels(n_channels=44):
+    """(1, C, 1, 1) tensor holding the channel number in every channel"""
+    return torch.arange(n_channels, dtype=torch.float32).view(1, -1, 1, 1)
+
+
+def permutation(rot, n, n_channels=44):
+    return rot(channels(n_channels), 'points', n).view(-1).long().tolist()
+
+
+def rotate_direction(rot, direction, n):
+    """Direction of a point after rot_tensor, found by rotating a one pixel image"""
+    img = torch.zeros(1, 1, 3, 3)
+    img[0, 0, 1 + direction[0], 1 + direction[1]] = 1
+    y, x = divmod(int(rot(img, 'tensor', n).argmax()), 3)
+    return (y - 1, x - 1)
+
+
+def test_permutations():
+    rot = RotateNTurns()
+    for n in TURNS:
+        index = permutation(rot, n)
+        assert sorted(index) == list(range(44)), n
+        # X junctions, rooms and icons keep their channel
+        assert index[12] == 12 and index[21:] == list(range(21, 44)), n
+
+
+def test_composition():
+    rot = RotateNTurns()
+    for a in TURNS:
+        for b in TURNS:
+            turns = (a + b) % 4
+            expected = {0: 0, 1: 1, 2: 2, 3: -1}[turns]
+            composed = rot(rot(channels(), 'points', a), 'points', b)
+            assert torch.equal(composed, rot(channels(), 'points', expected)), (a, b)
+
+
+def test_directions():
+    rot = RotateNTurns()
+    for n in TURNS:
+        index = permutation(rot, n)
+        for channel, direction in DIRECTIONS.items():
+            # The channel that now points in this direction pointed in the old one
+            rotated = rotate_direction(rot, direction, n)
+            target = [c for c, d in DIRECTIONS.items() if d == rotated][0]
+            assert index[target] == channel, (n, channel, target)
+
+
+def test_two_turns():
+    # Channel 1 used to keep its own value and channel 3 was lost
+    index = permutation(RotateNTurns(), 2)
+    assert index[:4] == [2, 3, 0, 1]
+
+
+def test_fused_rotation():
+    rot = RotateNTurns()
+    torch.manual_seed(0)
+    t = torch.rand(1, 44, 5, 7)
+    for n in TURNS:
+        expected = rot(rot(t, 'tensor', n), 'points', n)
+        assert torch.equal(rot(t, 'tensor points', n), expected), n
+
+
+if __name__ == "__main__":
+    test_permutations()
+    test_composition()
+    test_directions()
+    test_two_turns()
+    test_fused_rotation()
+    print("RotateNTurns permutations are consistent")
@@ -85,6 +85,8 @@ def clean_data_folder(folder):
 def create_new_floorplan_path(path):
     '''
     Creates next free name to floorplan data
+    The directory is claimed with an atomic mkdir, so several processes
+    generating floorplans at the same time never get the same path.
     @Param path, path to floorplan
     @Return end path
     '''
@@ -92,18 +94,17 @@ def create_new_floorplan_path(path):
     for root, dirs, files in os.walk(path):
         for dir in dirs:
             try:
-                if(int(dir) is not None):
-                    res = int(dir) + 1
+                res = max(res, int(dir) + 1)
             except:
                 continue
 
-    res = path + str(res) + "/"
-
-    # create dir
-    if not os.path.exists(res):
-        os.makedirs(res)
-
-    return res;
+    # create dir, take the next number if another process was faster
+    while True:
+        try:
+            os.makedirs(path + str(res) + "/")
+            return path + str(res) + "/"
+        except FileExistsError:
+            res += 1
 
 
 def get_current_path():
@@ -14,7 +14,8 @@ IO...
 transform...
 dialog...
 execution...
+pipeline...
 
 '''
 
-__all__ = ['detect', 'generate', 'IO', 'transform', 'dialog', 'execution']
+__all__ = ['detect', 'generate', 'IO', 'transform', 'dialog', 'execution', 'pipeline']
@@ -1,5 +1,8 @@
 import cv2
 import numpy as np
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 from . import detect
 from . import IO
@@ -14,13 +17,16 @@ FloorplanToBlender3d
 Copyright (C) 2019 Daniel Westberg
 '''
 
-def simple_single(image_path, show=True, CubiCasa=False,SR=None):
+def simple_single(image_path, show=True, CubiCasa=False,SR=None, SR_policy=None, cache=None):
     '''
     Generate one simple floorplan
     @Param image_path path to image
+    @Param SR_policy thresholds for adaptive super-resolution, None always applies SR
+    @Param cache utils.result_cache.ResultCache to reuse results of earlier runs, or None
     @Return path to generated files
     '''
-    fpath, _ = generate.generate_all_files(image_path, show, CubiCasa=CubiCasa,SR=SR)
+    fpath, _ = generate.generate_all_files(image_path, show, CubiCasa=CubiCasa,SR=SR, SR_policy=SR_policy,
+                                           cache=cache)
     return fpath
 
 def multiple_simple(image_paths, horizontal=True):
@@ -77,3 +83,33 @@ def multiple_coord(image_paths):
         # add path to send to blender
         data_paths.append(fpath)
     return data_paths
+
+def multiple_parallel(image_paths, show=False, CubiCasa=False, SR=None, processes=None, SR_policy=None,
+                      cache=None):
+    '''
+    Generates several floorplans at the same time, one process per image
+    Every image runs simple_single in a worker process, so the total time
+    scales with the number of cores instead of the number of images.
+    Workers are spawned (not forked) as torch/CUDA can't be used in forked
+    children, so the calling script needs a if __name__ == "__main__" guard.
+    @Param image_paths - list of path to images
+    @Param show - if info should be printed
+    @Param CubiCasa - if the CubiCasa model should be used
+    @Param SR - super-resolution [scale, method] or None
+    @Param processes - number of worker processes, default number of cores
+    @Param SR_policy - thresholds for adaptive super-resolution, None always applies SR
+    @Param cache - utils.result_cache.ResultCache shared by all workers, or None
+    @Return paths to image data, same order as image_paths
+    '''
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = max(1, min(processes, len(image_paths)))
+
+    if processes == 1:
+        return [simple_single(image_path, show, CubiCasa, SR, SR_policy, cache) for image_path in image_paths]
+
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context) as executor:
+        futures = [executor.submit(simple_single, image_path, show, CubiCasa, SR, SR_policy, cache)
+                   for image_path in image_paths]
+        return [future.result() for future in futures]
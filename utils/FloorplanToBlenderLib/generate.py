@@ -23,156 +23,221 @@ path = "Data/"
 Path_pb = ["EDSR_x","ESPCN_x","LapSRN_x","FSRCNN_x"]
 meth = ["edsr","espcn","lapsrn","fsrcnn"] 
 
-def generate_all_files(imgpath, info, position=None, rotation=None, CubiCasa=False, SR=[2,"lapsrn"]):
+# CubiCasa inference, larger images (px) are predicted in overlapping tiles
+INFERENCE_TILE_SIZE = 1024
+CUBICASA_CHECKPOINT = "model_best_val_loss_var.pkl"
+CUBICASA_CLASSES = 44
+CUBICASA_SPLIT = [21, 12, 11]
+POLYGON_THRESHOLD = 0.2
+OPENING_TYPES = [1, 2]
+
+def generate_all_files(imgpath, info, position=None, rotation=None, CubiCasa=False, SR=[2,"lapsrn"], SR_policy=None,
+                       cache=None):
     '''
     Generate all data files
     @Param imgpath
     @Param info, boolean if should be printed
     @Param position, vector of float
     @Param rotation, vector of float
+    @Param SR, super-resolution [scale, method] or None
+    @Param SR_policy, thresholds for utils.super_resolution.choose_super_resolution,
+           None always applies SR
+    @Param cache, utils.result_cache.ResultCache to reuse earlier results of the same image, or None
     @Return path to generated file, shape
     '''
     global path
     if CubiCasa == True:
-        import numpy as np
-        if SR!=None:
-            pos = np.argmax(np.array(meth)==SR[1])
-            make_res = True
-            
-        #from skimage import transform
-        
-        import matplotlib.pyplot as plt
-        import matplotlib.image as mpimg
-        import torch
-        import torch.nn.functional as F
-        import cv2
-        from torch.utils.data import DataLoader
-        from model import get_model
-        from utils.loaders import FloorplanSVG, DictToTensor, Compose, RotateNTurns
-        from utils.plotting import segmentation_plot, polygons_to_image, draw_junction_from_dict,           discrete_cmap
-        discrete_cmap()
-        from utils.post_prosessing import split_prediction, get_polygons, split_validation
-        from mpl_toolkits.axes_grid1 import AxesGrid
-
-        rot = RotateNTurns()
-        room_classes = ["Background", "Outdoor", "Wall", "Kitchen", "Living Room" ,"Bed Room", "Bath",
-                        "Entry", "Railing", "Storage", "Garage", "Undefined"]
-        icon_classes = ["No Icon", "Window", "Door", "Closet", "Electrical Applience" ,"Toilet", "Sink",
-                        "Sauna Bench", "Fire Place", "Bathtub", "Chimney"]
-
-        model = get_model('hg_furukawa_original', 51)
-        n_classes = 44
-        split = [21, 12, 11]
-        model.conv4_ = torch.nn.Conv2d(256, n_classes, bias=True, kernel_size=1)
-        model.upsample = torch.nn.ConvTranspose2d(n_classes, n_classes, kernel_size=4, stride=4)
-        checkpoint = torch.load('model_best_val_loss_var.pkl')
-
-        model.load_state_dict(checkpoint['model_state'])
-        model.eval()
-        model.cuda()
-        img_path = imgpath
-
-        # Create tensor for pytorch
-        img = cv2.imread(img_path)
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)  # correct color channels
+        polygons, SR_img, SR_decision = get_cubicasa_polygons(imgpath, info, SR, SR_policy, cache)
+        return write_cubicasa_files(imgpath, info, polygons, position, rotation, SR_img, SR_decision)
 
-        # Image transformation to range (-1,1)
-        img = 2 * (img / 255.0) - 1
+    if info:
+        print(" ----- Generate ", imgpath, " at pos ", position ," rot ",rotation," -----")
 
-        # Move from (h,w,3)--->(3,h,w) as model input dimension is defined like this
-        img = np.moveaxis(img, -1, 0)
+    # Get path to save data
+    path = IO.create_new_floorplan_path(base_path)
 
-        # Convert to pytorch, enable cuda
-        img = torch.tensor([img.astype(np.float32)]).cuda()
-        
-        # Super-Resolution
-        if make_res == True:
-            import cv2 as cv
-            from PIL import Image
-            import time
-            st = time.time()
-            sr = cv.dnn_superres.DnnSuperResImpl_create()
+    shape = generate_floor_file(imgpath, info)
+    new_shape = generate_walls_file(imgpath, info)
+    shape = validate_shape(shape, new_shape)
+    new_shape = generate_rooms_file(imgpath, info)
+    shape = validate_shape(shape, new_shape)
 
-            path = "model/super-res/"+Path_pb[pos]+str(SR[0])+".pb"
+    #verts, height = generate_big_windows_file(imgpath, info)
+    #verts, height = generate_small_windows_file(imgpath, info)
+    #verts, height = generate_doors_file(imgpath, info)
 
-            sr.readModel(path)
+    transform = generate_transform_file(imgpath, info, position, rotation, shape)
 
-            sr.setModel(meth[pos],SR[0])
+    return path, shape
+
+def load_cubicasa_model(checkpoint=CUBICASA_CHECKPOINT, device="cuda"):
+    '''
+    Load the trained CubiCasa model
+    @Param checkpoint, path of the trained weights
+    @Param device, torch device to move the model to
+    @Return model in eval mode
+    '''
+    import torch
+    from model import get_model
+
+    model = get_model('hg_furukawa_original', 51)
+    model.conv4_ = torch.nn.Conv2d(256, CUBICASA_CLASSES, bias=True, kernel_size=1)
+    model.upsample = torch.nn.ConvTranspose2d(CUBICASA_CLASSES, CUBICASA_CLASSES, kernel_size=4, stride=4)
+    checkpoint = torch.load(checkpoint, map_location=device)
+
+    model.load_state_dict(checkpoint['model_state'])
+    model.eval()
+    return model.to(device)
+
+def read_cubicasa_image(imgpath, info, SR=[2,"lapsrn"], SR_policy=None):
+    '''
+    Read an image and apply super-resolution
+    @Param imgpath
+    @Param info, boolean if should be printed
+    @Param SR, super-resolution [scale, method] or None
+    @Param SR_policy, thresholds for utils.super_resolution.choose_super_resolution,
+           None always applies SR
+    @Return RGB image, upsampled image or None, SR decision or None
+    '''
+    SR_img = None
+    SR_decision = None
+
+    # Read image, correct color channels
+    img = cv2.imread(imgpath)
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+    # Super-Resolution on the uint8 image, before it is moved to the device
+    if SR != None:
+        from utils.super_resolution import get_engine, choose_super_resolution
+        pos = np.argmax(np.array(meth)==SR[1])
+        if SR_policy is not None:
+            SR_decision = choose_super_resolution(img, meth[pos], SR[0], **SR_policy)
+        else:
+            SR_decision = {"method": meth[pos], "scale": SR[0], "reason": "always"}
 
-            img = sr.upsample(np.array((np.moveaxis(img[0].cpu().data.numpy(), 0, -1)/ 2 + 0.5)*255,dtype='uint8'))
-            
-            SR_img = img
-            img = torch.tensor(np.moveaxis([(img/255-0.5)*2],3,1)).cuda().float()
-            
-        n_rooms = 12
-        n_icons = 11
-
-        with torch.no_grad():
-            #Check if shape of image is odd or even
-            size_check = np.array([img.shape[2],img.shape[3]])%2
-
-            height = img.shape[2] - size_check[0]
-            width = img.shape[3] - size_check[1]
-
-            img_size = (height, width)
-
-            rotations = [(0, 0), (1, -1), (2, 2), (-1, 1)]
-            pred_count = len(rotations)
-            prediction = torch.zeros([pred_count, n_classes, height, width])
-            for i, r in enumerate(rotations):
-                forward, back = r
-                # We rotate first the image
-                rot_image = rot(img, 'tensor', forward)
-                pred = model(rot_image)
-                # We rotate prediction back
-                pred = rot(pred, 'tensor', back)
-                # We fix heatmaps
-                pred = rot(pred, 'points', back)
-                # We make sure the size is correct
-                pred = F.interpolate(pred, size=(height, width), mode='bilinear', align_corners=True)
-                # We add the prediction to output
-                prediction[i] = pred[0]
-
-        prediction = torch.mean(prediction, 0, True)
-
-
-        rooms_pred = F.softmax(prediction[0, 21:21+12], 0).cpu().data.numpy()
-        rooms_pred = np.argmax(rooms_pred, axis=0)
-
-        icons_pred = F.softmax(prediction[0, 21+12:], 0).cpu().data.numpy()
-        icons_pred = np.argmax(icons_pred, axis=0)
-
-        heatmaps, rooms, icons = split_prediction(prediction, img_size, split)
-        polygons, types, room_polygons, room_types = get_polygons((heatmaps, rooms, icons), 0.2, [1, 2])
-        
         if info:
-            print(" ----- Generate ", imgpath, " at pos ", position ," rot ",rotation," -----")
+            print("Super-resolution : ", SR_decision["method"], "x", SR_decision["scale"], "-", SR_decision["reason"])
 
-        # Get path to save data
-        path = IO.create_new_floorplan_path(base_path)
+        if SR_decision["method"] != "none":
+            img = get_engine().upsample(img, SR_decision["method"], SR_decision["scale"])
+            SR_img = img
 
-        shape = generate_floor_file(imgpath, info, SR = make_res, SR_img=SR_img)
-        new_shape = generate_walls_file(imgpath, info,CubiCasa = True, polygons=polygons, types=types)
-        shape = validate_shape(shape, new_shape)
-        new_shape = generate_rooms_file(imgpath, info,CubiCasa = True, room_polygons=room_polygons)
-        shape = validate_shape(shape, new_shape)
+    return img, SR_img, SR_decision
 
-        #verts, height = generate_big_windows_file(imgpath, info)
-        #verts, height = generate_small_windows_file(imgpath, info)
-        #verts, height = generate_doors_file(imgpath, info)
-        
-        #new_shape = generate_big_windows_file(imgpath, info)
-        #shape = validate_shape(shape, new_shape)
-        #new_shape = generate_small_windows_file(imgpath, info)
-        #shape = validate_shape(shape, new_shape)
-        #new_shape = generate_doors_file(imgpath, info)
-        
-        #shape = validate_shape(shape, new_shape)
+def cubicasa_input(img):
+    '''
+    Convert an RGB image to model input
+    @Param img, (h,w,3) uint8 image
+    @Return (1,3,h,w) float tensor in range (-1,1) on the cpu, prediction size (even height and width)
+    '''
+    import torch
+
+    # Image transformation to range (-1,1)
+    img = 2 * (img / 255.0) - 1
 
+    # Move from (h,w,3)--->(3,h,w) as model input dimension is defined like this
+    img = np.moveaxis(img, -1, 0)
+    img = torch.tensor(img[None].astype(np.float32))
 
-        transform = generate_transform_file(imgpath, info, position, rotation, shape)
+    #Check if shape of image is odd or even
+    size_check = np.array([img.shape[2],img.shape[3]])%2
+    height = img.shape[2] - size_check[0]
+    width = img.shape[3] - size_check[1]
 
-        return path, shape
+    return img, (int(height), int(width))
+
+def get_cubicasa_polygons(imgpath, info, SR=[2,"lapsrn"], SR_policy=None, cache=None):
+    '''
+    Super-resolution, inference and post-processing of an image
+    With a cache every step whose result is cached is skipped.
+    @Param imgpath
+    @Param info, boolean if should be printed
+    @Param SR, super-resolution [scale, method] or None
+    @Param SR_policy, thresholds for adaptive super-resolution, None always applies SR
+    @Param cache, utils.result_cache.ResultCache or None
+    @Return (polygons, types, room_polygons, room_types), SR image or None, SR decision or None
+    '''
+    from utils.inference import predict
+
+    sr = cached = None
+    if cache is not None:
+        keys = cache.get_keys(imgpath, SR, SR_policy, CUBICASA_CHECKPOINT, POLYGON_THRESHOLD, OPENING_TYPES)
+        sr = cache.get_sr(keys)
+        if sr is not None:
+            polygons = cache.get_polygons(keys)
+            if polygons is not None:
+                return polygons, sr[0], sr[1]
+            cached = cache.get_prediction(keys)
+
+    if sr is None:
+        img, SR_img, SR_decision = read_cubicasa_image(imgpath, info, SR, SR_policy)
+        if cache is not None:
+            cache.put_sr(keys, SR_img, SR_decision)
+    else:
+        SR_img, SR_decision = sr
+        img = SR_img if SR_img is not None else cv2.cvtColor(cv2.imread(imgpath), cv2.COLOR_BGR2RGB)
+
+    if cached is not None:
+        prediction, img_size = cached
+    else:
+        model = load_cubicasa_model()
+        img, img_size = cubicasa_input(img)
+
+        # Rotation averaged prediction, large images are predicted in overlapping tiles
+        img = img.to(next(model.parameters()).device)
+        prediction = predict(model, img, CUBICASA_CLASSES, img_size, tile_size=INFERENCE_TILE_SIZE)
+        if cache is not None:
+            cache.put_prediction(keys, prediction, img_size)
+
+    polygons = get_prediction_polygons(prediction, img_size)
+    if cache is not None:
+        cache.put_polygons(keys, *polygons)
+
+    return polygons, SR_img, SR_decision
+
+def get_prediction_polygons(prediction, img_size):
+    '''
+    Post-process a CubiCasa prediction
+    @Param prediction, (1,44,h,w) cpu tensor
+    @Param img_size, (h,w) of the prediction
+    @Return polygons, types, room_polygons, room_types
+    '''
+    from utils.post_prosessing import split_prediction, get_polygons
+
+    heatmaps, rooms, icons = split_prediction(prediction, img_size, CUBICASA_SPLIT)
+    return get_polygons((heatmaps, rooms, icons), POLYGON_THRESHOLD, OPENING_TYPES)
+
+def generate_cubicasa_files(imgpath, info, prediction, img_size, position=None, rotation=None,
+                            SR_img=None, SR_decision=None):
+    '''
+    Post-process a CubiCasa prediction and generate all data files
+    @Param imgpath
+    @Param info, boolean if should be printed
+    @Param prediction, (1,44,h,w) cpu tensor
+    @Param img_size, (h,w) of the prediction
+    @Param position, vector of float
+    @Param rotation, vector of float
+    @Param SR_img, upsampled image or None
+    @Param SR_decision, super-resolution decision to record or None
+    @Return path to generated file, shape
+    '''
+    polygons = get_prediction_polygons(prediction, img_size)
+    return write_cubicasa_files(imgpath, info, polygons, position, rotation, SR_img, SR_decision)
+
+def write_cubicasa_files(imgpath, info, polygons, position=None, rotation=None, SR_img=None, SR_decision=None):
+    '''
+    Generate all data files from CubiCasa polygons
+    @Param imgpath
+    @Param info, boolean if should be printed
+    @Param polygons, (polygons, types, room_polygons, room_types) of get_polygons
+    @Param position, vector of float
+    @Param rotation, vector of float
+    @Param SR_img, upsampled image or None
+    @Param SR_decision, super-resolution decision to record or None
+    @Return path to generated file, shape
+    '''
+    global path
+    polygons, types, room_polygons, room_types = polygons
 
     if info:
         print(" ----- Generate ", imgpath, " at pos ", position ," rot ",rotation," -----")
@@ -180,16 +245,17 @@ def generate_all_files(imgpath, info, position=None, rotation=None, CubiCasa=Fal
     # Get path to save data
     path = IO.create_new_floorplan_path(base_path)
 
-    shape = generate_floor_file(imgpath, info)
-    new_shape = generate_walls_file(imgpath, info)
+    # Record which super-resolution was used, coordinates are in upsampled pixels
+    if SR_decision is not None:
+        IO.save_to_file(path+"super_resolution", SR_decision, info)
+
+    make_res = SR_img is not None
+    shape = generate_floor_file(imgpath, info, SR = make_res, SR_img=SR_img)
+    new_shape = generate_walls_file(imgpath, info,CubiCasa = True, polygons=polygons, types=types)
     shape = validate_shape(shape, new_shape)
-    new_shape = generate_rooms_file(imgpath, info)
+    new_shape = generate_rooms_file(imgpath, info,CubiCasa = True, room_polygons=room_polygons)
     shape = validate_shape(shape, new_shape)
 
-    #verts, height = generate_big_windows_file(imgpath, info)
-    #verts, height = generate_small_windows_file(imgpath, info)
-    #verts, height = generate_doors_file(imgpath, info)
-
     transform = generate_transform_file(imgpath, info, position, rotation, shape)
 
     return path, shape
@@ -218,25 +284,15 @@ def get_shape(verts, scale):
     if len(verts) == 0:
         return [0,0,0]
 
-    posList = transform.verts_to_poslist(verts)
-    high = [0,0,0]
-    low = posList[0]
-
-    for pos in posList:
-        if pos[0] > high[0]:
-            high[0] = pos[0]
-        if pos[1] > high[1]:
-            high[1] = pos[1]
-        if pos[2] > high[2]:
-            high[2] = pos[2]
-        if pos[0] < low[0]:
-            low[0] = pos[0]
-        if pos[1] < low[1]:
-            low[1] = pos[1]
-        if pos[2] < low[2]:
-            low[2] = pos[2]
-
-    return [high[0] - low[0],high[1] - low[1],high[2] - low[2]]
+    positions = transform.verts_to_array(verts)
+    if len(positions) == 0:
+        return [0,0,0]
+
+    # high starts at the origin, low at the first position
+    high = np.maximum(positions.max(axis=0), 0)
+    low = positions.min(axis=0)
+
+    return (high - low).tolist()
 
 def generate_transform_file(imgpath, info, position, rotation, shape):
     '''
@@ -306,12 +362,7 @@ def generate_icons_file(img_path, info, polygons=[], types = []):
 
     # create faces
     for icon in verts:
-        count = 0
-        temp = ()
-        for pos in icon:
-            temp = temp + (count,)
-            count += 1
-        faces.append([(temp)])
+        faces.append([tuple(range(len(icon)))])
 
     if(info):
         print("Number of icons detected : ", icon_count)
@@ -341,12 +392,7 @@ def generate_icons_file(img_path, info, polygons=[], types = []):
 
     # create faces
     for dw in verts:
-        count = 0
-        temp = ()
-        for pos in dw:
-            temp = temp + (count,)
-            count += 1
-        faces.append([(temp)])
+        faces.append([tuple(range(len(dw)))])
     if(info):
         print("Number of doors/windows detected : ", dw_count)
 
@@ -386,12 +432,7 @@ def generate_rooms_file(img_path, info, CubiCasa=False, room_polygons=[]):
 
         # create faces
         for room in verts:
-            count = 0
-            temp = ()
-            for pos in room:
-                temp = temp + (count,)
-                count += 1
-            faces.append([(temp)])
+            faces.append([tuple(range(len(room)))])
 
         if(info):
             print("Number of rooms detected : ", room_count)
@@ -439,12 +480,7 @@ def generate_rooms_file(img_path, info, CubiCasa=False, room_polygons=[]):
 
     # create faces
     for room in verts:
-        count = 0
-        temp = ()
-        for pos in room:
-            temp = temp + (count,)
-            count += 1
-        faces.append([(temp)])
+        faces.append([tuple(range(len(room)))])
 
     if(info):
         print("Number of rooms detected : ", room_count)
@@ -620,10 +656,7 @@ def generate_floor_file(img_path, info, SR=False ,SR_img = None):
     verts = transform.scale_point_to_vector(contour, scale, height)
 
     # create faces
-    count = 0
-    for box in verts:
-        faces.extend([(count)])
-        count += 1
+    faces = list(range(len(verts)))
 
 
     if(info):
@@ -684,12 +717,7 @@ def generate_walls_file(img_path, info, CubiCasa=False, polygons=[],types=[]):
         # create faces
         faces = []
         for room in verts:
-            count = 0
-            temp = ()
-            for _ in room:
-                temp = temp + (count,)
-                count += 1
-            faces.append([(temp)])
+            faces.append([tuple(range(len(room)))])
 
         # One solution to get data to blender is to write and read from file.
         IO.save_to_file(path+"top_wall_verts", verts, info)
@@ -738,12 +766,7 @@ def generate_walls_file(img_path, info, CubiCasa=False, polygons=[],types=[]):
     # create faces
     faces = []
     for room in verts:
-        count = 0
-        temp = ()
-        for _ in room:
-            temp = temp + (count,)
-            count += 1
-        faces.append([(temp)])
+        faces.append([tuple(range(len(room)))])
 
     # One solution to get data to blender is to write and read from file.
     IO.save_to_file(path+"top_wall_verts", verts, info)
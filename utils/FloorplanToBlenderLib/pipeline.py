@@ -0,0 +1,207 @@
+import os
+import queue
+import threading
+import time
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from . import generate
+
+'''
+Pipeline
+Pipelined CubiCasa batch runner. Decoding and super-resolution, model inference
+and post-processing with file generation run on separate workers connected by
+bounded queues, so the model doesn't wait for get_polygons and the other way
+around. Throughput approaches the one of the slowest stage.
+
+FloorplanToBlender3d
+Copyright (C) 2019 Daniel Westberg
+'''
+
+
+def timed_call(func, *args):
+    '''
+    Call a function and measure it, used for work done in worker processes
+    @Return result, seconds
+    '''
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+class PipelineRunner(object):
+    '''
+    Pipelined generation of many floorplans with the CubiCasa model
+    @Param model - loaded model, default generate.load_cubicasa_model()
+    @Param info - if info should be printed
+    @Param SR - super-resolution [scale, method] or None
+    @Param SR_policy - thresholds for adaptive super-resolution, None always applies SR
+    @Param io_workers - threads reading and upsampling images
+    @Param post_workers - processes running post-processing and file generation,
+                          default number of cores
+    @Param queue_size - images waiting between two stages, bounds memory
+    @Param batch_size - images per forward pass, 1 uses tiled inference
+    '''
+
+    def __init__(self, model=None, info=False, SR=None, SR_policy=None, io_workers=2, post_workers=None,
+                 queue_size=4, batch_size=1):
+        self.model = model if model is not None else generate.load_cubicasa_model()
+        self.info = info
+        self.SR = SR
+        self.SR_policy = SR_policy
+        self.io_workers = io_workers
+        self.post_workers = post_workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+
+    def decode(self, imgpath):
+        '''
+        Decode stage, read and upsample an image
+        @Return model input, prediction size, SR image, SR decision
+        '''
+        img, SR_img, SR_decision = generate.read_cubicasa_image(imgpath, self.info, self.SR, self.SR_policy)
+        img, img_size = generate.cubicasa_input(img)
+        return img, img_size, SR_img, SR_decision
+
+    def infer(self, items):
+        '''
+        Model stage
+        @Param items - list of (model input, prediction size)
+        @Return list of (1,44,h,w) cpu tensors
+        '''
+        from utils.inference import predict, BatchPredictor
+
+        device = next(self.model.parameters()).device
+        if len(items) == 1:
+            img, img_size = items[0]
+            return [predict(self.model, img.to(device), generate.CUBICASA_CLASSES, img_size,
+                            tile_size=generate.INFERENCE_TILE_SIZE)]
+
+        predictor = BatchPredictor(self.model, generate.CUBICASA_CLASSES, batch_size=len(items))
+        return predictor.predict_all([img for img, _ in items], [img_size for _, img_size in items])
+
+    def run(self, image_paths, positions=None):
+        '''
+        Generate data files of all images
+        Post-processing runs in spawned processes, so the calling script needs a
+        if __name__ == "__main__" guard.
+        @Param image_paths - list of path to images
+        @Param positions - optional list of position vectors
+        @Return paths to image data in input order, report with per stage busy
+                seconds, workers and utilization, wall time and throughput
+        '''
+        n = len(image_paths)
+        paths = [None] * n
+        busy = {"decode": 0.0, "inference": 0.0, "postprocess": 0.0}
+        lock = threading.Lock()
+        errors = []
+
+        todo = queue.Queue()
+        for i in range(n):
+            todo.put(i)
+        decoded = queue.Queue(maxsize=self.queue_size)
+        # Predictions handed to post-processing but not yet done
+        in_flight = threading.BoundedSemaphore(self.queue_size + self.post_workers)
+
+        def decode_worker():
+            while True:
+                try:
+                    i = todo.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    item, seconds = timed_call(self.decode, image_paths[i])
+                except Exception as e:
+                    decoded.put((i, e))
+                    continue
+                with lock:
+                    busy["decode"] += seconds
+                decoded.put((i, item))
+
+        def post_done(i, future):
+            in_flight.release()
+            try:
+                (paths[i], _), seconds = future.result()
+                with lock:
+                    busy["postprocess"] += seconds
+            except Exception as e:
+                errors.append(e)
+
+        start = time.perf_counter()
+        context = multiprocessing.get_context("spawn")
+        with ThreadPoolExecutor(max_workers=self.io_workers) as io_pool, \
+                ProcessPoolExecutor(max_workers=self.post_workers, mp_context=context) as post_pool:
+            decoders = [io_pool.submit(decode_worker) for _ in range(self.io_workers)]
+
+            received = 0
+            try:
+                while received < n and not errors:
+                    # Take what is decoded, up to one batch
+                    batch = [decoded.get()]
+                    while len(batch) < self.batch_size and received + len(batch) < n:
+                        try:
+                            batch.append(decoded.get_nowait())
+                        except queue.Empty:
+                            break
+                    received += len(batch)
+
+                    for i, item in batch:
+                        if isinstance(item, Exception):
+                            errors.append(item)
+                    if errors:
+                        break
+
+                    predictions, seconds = timed_call(self.infer, [(item[0], item[1]) for _, item in batch])
+                    busy["inference"] += seconds
+
+                    for (i, (_, img_size, SR_img, SR_decision)), prediction in zip(batch, predictions):
+                        position = positions[i] if positions is not None else None
+                        in_flight.acquire()
+                        future = post_pool.submit(timed_call, generate.generate_cubicasa_files, image_paths[i],
+                                                  self.info, prediction, img_size, position, None,
+                                                  SR_img, SR_decision)
+                        future.add_done_callback(lambda f, i=i: post_done(i, f))
+            except Exception as e:
+                # e.g. out of memory in inference or a broken process pool
+                errors.append(e)
+
+            if errors:
+                # Stop decoding, empty the queue until no decoder is blocked on it
+                while True:
+                    try:
+                        todo.get_nowait()
+                    except queue.Empty:
+                        break
+                while not all(decoder.done() for decoder in decoders):
+                    try:
+                        decoded.get(timeout=0.1)
+                    except queue.Empty:
+                        pass
+
+        if errors:
+            raise errors[0]
+
+        wall = time.perf_counter() - start
+        workers = {"decode": self.io_workers, "inference": 1, "postprocess": self.post_workers}
+        report = {
+            "images": n,
+            "wall": wall,
+            "throughput": n / wall if wall > 0 else 0.0,
+            "stages": {stage: {"busy": busy[stage], "workers": workers[stage],
+                               "utilization": busy[stage] / (wall * workers[stage]) if wall > 0 else 0.0}
+                       for stage in busy},
+        }
+        if self.info:
+            print_report(report)
+        return paths, report
+
+
+def print_report(report):
+    '''
+    Print stage utilization of a PipelineRunner report
+    @Param report - report returned by PipelineRunner.run
+    '''
+    print(f"{report['images']} images in {report['wall']:.1f} s, {report['throughput']:.2f} images/s")
+    for stage, r in report["stages"].items():
+        print(f"  {stage:<12} {r['workers']:>2} workers  busy {r['busy']:>7.1f} s  "
+              f"utilization {100 * r['utilization']:>5.1f}%")
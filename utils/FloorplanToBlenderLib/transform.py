@@ -13,22 +13,41 @@ Copyright (C) 2019 Daniel Westberg
 def recursive_loop_element(thelist, res):
     '''
     Recursive loop element
-    A recursive function transforming any sized array to a one dimentional array
+    Transforming any sized array to a one dimentional array
+    Walks the nesting with an explicit stack instead of recursion, so deep or
+    long lists neither copy slices nor hit the recursion limit.
     @Param thelist, incoming list
     @Param res, resulting list
+    @Return res
     '''
-    if not thelist:
-        return res
-    else:
-        if isinstance(thelist[0], int):
-            res.append(thelist[0])
-            return recursive_loop_element(thelist[1:], res)
-        elif isinstance(thelist[0], float):
-            res.append(thelist[0])
-            return recursive_loop_element(thelist[1:], res)
+    stack = [iter(thelist)]
+    while stack:
+        for element in stack[-1]:
+            if isinstance(element, (int, float)):
+                res.append(element)
+            elif isinstance(element, np.ndarray):
+                res.extend(element.ravel().tolist())
+            else:
+                stack.append(iter(element))
+                break
         else:
-            res.extend( recursive_loop_element(thelist[0], []))
-            return  recursive_loop_element(thelist[1:], res)
+            stack.pop()
+    return res
+
+def verts_to_array(verts):
+    '''
+    Verts to array
+    Convert any verts array to an (N, 3) numpy array of positions
+    Trailing values that don't make a full position are dropped.
+    @Param verts of undecided size
+    @Return (N, 3) float array
+    '''
+    try:
+        # Regular nesting converts directly
+        flat = np.asarray(verts, dtype=float).ravel()
+    except (ValueError, TypeError):
+        flat = np.asarray(recursive_loop_element(verts, []), dtype=float)
+    return flat[:len(flat) // 3 * 3].reshape(-1, 3)
 
 def verts_to_poslist(verts):
     '''
@@ -37,14 +56,27 @@ def verts_to_poslist(verts):
     @Param verts of undecided size
     @Return res, list of position
     '''
-    list_of_elements = recursive_loop_element(verts, [])
+    return verts_to_array(verts).tolist()
 
-    res = []
-    i = 0
-    while(i < len(list_of_elements)-1):
-        res.append([list_of_elements[i],list_of_elements[i+1],list_of_elements[i+2]])
-        i+= 3
-    return res
+def boxes_to_points(boxes):
+    '''
+    Boxes to points
+    Collect ragged boxes into one flat array
+    @Param boxes, list of boxes, each [[[x,y]], [[x,y]], ...] or (n,1,2) numpy array
+    @Return points - (N, 2) float array of all box positions, offsets - (len(boxes)+1,) int array,
+            box i is points[offsets[i]:offsets[i+1]]
+    '''
+    points = []
+    offsets = [0]
+    for box in boxes:
+        box = np.asarray(box, dtype=float)
+        box = box.reshape(len(box), -1)[:, :2] if len(box) else np.empty((0, 2))
+        points.append(box)
+        offsets.append(offsets[-1] + len(box))
+
+    if not points:
+        return np.empty((0, 2)), np.zeros(1, dtype=int)
+    return np.concatenate(points, axis=0), np.asarray(offsets, dtype=int)
 
 def scale_point_to_vector(boxes, scale = 1, height = 0):
     '''
@@ -53,12 +85,13 @@ def scale_point_to_vector(boxes, scale = 1, height = 0):
     @Param boxes
     @Param scale
     @Param height
+    @Return list of (x, y, height) positions
     '''
-    res = []
-    for box in boxes:
-        for pos in box:
-            res.extend([(pos[0]/scale, pos[1]/scale, height)])
-    return res
+    points, _ = boxes_to_points(boxes)
+    res = np.empty((len(points), 3))
+    res[:, :2] = points / scale
+    res[:, 2] = height
+    return res.tolist()
 
 
 def write_verts_on_2d_image(boxes, blank_image):
@@ -86,35 +119,23 @@ def create_nx4_verts_and_faces(boxes, height = 1, scale = 1, ground = 0):
     Use the result by looping over boxes in verts, and create mesh for each box with same face and pos
     See create_custom_mesh in floorplan code
     '''
-    wall_counter = 0
-    verts = []
+    points, offsets = boxes_to_points(boxes)
+    points = points / scale
+    wall_counter = len(points)
 
-    for box in boxes:
-        box_verts = []
-        for index in range(0, len(box) ):
-            temp_verts = []
-            # Get current
-            curr = box[index][0];
+    # Every position is linked to the next one in its box, the last one to the first
+    next_index = np.arange(1, len(points) + 1)
+    filled = offsets[1:] > offsets[:-1]
+    next_index[offsets[1:][filled] - 1] = offsets[:-1][filled]
 
-            # is last, link to first
-            if(len(box)-1 >= index+1):
-                next = box[index+1][0];
-            else:
-                next = box[0][0]; # link to first pos
+    # Create all 3d poses for each wall: curr ground, curr height, next ground, next height
+    walls = np.empty((len(points), 4, 3))
+    walls[:, 0:2, :2] = points[:, None]
+    walls[:, 2:4, :2] = points[next_index][:, None]
+    walls[:, 0::2, 2] = ground
+    walls[:, 1::2, 2] = height
 
-            # Create all 3d poses for each wall
-            temp_verts.extend([(curr[0]/scale, curr[1]/scale, ground)])
-            temp_verts.extend([(curr[0]/scale, curr[1]/scale, height)])
-            temp_verts.extend([(next[0]/scale, next[1]/scale, ground)])
-            temp_verts.extend([(next[0]/scale, next[1]/scale, height)])
-
-            # add wall verts to verts
-            box_verts.extend([temp_verts])
-
-            # wall counter
-            wall_counter += 1
-
-        verts.extend([box_verts])
+    verts = [walls[start:end].tolist() for start, end in zip(offsets[:-1], offsets[1:])]
 
     faces = [(0, 1, 3, 2)]
     return verts, faces, wall_counter
@@ -130,22 +151,15 @@ def create_verts(boxes, height, scale):
     Scale and create array of box_verts
     [[box1],[box2],...]
     '''
-    verts = []
-
-    # for each wall group
-    for box in boxes:
-        temp_verts = []
-        # for each pos
-        for pos in box:
-
-        # add and convert all positions
-            temp_verts.extend([(pos[0][0]/scale, pos[0][1]/scale, 0.0)])
-            temp_verts.extend([(pos[0][0]/scale, pos[0][1]/scale, height)])
+    points, _ = boxes_to_points(boxes)
 
-        # add box to list
-        verts.extend(temp_verts)
+    # add and convert all positions, at the ground and at height
+    verts = np.empty((len(points), 2, 3))
+    verts[:, :, :2] = (points / scale)[:, None]
+    verts[:, 0, 2] = 0.0
+    verts[:, 1, 2] = height
 
-    return verts
+    return verts.reshape(-1, 3).tolist()
 
 def write_boxes_on_2d_image(boxes, blank_image):
     '''
@@ -0,0 +1,146 @@
+import os
+import json
+
+import numpy as np
+
+from utils.metrics import runningScore
+
+'''
+Evaluation
+Room and icon segmentation scores of a set of plans, kept as confusion
+matrices that grow with every plan instead of lists of label arrays. Every
+plan appends one line to a summary file, its room and icon confusion matrices
+and its pixel accuracies, so a stopped evaluation resumes from the file and
+memory doesn't depend on the number of plans. Precision, recall and IoU of
+the classes are computed from the summed matrices at the end.
+'''
+
+ROOM_CLASSES = ["Background", "Outdoor", "Wall", "Kitchen", "Living Room", "Bed Room", "Bath",
+                "Entry", "Railing", "Storage", "Garage", "Undefined"]
+ICON_CLASSES = ["No Icon", "Window", "Door", "Closet", "Electrical Applience", "Toilet", "Sink",
+                "Sauna Bench", "Fire Place", "Bathtub", "Chimney"]
+
+
+def class_scores(hist, class_names, zero_division=1.0):
+    """
+    Scores of a confusion matrix, rows are labels and columns predictions
+    @Param hist: (n, n) confusion matrix
+    @Param class_names: n names
+    @Param zero_division: score of a class without labels or predictions,
+                          1 as classification_report(zero_division=1)
+    @Return dict with overall accuracy, mean IoU and per class precision,
+            recall, IoU and support
+    """
+    hist = np.asarray(hist, dtype=np.float64)
+    tp = np.diag(hist)
+    support = hist.sum(axis=1)
+    predicted = hist.sum(axis=0)
+    union = support + predicted - tp
+
+    def divide(a, b):
+        res = np.full(len(a), zero_division, dtype=np.float64)
+        np.divide(a, b, out=res, where=b > 0)
+        return res
+
+    precision, recall, iou = divide(tp, predicted), divide(tp, support), divide(tp, union)
+    total = hist.sum()
+    return {'accuracy': tp.sum() / total if total else zero_division,
+            'mean_iou': float(iou[support > 0].mean()) if (support > 0).any() else zero_division,
+            'classes': {name: {'precision': precision[i], 'recall': recall[i], 'iou': iou[i],
+                               'support': int(support[i])}
+                        for i, name in enumerate(class_names)}}
+
+
+class Evaluation(object):
+    """
+    Confusion matrices of room and icon segmentations of plans, per group
+    (e.g. with and without super resolution), with a summary line per plan
+    @Param summary_path: append-only json lines file, None to keep no summaries
+    @Param room_classes, icon_classes: class names
+    """
+
+    def __init__(self, summary_path=None, room_classes=ROOM_CLASSES, icon_classes=ICON_CLASSES):
+        self.summary_path = summary_path
+        self.room_classes = room_classes
+        self.icon_classes = icon_classes
+        self.scores = {}
+        self.done = set()
+        if summary_path is not None and os.path.exists(summary_path):
+            self.load(summary_path)
+
+    def get_score(self, group, kind):
+        key = (group, kind)
+        if key not in self.scores:
+            self.scores[key] = runningScore(len(self.room_classes if kind == 'rooms' else self.icon_classes))
+        return self.scores[key]
+
+    def load(self, path):
+        """Sum the confusion matrices of an earlier run"""
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                summary = json.loads(line)
+                if self.is_done(summary['plan'], summary['group']):
+                    # Repeated line, the plan is counted once
+                    continue
+                for kind in ('rooms', 'icons'):
+                    score = self.get_score(summary['group'], kind)
+                    score.confusion_matrix += np.array(summary[kind]['hist']).reshape(score.n_classes, -1)
+                self.done.add((summary['plan'], summary['group']))
+
+    def is_done(self, plan, group=None):
+        return (plan, group) in self.done
+
+    def add(self, plan, rooms_true, rooms_pred, icons_true, icons_pred, group=None, **info):
+        """
+        Add the segmentations of a plan
+        @Param plan: plan name, e.g. the folder
+        @Param rooms_true, rooms_pred: (H, W) room label and prediction
+        @Param icons_true, icons_pred: (H, W) icon label and prediction
+        @Param group: scores of different groups are kept apart
+        @Param info: other json values of the summary line, e.g. time
+        @Return summary of the plan, None if the plan is already in the group
+        """
+        if self.is_done(plan, group):
+            # Added in this run or loaded from the summary file, adding it
+            # again would count its pixels twice
+            return None
+
+        summary = {'plan': plan, 'group': group}
+        summary.update(info)
+        for kind, true, pred in (('rooms', rooms_true, rooms_pred), ('icons', icons_true, icons_pred)):
+            score = self.get_score(group, kind)
+            hist = score._fast_hist(np.asarray(true).reshape(-1), np.asarray(pred).reshape(-1).astype(np.int64),
+                                    score.n_classes)
+            score.confusion_matrix += hist
+            total = hist.sum()
+            summary[kind] = {'accuracy': float(np.trace(hist) / total) if total else None,
+                             'hist': hist.reshape(-1).tolist()}
+
+        if self.summary_path is not None:
+            with open(self.summary_path, 'a') as f:
+                f.write(json.dumps(summary) + '\n')
+        self.done.add((plan, group))
+        return summary
+
+    def get_scores(self, group=None, zero_division=1.0):
+        """
+        Scores of all plans of a group
+        @Return dict rooms, icons -> class_scores
+        """
+        return {'rooms': class_scores(self.get_score(group, 'rooms').confusion_matrix, self.room_classes,
+                                      zero_division),
+                'icons': class_scores(self.get_score(group, 'icons').confusion_matrix, self.icon_classes,
+                                      zero_division)}
+
+    def report(self, group=None):
+        """Scores of a group as a text table"""
+        lines = []
+        for kind, scores in self.get_scores(group).items():
+            lines.append(f"{kind}: accuracy {scores['accuracy']:.4f}, mean IoU {scores['mean_iou']:.4f}")
+            lines.append(f"{'class':<22}{'precision':>10}{'recall':>10}{'IoU':>10}{'support':>12}")
+            for name, s in scores['classes'].items():
+                lines.append(f"{name:<22}{s['precision']:>10.4f}{s['recall']:>10.4f}{s['iou']:>10.4f}{s['support']:>12}")
+            lines.append('')
+        return '\n'.join(lines)
@@ -0,0 +1,357 @@
+import warnings
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from utils.loaders.augmentations import RotateNTurns
+
+'''
+Inference
+Runs hg_furukawa_original on a normalised floorplan image with rotation
+test time augmentation. Large images are split in overlapping tiles whose
+predictions are blended, so memory is bounded by the tile size instead of
+the image size. FloorplanInference packages the whole eager pipeline in one
+module that can be exported to TorchScript and ONNX. BatchPredictor runs many
+images in padded batches.
+'''
+
+# (forward, back) rotations used for test time augmentation
+ROTATIONS = [(0, 0), (1, -1), (2, 2), (-1, 1)]
+
+# Example input size for tracing. Every feature map of hg_furukawa_original has an
+# odd size at 252px, so each _upsample_add traces its interpolation branch and the
+# exported graph works for any input size.
+EXPORT_SIZE = (252, 252)
+
+# Total stride of hg_furukawa_original, inputs padded to a multiple of it give
+# outputs of exactly the input size
+MODEL_STRIDE = 64
+
+# Normalised value of white paper, used to pad batched images
+PAD_VALUE = 1.0
+
+
+def predict(model, img, n_classes=44, size=None, rotate=True, tile_size=1024, overlap=128):
+    """
+    Predict heatmaps and room/icon logits of an image
+    @Param model: network in eval mode, on the same device as img
+    @Param img: (1, 3, H, W) tensor normalised to [-1, 1]
+    @Param n_classes: number of output channels
+    @Param size: (height, width) of the returned prediction, default (H, W)
+    @Param rotate: average the four 90 degree rotations
+    @Param tile_size: images larger than this (px) are predicted in tiles, None never tiles
+    @Param overlap: overlap of neighbouring tiles (px), blended linearly
+    @Return (1, n_classes, height, width) CPU tensor
+    """
+    _, _, height, width = img.shape
+    if size is None:
+        size = (height, width)
+
+    with torch.no_grad():
+        if tile_size is None or (height <= tile_size and width <= tile_size):
+            prediction = predict_tta(model, img, n_classes, size, rotate)
+        else:
+            prediction = predict_tiled(model, img, n_classes, rotate, tile_size, overlap)
+            if prediction.shape[2:] != size:
+                prediction = F.interpolate(prediction, size=size, mode='bilinear', align_corners=True)
+
+    return prediction
+
+
+def predict_tta(model, img, n_classes, size, rotate=True):
+    """
+    Prediction of one image or tile, averaged over all rotations
+    Keeps a running sum instead of a buffer with one prediction per rotation.
+    @Param model: network in eval mode
+    @Param img: (1, 3, H, W) tensor
+    @Param n_classes: number of output channels
+    @Param size: (height, width) of the returned prediction
+    @Param rotate: average the four 90 degree rotations
+    @Return (1, n_classes, height, width) CPU tensor
+    """
+    rot = RotateNTurns()
+    rotations = ROTATIONS if rotate else ROTATIONS[:1]
+
+    prediction = torch.zeros([1, n_classes, size[0], size[1]])
+    for forward, back in rotations:
+        # We rotate first the image
+        rot_image = rot(img, 'tensor', forward)
+        pred = model(rot_image)
+        # We rotate prediction back and fix heatmaps
+        pred = rot(pred, 'tensor points', back)
+        # We make sure the size is correct
+        pred = F.interpolate(pred, size=size, mode='bilinear', align_corners=True)
+        # We add the prediction to output
+        prediction += pred.cpu()
+
+    return prediction / len(rotations)
+
+
+def get_tile_starts(length, tile_size, overlap):
+    """
+    Start positions of tiles covering [0, length)
+    @Return list of starts, the last tile ends at length
+    """
+    if length <= tile_size:
+        return [0]
+    stride = tile_size - overlap
+    starts = list(range(0, length - tile_size, stride))
+    starts.append(length - tile_size)
+    return starts
+
+
+def get_blend_ramp(length, start_ramp, end_ramp):
+    """
+    1D blending weights of a tile
+    Weights rise linearly over the overlap at sides that border another tile
+    and are 1 everywhere else.
+    @Param length: tile length
+    @Param start_ramp, end_ramp: length of the ramp at the start and end, 0 for none
+    @Return (length,) tensor
+    """
+    ramp = torch.ones(length)
+    if start_ramp > 0:
+        ramp[:start_ramp] = torch.arange(1, start_ramp + 1, dtype=torch.float32) / (start_ramp + 1)
+    if end_ramp > 0:
+        ramp[length - end_ramp:] = torch.minimum(
+            ramp[length - end_ramp:],
+            torch.arange(end_ramp, 0, -1, dtype=torch.float32) / (end_ramp + 1))
+    return ramp
+
+
+def predict_tiled(model, img, n_classes, rotate=True, tile_size=1024, overlap=128):
+    """
+    Sliding window prediction with blended seams
+    Every tile is predicted with predict_tta and added with weights that fade out
+    towards neighbouring tiles, the sum is divided by the summed weights.
+    Only one tile of network activations exists at any time.
+    @Param model: network in eval mode
+    @Param img: (1, 3, H, W) tensor normalised to [-1, 1]
+    @Param n_classes: number of output channels
+    @Param rotate: average the four 90 degree rotations in every tile
+    @Param tile_size: tile size (px), a multiple of 64 matches the network strides
+    @Param overlap: overlap of neighbouring tiles (px)
+    @Return (1, n_classes, H, W) CPU tensor
+    """
+    _, _, height, width = img.shape
+    overlap = min(overlap, tile_size // 2)
+    y_starts = get_tile_starts(height, tile_size, overlap)
+    x_starts = get_tile_starts(width, tile_size, overlap)
+
+    prediction = torch.zeros([1, n_classes, height, width])
+    weights = torch.zeros([height, width])
+    for i, y0 in enumerate(y_starts):
+        y1 = min(y0 + tile_size, height)
+        # Ramps only where the previous / next tile overlaps this one
+        top = y_starts[i - 1] + tile_size - y0 if i > 0 else 0
+        bottom = y1 - y_starts[i + 1] if i + 1 < len(y_starts) else 0
+        ramp_y = get_blend_ramp(y1 - y0, top, bottom)
+
+        for j, x0 in enumerate(x_starts):
+            x1 = min(x0 + tile_size, width)
+            left = x_starts[j - 1] + tile_size - x0 if j > 0 else 0
+            right = x1 - x_starts[j + 1] if j + 1 < len(x_starts) else 0
+            ramp_x = get_blend_ramp(x1 - x0, left, right)
+
+            tile = img[:, :, y0:y1, x0:x1]
+            pred = predict_tta(model, tile, n_classes, (y1 - y0, x1 - x0), rotate)
+
+            weight = ramp_y[:, None] * ramp_x[None, :]
+            prediction[:, :, y0:y1, x0:x1] += pred * weight
+            weights[y0:y1, x0:x1] += weight
+
+    return prediction / weights
+
+
+class BatchPredictor(object):
+    """
+    Batched inference of many images
+    Images are bucketed by their size padded up to a multiple of bucket_size,
+    every bucket runs through the model in batches with rotation TTA and the
+    predictions are cropped back to the image sizes. Sizes in one bucket differ
+    by less than bucket_size, which bounds the padding work.
+    @Param model: network in eval mode
+    @Param n_classes: number of output channels
+    @Param batch_size: images per forward pass
+    @Param bucket_size: padding granularity (px), a multiple of MODEL_STRIDE
+    @Param rotate: average the four 90 degree rotations
+    """
+
+    def __init__(self, model, n_classes=44, batch_size=4, bucket_size=MODEL_STRIDE, rotate=True):
+        if bucket_size % MODEL_STRIDE != 0:
+            raise ValueError(f"bucket_size must be a multiple of {MODEL_STRIDE}")
+        self.model = model
+        self.n_classes = n_classes
+        self.batch_size = batch_size
+        self.bucket_size = bucket_size
+        self.rotate = rotate
+        self.rot = RotateNTurns()
+
+    def get_padded_size(self, height, width):
+        """Bucket of an image size"""
+        b = self.bucket_size
+        return (-(-height // b) * b, -(-width // b) * b)
+
+    def get_batches(self, images):
+        """
+        Group images by bucket
+        @Param images: list of (1, 3, H, W) or (3, H, W) tensors
+        @Return list of (padded size, list of image indices), at most batch_size per batch
+        """
+        buckets = {}
+        for i, img in enumerate(images):
+            buckets.setdefault(self.get_padded_size(img.shape[-2], img.shape[-1]), []).append(i)
+
+        batches = []
+        for padded, indices in sorted(buckets.items()):
+            for start in range(0, len(indices), self.batch_size):
+                batches.append((padded, indices[start:start + self.batch_size]))
+        return batches
+
+    def predict_batch(self, batch):
+        """
+        Rotation averaged prediction of a padded batch
+        @Param batch: (N, 3, H, W) tensor on the model device
+        @Return (N, n_classes, H, W) CPU tensor
+        """
+        rotations = ROTATIONS if self.rotate else ROTATIONS[:1]
+        prediction = None
+        for forward, back in rotations:
+            pred = self.model(self.rot(batch, 'tensor', forward))
+            pred = self.rot(pred, 'tensor points', back).cpu()
+            prediction = pred if prediction is None else prediction + pred
+        return prediction / len(rotations)
+
+    def predict(self, images, sizes=None):
+        """
+        Predict many images, in batches
+        Predictions are yielded as soon as their batch is done, in bucket order,
+        so post-processing can start before all images went through the model.
+        @Param images: list of (1, 3, H, W) or (3, H, W) tensors normalised to [-1, 1]
+        @Param sizes: optional list of (height, width) per image for the returned
+                      predictions, default the image size
+        @Return generator of (image index, (1, n_classes, height, width) CPU tensor)
+        """
+        device = next(self.model.parameters()).device
+        with torch.no_grad():
+            for (padded_height, padded_width), indices in self.get_batches(images):
+                batch = torch.full((len(indices), 3, padded_height, padded_width), PAD_VALUE, device=device)
+                for j, i in enumerate(indices):
+                    img = images[i].reshape(3, images[i].shape[-2], images[i].shape[-1])
+                    batch[j, :, :img.shape[1], :img.shape[2]] = img.to(device)
+
+                prediction = self.predict_batch(batch)
+
+                for j, i in enumerate(indices):
+                    height, width = images[i].shape[-2], images[i].shape[-1]
+                    pred = prediction[j:j + 1, :, :height, :width]
+                    size = sizes[i] if sizes is not None else (height, width)
+                    if tuple(size) != (height, width):
+                        pred = F.interpolate(pred, size=tuple(size), mode='bilinear', align_corners=True)
+                    yield i, pred.contiguous()
+
+    def predict_all(self, images, sizes=None):
+        """
+        Predict many images
+        @Return list of (1, n_classes, height, width) CPU tensors in input order
+        """
+        predictions = [None] * len(images)
+        for i, prediction in self.predict(images, sizes):
+            predictions[i] = prediction
+        return predictions
+
+
+class FloorplanInference(nn.Module):
+    """
+    Exportable inference graph
+    Normalisation, rotation test time augmentation, interpolation to the input
+    size and the heatmap / room / icon split with softmaxes, as done eagerly by
+    predict and post_prosessing.split_prediction.
+    @Param model: trained hg_furukawa_original in eval mode
+    @Param split: heatmap, room and icon channel counts
+    @Param rotate: average the four 90 degree rotations
+    """
+
+    def __init__(self, model, split=[21, 12, 11], rotate=True):
+        super(FloorplanInference, self).__init__()
+        self.model = model.eval()
+        self.split = list(split)
+        self.rotations = ROTATIONS if rotate else ROTATIONS[:1]
+        self.rot = RotateNTurns()
+
+        # Heatmap channel order after rotating back, as an index per rotation
+        for _, back in self.rotations:
+            permutation = self.rot.get_index(back, sum(self.split), torch.device("cpu"))
+            self.register_buffer(self.permutation_name(back), permutation.clone())
+
+    @staticmethod
+    def permutation_name(n):
+        return "permutation_" + str(n).replace("-", "m")
+
+    def forward(self, img):
+        """
+        @Param img: (1, 3, H, W) float RGB image with values 0-255
+        @Return heatmaps (1, 21, H, W), room (1, 12, H, W) and icon (1, 11, H, W) probabilities
+        """
+        size = (img.shape[2], img.shape[3])
+        img = 2 * (img / 255.0) - 1
+
+        prediction = None
+        for forward, back in self.rotations:
+            pred = self.model(self.rot(img, 'tensor', forward))
+            pred = self.rot(pred, 'tensor', back)
+            pred = pred.index_select(1, getattr(self, self.permutation_name(back)))
+            pred = F.interpolate(pred, size=size, mode='bilinear', align_corners=True)
+            prediction = pred if prediction is None else prediction + pred
+        prediction = prediction / len(self.rotations)
+
+        heatmaps, rooms, icons = torch.split(prediction, self.split, 1)
+        return heatmaps, F.softmax(rooms, 1), F.softmax(icons, 1)
+
+
+def trace_inference(model, split=[21, 12, 11], rotate=True):
+    """
+    Trace FloorplanInference with TorchScript
+    @Param model: trained hg_furukawa_original
+    @Param split: heatmap, room and icon channel counts
+    @Param rotate: average the four 90 degree rotations
+    @Return torch.jit.ScriptModule taking (1, 3, H, W) images of any size
+    """
+    module = FloorplanInference(model, split, rotate).eval()
+    example = torch.rand(1, 3, EXPORT_SIZE[0], EXPORT_SIZE[1]) * 255
+    with torch.no_grad(), warnings.catch_warnings():
+        # The shape comparisons in _upsample_add are fixed by the example size on purpose
+        warnings.simplefilter("ignore", torch.jit.TracerWarning)
+        return torch.jit.trace(module, example)
+
+
+def export_torchscript(model, path, split=[21, 12, 11], rotate=True):
+    """
+    Save the traced inference graph, load it with torch.jit.load
+    @Param model: trained hg_furukawa_original
+    @Param path: output .pt file
+    @Return path
+    """
+    trace_inference(model, split, rotate).save(path)
+    return path
+
+
+def export_onnx(model, path, split=[21, 12, 11], rotate=True, opset_version=17):
+    """
+    Export the inference graph to ONNX, e.g. for onnxruntime on the CPU
+    Input "image" is (1, 3, height, width) float RGB 0-255, outputs are
+    "heatmaps", "rooms" and "icons" like FloorplanInference.
+    @Param model: trained hg_furukawa_original
+    @Param path: output .onnx file
+    @Param opset_version: ONNX opset, bilinear align_corners needs 11 or later
+    @Return path
+    """
+    module = FloorplanInference(model, split, rotate).eval()
+    example = torch.rand(1, 3, EXPORT_SIZE[0], EXPORT_SIZE[1]) * 255
+    axes = {2: "height", 3: "width"}
+    with torch.no_grad(), warnings.catch_warnings():
+        warnings.simplefilter("ignore", torch.jit.TracerWarning)
+        torch.onnx.export(module, (example,), path, input_names=["image"],
+                          output_names=["heatmaps", "rooms", "icons"],
+                          dynamic_axes={"image": axes, "heatmaps": axes, "rooms": axes, "icons": axes},
+                          opset_version=opset_version, dynamo=False)
+    return path
@@ -2,3 +2,4 @@ from utils.loaders.svg_loader import FloorplanSVG
 from utils.loaders import svg_utils
 from utils.loaders.augmentations import *
 from utils.loaders import house
+from utils.loaders.collate import PaddedCollate, BucketBatchSampler, get_loader, get_sample, iter_samples
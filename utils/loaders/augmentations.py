@@ -131,6 +131,52 @@ def clip_heatmaps(heatmaps, minx, maxx, miny, maxy):
     return res
 
 
+def heatmaps_to_arrays(heatmaps):
+    """
+    Heatmap dict as arrays
+    @Param heatmaps: dict channel -> list of (x, y)
+    @Return (n,) int64 channels, (n, 2) points
+    """
+    channels = np.array([c for c, coords in heatmaps.items() for _ in coords], dtype=np.int64)
+    points = np.array([p for coords in heatmaps.values() for p in coords]).reshape(-1, 2)
+    return channels, points
+
+
+def arrays_to_heatmaps(channels, points, keys=()):
+    """
+    Heatmap dict of arrays
+    @Param channels: (n,) channels
+    @Param points: (n, 2) points
+    @Param keys: channels that are in the dict even without points
+    @Return dict channel -> list of (x, y)
+    """
+    heatmaps = {k: [] for k in keys}
+    for channel, point in zip(channels.tolist(), points.tolist()):
+        heatmaps.setdefault(channel, []).append(tuple(point))
+    return heatmaps
+
+
+def crop_padded(tensor, top, left, height, width, fill=0, out=None):
+    """
+    Crop of a (C, H, W) tensor as if it was padded with fill on all sides,
+    only the part of the tensor in the crop is copied
+    @Param top, left: crop corner in tensor coordinates, can be outside of it
+    @Param height, width: crop size
+    @Param fill: value outside of the tensor
+    @Param out: (C, height, width) tensor to write to, default a new one of the tensor dtype
+    @Return (C, height, width) tensor
+    """
+    if out is None:
+        out = tensor.new_full((tensor.shape[0], height, width), fill)
+    else:
+        out.fill_(fill)
+    y0, y1 = max(top, 0), min(top + height, tensor.shape[1])
+    x0, x1 = max(left, 0), min(left + width, tensor.shape[2])
+    if y0 < y1 and x0 < x1:
+        out[:, y0 - top:y1 - top, x0 - left:x1 - left] = tensor[:, y0:y1, x0:x1]
+    return out
+
+
 class DictToTensor(object):
     def __init__(self, data_format='cubi'):
         if data_format == 'cubi':
@@ -144,29 +190,33 @@ class DictToTensor(object):
     def cubi(self, sample):
         image, label = sample['image'], sample['label']
         _, height, width = label.shape
-        heatmaps = sample['heatmaps']
-        scale = sample['scale']
-
-        heatmap_tensor = np.zeros((21, height, width))
-        for channel, coords in heatmaps.items():
-            for x, y in coords:
-                if x >= width:
-                    x -= 1
-                if y >= height:
-                    y -= 1
-                heatmap_tensor[int(channel), int(y), int(x)] = 1
-
-        # Gaussian filter
-        kernel = svg_utils.get_gaussian2D(int(30*scale))
-        for i, h in enumerate(heatmap_tensor):
-            heatmap_tensor[i] = cv2.filter2D(h, -1, kernel)
-
-        heatmap_tensor = torch.FloatTensor(heatmap_tensor)
+        channels, points = heatmaps_to_arrays(sample['heatmaps'])
 
+        heatmap_tensor = torch.from_numpy(self.render(channels, points, height, width, sample['scale']))
         label = torch.cat((heatmap_tensor, label), 0)
 
         return {'image': image, 'label': label}
 
+    @staticmethod
+    def render(channels, points, height, width, scale):
+        """
+        Gaussian heatmaps of cubi points, the kernel is only added around the points
+        @Param channels, points: heatmaps_to_arrays of the heatmap points
+        @Param height, width: heatmap size
+        @Param scale: sample scale, the kernel is int(30 * scale) pixels
+        @Return (21, height, width) float32 array
+        """
+        points = np.array(points, dtype=np.float64).reshape(-1, 2)
+        # Points on the far edge belong to the last pixel
+        points[:, 0] -= points[:, 0] >= width
+        points[:, 1] -= points[:, 1] >= height
+        # Truncated like int(), negative coordinates index from the end
+        points = points.astype(np.int64) % np.array([width, height])
+        points = np.column_stack((channels, points))
+
+        kernel = svg_utils.get_gaussian2D(int(30*scale))
+        return svg_utils.render_heatmaps(points, 21, height, width, kernel)
+
     def furukawa(self, sample):
         image, label = sample['image'], sample['label']
         _, height, width = label.shape
@@ -190,6 +240,35 @@ class DictToTensor(object):
 
 
 class RotateNTurns(object):
+    # Heatmap channel permutations, the rotated channel i is taken from channel
+    # POINT_PERMUTATIONS[n][i]. Channels 21 and up (rooms, icons) don't change.
+    POINT_PERMUTATIONS = {
+        0: list(range(21)),
+        # One turn clock wise
+        1: [3, 0, 1, 2,         # I junctions
+            7, 4, 5, 6,         # L junctions
+            11, 8, 9, 10,       # T junctions
+            12,
+            16, 15, 13, 14,     # Opening corners
+            19, 17, 20, 18],    # Icon corners
+        # One turn counter clock wise
+        -1: [1, 2, 3, 0,
+             5, 6, 7, 4,
+             9, 10, 11, 8,
+             12,
+             15, 16, 14, 13,
+             18, 20, 17, 19],
+        # Two turns clock wise
+        2: [2, 3, 0, 1,
+            6, 7, 4, 5,
+            10, 11, 8, 9,
+            12,
+            14, 13, 16, 15,
+            20, 19, 18, 17],
+    }
+
+    def __init__(self):
+        self.indices = {}
 
     def rot_tensor(self, t, n):
         # One turn clock wise
@@ -204,101 +283,32 @@ class RotateNTurns(object):
 
         return t
 
+    def get_index(self, n, channels, device):
+        # Permutation of all channels, cached per rotation, size and device
+        key = (n, channels, device)
+        index = self.indices.get(key)
+        if index is None:
+            permutation = self.POINT_PERMUTATIONS[n]
+            index = torch.tensor(permutation + list(range(len(permutation), channels)), device=device)
+            self.indices[key] = index
+        return index
+
     def rot_points(self, t, n):
-        # Swapping corner ts 
-        t_sorted = t.clone().detach()
-        # One turn clock wise
-        if n == 1:
-            # I junctions
-            t_sorted[:, 1] = t[:, 0]
-            t_sorted[:, 2] = t[:, 1]
-            t_sorted[:, 3] = t[:, 2]
-            t_sorted[:, 0] = t[:, 3]
-            # L junctions
-            t_sorted[:, 5] = t[:, 4]
-            t_sorted[:, 6] = t[:, 5]
-            t_sorted[:, 7] = t[:, 6]
-            t_sorted[:, 4] = t[:, 7]
-            # T junctions
-            t_sorted[:, 9] = t[:, 8]
-            t_sorted[:, 10] = t[:, 9]
-            t_sorted[:, 11] = t[:, 10]
-            t_sorted[:, 8] = t[:, 11]
-            # Opening corners
-            t_sorted[:, 15] = t[:, 13]
-            t_sorted[:, 16] = t[:, 14]
-            t_sorted[:, 14] = t[:, 15]
-            t_sorted[:, 13] = t[:, 16]
-            # Icon corners
-            t_sorted[:, 18] = t[:, 17]
-            t_sorted[:, 20] = t[:, 18]
-            t_sorted[:, 17] = t[:, 19]
-            t_sorted[:, 19] = t[:, 20]
-        # One turn counter clock wise
-        elif n == -1:
-            # I junctions
-            t_sorted[:, 3] = t[:, 0]
-            t_sorted[:, 0] = t[:, 1]
-            t_sorted[:, 1] = t[:, 2]
-            t_sorted[:, 2] = t[:, 3]
-            # L junctions
-            t_sorted[:, 7] = t[:, 4]
-            t_sorted[:, 4] = t[:, 5]
-            t_sorted[:, 5] = t[:, 6]
-            t_sorted[:, 6] = t[:, 7]
-            # T junctions
-            t_sorted[:, 11] = t[:, 8]
-            t_sorted[:, 8] = t[:, 9]
-            t_sorted[:, 9] = t[:, 10]
-            t_sorted[:, 10] = t[:, 11]
-            # Opening corners
-            t_sorted[:, 16] = t[:, 13]
-            t_sorted[:, 15] = t[:, 14]
-            t_sorted[:, 13] = t[:, 15]
-            t_sorted[:, 14] = t[:, 16]
-            # Icon corners
-            t_sorted[:, 19] = t[:, 17]
-            t_sorted[:, 17] = t[:, 18]
-            t_sorted[:, 20] = t[:, 19]
-            t_sorted[:, 18] = t[:, 20]
-        # Two turns clock wise
-        elif n == 2:
-            t_sorted = t.clone().detach()
-            # I junctions
-            t_sorted[:, 2] = t[:, 0]
-            t_sorted[:, 3] = t[:, 1]
-            t_sorted[:, 0] = t[:, 2]
-            t_sorted[:, 4] = t[:, 3]
-            # L junctions
-            t_sorted[:, 6] = t[:, 4]
-            t_sorted[:, 7] = t[:, 5]
-            t_sorted[:, 4] = t[:, 6]
-            t_sorted[:, 5] = t[:, 7]
-            # T junctions
-            t_sorted[:, 10] = t[:, 8]
-            t_sorted[:, 11] = t[:, 9]
-            t_sorted[:, 8] = t[:, 10]
-            t_sorted[:, 9] = t[:, 11]
-            # Opening corners
-            t_sorted[:, 14] = t[:, 13]
-            t_sorted[:, 13] = t[:, 14]
-            t_sorted[:, 16] = t[:, 15]
-            t_sorted[:, 15] = t[:, 16]
-            # Icon corners
-            t_sorted[:, 20] = t[:, 17]
-            t_sorted[:, 19] = t[:, 18]
-            t_sorted[:, 18] = t[:, 19]
-            t_sorted[:, 17] = t[:, 20]
-        elif n == 0:
-            return t_sorted
-
-        return t_sorted
+        # Swapping corner ts with a single gather
+        return t.index_select(1, self.get_index(n, t.shape[1], t.device))
+
+    def rot_tensor_points(self, t, n):
+        # Rotate a prediction and its heatmap channels. Gathering channels of the
+        # contiguous input first is much cheaper than gathering a rotated view.
+        return self.rot_tensor(self.rot_points(t, n), n)
 
     def __call__(self, sample, data_type, n):
         if data_type == 'tensor':
             return self.rot_tensor(sample, n)
         elif data_type == 'points':
             return self.rot_points(sample, n)
+        elif data_type == 'tensor points':
+            return self.rot_tensor_points(sample, n)
 
 
 class RandomCropToSizeTorch(object):
@@ -326,161 +336,73 @@ class RandomCropToSizeTorch(object):
         image, label = sample['image'], sample['label']
         img_w = image.shape[2]
         img_h = image.shape[1]
-        pad_w = int(self.width / 2)
-        pad_h = int(self.height / 2)
-
-        new_w = self.width + max(img_w, self.width)
-        new_h = self.height + max(img_h, self.height)
-
-        new_image = torch.zeros([image.shape[0], new_h, new_w], dtype=self.dtype)
-        new_image[:, pad_h:img_h+pad_h, pad_w:img_w+pad_w] = image
-
-        new_heatmaps = torch.zeros([self.input_slice[0], new_h, new_w], dtype=self.dtype)
-        new_heatmaps[:, pad_h:img_h+pad_h, pad_w:img_w+pad_w] = label[:self.input_slice[0]]
-
-        new_rooms = torch.full((self.input_slice[1], new_h, new_w), self.fill[0])
-        new_rooms[:, pad_h:img_h+pad_h, pad_w:img_w+pad_w] = label[self.input_slice[0]]
-        new_icons = torch.full((self.input_slice[2], new_h, new_w), self.fill[1])
-        new_icons[:, pad_h:img_h+pad_h, pad_w:img_w+pad_w] = label[self.input_slice[0]+self.input_slice[1]]
-
-        label = torch.cat((new_heatmaps, new_rooms, new_icons), 0)
-        image = new_image
-
-        removed_up = random.randint(0, new_h - self.width)
-        removed_left = random.randint(0, new_w - self.height)
-
-        removed_down = new_h - self.height - removed_up
-        removed_right = new_w - self.width - removed_left
-
-        if removed_down == 0 and removed_right == 0:
-            image = image[:, removed_up:, removed_left:]
-            label = label[:, removed_up:, removed_left:]
-        elif removed_down == 0:
-            image = image[:, removed_up:, removed_left:-removed_right]
-            label = label[:, removed_up:, removed_left:-removed_right]
-        elif removed_right == 0:
-            image = image[:, removed_up:-removed_down, removed_left:]
-            label = label[:, removed_up:-removed_down, removed_left:]
-        else:
-            image = image[:, removed_up:-removed_down, removed_left:-removed_right]
-            label = label[:, removed_up:-removed_down, removed_left:-removed_right]
+        # Window of the image padded by half the crop size, at least a crop size big
+        top, left = self.get_window(self.height + max(img_h, self.height), self.width + max(img_w, self.width))
+
+        image = crop_padded(image.to(self.dtype), top, left, self.height, self.width, 0)
+        heatmaps, rooms, icons = self.input_slice
+        label = label.to(self.dtype)
+        label = torch.cat((crop_padded(label[:heatmaps], top, left, self.height, self.width, 0),
+                           crop_padded(label[[heatmaps]].expand(rooms, -1, -1), top, left,
+                                       self.height, self.width, self.fill[0]),
+                           crop_padded(label[[heatmaps + rooms]].expand(icons, -1, -1), top, left,
+                                       self.height, self.width, self.fill[1])), 0)
 
         return {'image': image, 'label': label}
 
-    def augment_dict(self, sample):
-        image, label = sample['image'], sample['label']
-        heatmap_points = sample['heatmaps']
-        img_w = image.shape[2]
-        img_h = image.shape[1]
-        pad_w = int(self.width / 2)
-        pad_h = int(self.height / 2)
-
-        new_w = self.width + img_w
-        new_h = self.height + img_h
-
-        new_image = torch.full([image.shape[0], new_h, new_w], 255)
-        new_image[:, pad_h:img_h+pad_h, pad_w:img_w+pad_w] = image
-
-        new_rooms = torch.full((1, new_h, new_w), self.fill[0])
-        new_rooms[:, pad_h:img_h+pad_h, pad_w:img_w+pad_w] = label[0]
-        new_icons = torch.full((1, new_h, new_w), self.fill[1])
-        new_icons[:, pad_h:img_h+pad_h, pad_w:img_w+pad_w] = label[1]
-
-        label = torch.cat((new_rooms, new_icons), 0)
-        image = new_image
-
+    def get_window(self, new_h, new_w):
+        """
+        Random crop window of the image padded to new_h x new_w
+        @Return top, left of the window in image coordinates
+        """
         removed_up = random.randint(0, new_h - self.width)
         removed_left = random.randint(0, new_w - self.height)
-
+        return removed_up - int(self.height / 2), removed_left - int(self.width / 2)
+
+    def crop_arrays(self, image, label, channels, points, image_out=None, label_out=None):
+        """
+        Random crop of an image, its room and icon labels and heatmap points
+        @Param image: (3, H, W) tensor, filled with 255 outside
+        @Param label: (2, H, W) rooms and icons tensor, filled with self.fill outside
+        @Param channels, points: heatmap_to_arrays of the heatmap points
+        @Param image_out, label_out: tensors to write the crops to
+        @Return image, label, channels and points of the crop
+        """
+        img_h, img_w = image.shape[1:]
+        new_h, new_w = self.height + img_h, self.width + img_w
+        top, left = self.get_window(new_h, new_w)
+
+        image = crop_padded(image, top, left, self.height, self.width, 255, image_out)
+        if label_out is None:
+            label_out = label.new_empty((2, self.height, self.width))
+        crop_padded(label[[0]], top, left, self.height, self.width, self.fill[0], label_out[0:1])
+        crop_padded(label[[1]], top, left, self.height, self.width, self.fill[1], label_out[1:2])
+
+        # Points stay if they are in the window, except past the padded image
+        # edge when the window touches it
+        removed_up, removed_left = top + int(self.height / 2), left + int(self.width / 2)
         removed_down = new_h - self.height - removed_up
         removed_right = new_w - self.width - removed_left
-
-        new_heatmap_points = dict()
-        for junction_type, points in heatmap_points.items():
-            new_heatmap_points_per_type = []
-            for point in points:
-                new_heatmap_points_per_type.append([point[0]+pad_w, point[1]+pad_h])
-
-                new_heatmap_points[junction_type] = new_heatmap_points_per_type
-
-        heatmap_points = new_heatmap_points
-
-        if removed_down == 0 and removed_right == 0:
-            image = image[:, removed_up:, removed_left:]
-            label = label[:, removed_up:, removed_left:]
-            heatmap_points = clip_heatmaps(heatmap_points, removed_left, inf, removed_up, inf)
-        elif removed_down == 0:
-            image = image[:, removed_up:, removed_left:-removed_right]
-            label = label[:, removed_up:, removed_left:-removed_right]
-            heatmap_points = clip_heatmaps(heatmap_points, removed_left, removed_left+self.width, removed_up, inf)
-        elif removed_right == 0:
-            image = image[:, removed_up:-removed_down, removed_left:]
-            label = label[:, removed_up:-removed_down, removed_left:]
-            heatmap_points = clip_heatmaps(heatmap_points, removed_left, inf, removed_up, removed_up+self.width)
-        else:
-            image = image[:, removed_up:-removed_down, removed_left:-removed_right]
-            label = label[:, removed_up:-removed_down, removed_left:-removed_right]
-            heatmap_points = clip_heatmaps(heatmap_points, removed_left, removed_left+self.width, removed_up, removed_up+self.height)
-
-        return {'image': image, 'label': label, 'heatmaps': heatmap_points, 'scale': sample['scale']}
-
+        max_x = inf if removed_right == 0 else self.width
+        max_y = inf if removed_down == 0 else (self.height if removed_right else self.width)
+
+        points = points - np.array([left, top])
+        keep = (points[:, 0] >= 0) & (points[:, 0] < max_x) & (points[:, 1] >= 0) & (points[:, 1] < max_y)
+        return image, label_out, channels[keep], points[keep]
+
+    def augment_dict(self, sample, points_key='heatmaps'):
+        channels, points = heatmaps_to_arrays(sample[points_key])
+        image, label, new_channels, points = self.crop_arrays(sample['image'], sample['label'], channels, points)
+        # Channels that had points stay in the dict
+        heatmap_points = arrays_to_heatmaps(new_channels, points, keys=dict.fromkeys(channels.tolist()))
+
+        res = {'image': image, 'label': label, points_key: heatmap_points}
+        if 'scale' in sample:
+            res['scale'] = sample['scale']
+        return res
 
     def augment_dict_furu(self, sample):
-        image, label = sample['image'], sample['label']
-        heatmap_points = sample['heatmap_points']
-        img_w = image.shape[2]
-        img_h = image.shape[1]
-        pad_w = int(self.width / 2)
-        pad_h = int(self.height / 2)
-
-        new_w = self.width + img_w
-        new_h = self.height + img_h
-
-        new_image = torch.full([image.shape[0], new_h, new_w], 255)
-        new_image[:, pad_h:img_h+pad_h, pad_w:img_w+pad_w] = image
-
-        new_rooms = torch.full((1, new_h, new_w), self.fill[0])
-        new_rooms[:, pad_h:img_h+pad_h, pad_w:img_w+pad_w] = label[0]
-        new_icons = torch.full((1, new_h, new_w), self.fill[1])
-        new_icons[:, pad_h:img_h+pad_h, pad_w:img_w+pad_w] = label[1]
-
-        label = torch.cat((new_rooms, new_icons), 0)
-        image = new_image
-
-        removed_up = random.randint(0, new_h - self.width)
-        removed_left = random.randint(0, new_w - self.height)
-
-        removed_down = new_h - self.height - removed_up
-        removed_right = new_w - self.width - removed_left
-
-        new_heatmap_points = dict()
-        for junction_type, points in heatmap_points.items():
-            new_heatmap_points_per_type = []
-            for point in points:
-                new_heatmap_points_per_type.append([point[0]+pad_w, point[1]+pad_h])
-
-                new_heatmap_points[junction_type] = new_heatmap_points_per_type
-
-        heatmap_points = new_heatmap_points
-
-        if removed_down == 0 and removed_right == 0:
-            image = image[:, removed_up:, removed_left:]
-            label = label[:, removed_up:, removed_left:]
-            heatmap_points = clip_heatmaps(heatmap_points, removed_left, inf, removed_up, inf)
-        elif removed_down == 0:
-            image = image[:, removed_up:, removed_left:-removed_right]
-            label = label[:, removed_up:, removed_left:-removed_right]
-            heatmap_points = clip_heatmaps(heatmap_points, removed_left, removed_left+self.width, removed_up, inf)
-        elif removed_right == 0:
-            image = image[:, removed_up:-removed_down, removed_left:]
-            label = label[:, removed_up:-removed_down, removed_left:]
-            heatmap_points = clip_heatmaps(heatmap_points, removed_left, inf, removed_up, removed_up+self.width)
-        else:
-            image = image[:, removed_up:-removed_down, removed_left:-removed_right]
-            label = label[:, removed_up:-removed_down, removed_left:-removed_right]
-            heatmap_points = clip_heatmaps(heatmap_points, removed_left, removed_left+self.width, removed_up, removed_up+self.height)
-
-        return {'image': image, 'label': label, 'heatmap_points': heatmap_points}
+        return self.augment_dict(sample, 'heatmap_points')
 
 
 class ColorJitterTorch(object):
@@ -494,51 +416,51 @@ class ColorJitterTorch(object):
 
     def __call__(self, sample):
         res = sample
-        image = sample['image']
-        image = self.brightness(image, self.b_var)
-        image = self.contrast(image, self.c_var)
-        image = self.saturation(image, self.s_var)
-        res['image'] = image
+        res['image'] = self.jitter(sample['image'])
 
         return res
 
-    def blend(self, img_1, img_2, var):
-        m = torch.tensor([0], dtype=self.dtype).uniform_(-var, var)
-        alpha = 1 + m
-        res = img_1 * alpha + (1 - alpha) * img_2
-        res = torch.clamp(res, min=0, max=255) 
-
-        return res
+    def get_factors(self, n):
+        """
+        Brightness, contrast and saturation factors of n images, drawn image by image
+        @Return (n, 3) tensor
+        """
+        factors = torch.empty((n, 3), dtype=self.dtype)
+        for i in range(n):
+            for j, var in enumerate((self.b_var, self.c_var, self.s_var)):
+                factors[i, j] = 1 + torch.tensor([0], dtype=self.dtype).uniform_(-var, var)
+        return factors
+
+    def jitter(self, images, factors=None):
+        """
+        Brightness, contrast and saturation jitter in one pass over the images,
+        on the device of the images
+        @Param images: (3, H, W) image or (N, 3, H, W) batch in [0, 255]
+        @Param factors: (N, 3) factors, default get_factors
+        @Return jittered images of the same shape
+        """
+        batch = images.reshape(-1, *images.shape[-3:])
+        if factors is None:
+            factors = self.get_factors(batch.shape[0])
+        factors = factors.to(device=batch.device, dtype=batch.dtype).view(-1, 3, 1, 1, 1)
+        b, c, s = factors.unbind(1)
+
+        res = torch.clamp(batch * b, min=0, max=255)
+        mean_color = self.grayscale(res).mean((1, 2, 3), keepdim=True)
+        res = torch.clamp(res * c + (1 - c) * mean_color, min=0, max=255)
+        res = torch.clamp(res * s + (1 - s) * self.grayscale(res), min=0, max=255)
+
+        return res.reshape(images.shape)
 
     def grayscale(self, img):
-        red = img[0] * 0.299
-        green = img[1] * 0.587
-        blue = img[2] * 0.114
+        # (N, 1, H, W) gray of (N, 3, H, W) images
+        red = img[:, 0] * 0.299
+        green = img[:, 1] * 0.587
+        blue = img[:, 2] * 0.114
         gray = red + green + blue
         gray = torch.clamp(gray, min=0, max=255)
-        res = torch.stack((gray, gray, gray), dim=0)
 
-        return res
-
-    def saturation(self, img, var):
-        res = self.grayscale(img)
-        res = self.blend(img, res, var)
-
-        return res
-
-    def brightness(self, img, var):
-        res = torch.zeros(img.shape)
-        res = self.blend(img, res, var)
-
-        return res
-
-    def contrast(self, img, var):
-        res = self.grayscale(img)
-        mean_color = res.mean()
-        res = torch.full(res.shape, mean_color)
-        res = self.blend(img, res, var)
-
-        return res
+        return gray.unsqueeze(1)
 
 
 class ResizePaddedTorch(object):
@@ -580,50 +502,44 @@ class ResizePaddedTorch(object):
 
     def augment_dict_furu(self, sample):
         image, label = sample['image'], sample['label']
-        heatmap_points = sample['heatmap_points']
 
-        rooms_padded, _, _, _ = self.resize_padded(label[[0]], self.size, mode='nearest', fill_cval=self.fill[0])
-        icons_padded, ratio, y_pad, x_pad = self.resize_padded(label[[1]], self.size, mode='nearest', fill_cval=self.fill[1])
-        label = torch.cat((rooms_padded, icons_padded), dim=0)
-
-        new_heatmap_points = dict()
-        for junction_type, points in heatmap_points.items():
-            new_heatmap_points_per_type = []
-            for point in points:
-                # Indexing starts from 0 but when we multiply with the ratio we need to start from 0.
-                new_x = point[0] * ratio + x_pad
-                new_y = point[1] * ratio + y_pad
-                new_heatmap_points_per_type.append([new_x, new_y])
-                new_heatmap_points[junction_type] = new_heatmap_points_per_type
-
-        heatmap_points = new_heatmap_points
+        label, ratio, y_pad, x_pad = self.resize_label(label)
+        channels, points = heatmaps_to_arrays(sample['heatmap_points'])
+        points = self.resize_points(points, ratio, x_pad, y_pad)
+        heatmap_points = arrays_to_heatmaps(channels, points)
 
         return {'image': image, 'label': label, 'heatmap_points': heatmap_points}
 
     def augment_dict(self, sample):
         image, label = sample['image'], sample['label']
-        heatmap_points = sample['heatmaps']
         scale = sample['scale']
 
+        label, ratio, y_pad, x_pad = self.resize_label(label)
+        channels, points = heatmaps_to_arrays(sample['heatmaps'])
+        points = self.resize_points(points, ratio, x_pad, y_pad)
+        # Only channels with points inside the resized plan stay in the dict
+        keep = (points[:, 0] >= 0) & (points[:, 0] < self.width) & (points[:, 1] >= 0) & (points[:, 1] < self.height)
+        heatmap_points = arrays_to_heatmaps(channels[keep], points[keep])
+
+        return {'image': image, 'label': label, 'heatmaps': heatmap_points, 'scale': scale}
+
+    def resize_label(self, label):
         rooms_padded, _, _, _ = self.resize_padded(label[[0]], self.size, mode='nearest', fill_cval=self.fill[0])
         icons_padded, ratio, y_pad, x_pad = self.resize_padded(label[[1]], self.size, mode='nearest', fill_cval=self.fill[1])
         label = torch.cat((rooms_padded, icons_padded), dim=0)
 
-        new_heatmap_points = dict()
-        for junction_type, points in heatmap_points.items():
-            new_heatmap_points_per_type = []
-            for point in points:
-                # Indexing starts from 0 but when we multiply with the ratio we need to start from 0.
-                new_x = point[0] * ratio + x_pad
-                new_y = point[1] * ratio + y_pad
-                if new_y < 256 and new_x < 256 and new_y >= 0 and new_x >= 0:
-                    # __import__('ipdb').set_trace()
-                    new_heatmap_points_per_type.append([new_x, new_y])
-                    new_heatmap_points[junction_type] = new_heatmap_points_per_type
+        return label, ratio, y_pad, x_pad
 
-        heatmap_points = new_heatmap_points
+    def resize_points(self, points, ratio, x_pad, y_pad):
+        """
+        Heatmap points in the resized and padded plan
+        @Param points: (n, 2) points
+        @Return (n, 2) float32 points
+        """
+        # Same single precision as scaling the points with the ratio tensor
+        points = points.astype(np.float32) * np.float32(ratio) + np.array([x_pad, y_pad], dtype=np.float32)
 
-        return {'image': image, 'label': label, 'heatmaps': heatmap_points, 'scale': scale}
+        return points
 
     def resize_padded(self, img, new_shape, image=False, fill_cval=0, mode='nearest',
                       aling_corners=None):
@@ -634,7 +550,7 @@ class ResizePaddedTorch(object):
         img_s = torch.tensor(img.shape[1:], dtype=self.dtype)
         interm_shape = (ratio * img_s).ceil()
 
-        interm_shape = [interm_shape[0], interm_shape[1]]
+        interm_shape = [int(interm_shape[0]), int(interm_shape[1])]
 
         img = img.unsqueeze(0)
         interm_img = torch.nn.functional.interpolate(img, size=interm_shape, mode=mode, align_corners=aling_corners)
@@ -642,7 +558,8 @@ class ResizePaddedTorch(object):
 
         a = (interm_img.shape[0], self.size[0], self.size[1])
 
-        new_img = torch.full(a, fill_cval)
+        # Integer fills would make the result an integer tensor
+        new_img = torch.full(a, fill_cval, dtype=interm_img.dtype)
 
         x_pad = int((self.width - interm_img.shape[1]) / 2)
         y_pad = int((self.height - interm_img.shape[2]) / 2)
@@ -650,3 +567,96 @@ class ResizePaddedTorch(object):
         new_img[:, x_pad:interm_img.shape[1]+x_pad, y_pad:interm_img.shape[2]+y_pad] = interm_img
 
         return new_img, ratio, x_pad, y_pad
+
+
+class BatchAugmentation(object):
+    """
+    DataLoader collate_fn augmenting FloorplanSVG(is_transform=False) cubi samples
+    as a batch. Every plan is randomly cropped or resized straight into its slot
+    of the batch, rotated, and gets its heatmaps rendered from the points.
+    Colour jitter and normalization run once over the whole batch, or on the
+    training device when on_device is set:
+        images = augmentation.finish(batch['image'].to(device), batch['jitter'])
+    Random numbers are drawn in the order of Compose([RandomCropToSizeTorch or
+    ResizePaddedTorch, RandomRotations('cubi'), DictToTensor(), ColorJitterTorch()])
+    applied plan by plan, so a batch equals the plans augmented one by one.
+    @Param size: square crop size, rotations swap height and width
+    @Param fill: room and icon fill outside of the plan
+    @Param resize_probability: share of plans resized instead of cropped
+    @Param rotate: random 0, 1 or 2 clock wise turns
+    @Param jitter: ColorJitterTorch or None
+    @Param img_norm: scale images to [-1, 1] as FloorplanSVG.transform
+    @Param on_device: leave jitter and normalization to finish
+    """
+
+    ROTATED_CHANNELS = np.array([1, 2, 3, 0, 5, 6, 7, 4, 9, 10, 11, 8, 12,
+                                 15, 16, 14, 13, 18, 20, 17, 19])
+
+    def __init__(self, size=(256, 256), fill=(0, 0), resize_probability=0.5, rotate=True,
+                 jitter=ColorJitterTorch(), img_norm=True, on_device=False):
+        if size[0] != size[1]:
+            raise ValueError(f"BatchAugmentation needs a square size, got {size}")
+        self.size = size
+        self.crop = RandomCropToSizeTorch(size=size, fill=fill, data_format='dict')
+        self.resize = ResizePaddedTorch(fill, size=size, data_format='dict')
+        self.resize_probability = resize_probability
+        self.rotate = rotate
+        self.jitter = jitter
+        self.img_norm = img_norm
+        self.on_device = on_device
+
+    def __call__(self, samples):
+        n = len(samples)
+        height, width = self.crop.height, self.crop.width
+        images = torch.empty((n, 3, height, width))
+        labels = torch.empty((n, 23, height, width))
+        factors = torch.ones((n, 3))
+
+        for i, sample in enumerate(samples):
+            turns = int(torch.randint(0, 3, (1,))) if self.rotate else 0
+            if random.random() < self.resize_probability:
+                resized = self.resize(dict(sample))
+                image, label = resized['image'], resized['label']
+                channels, points = heatmaps_to_arrays(resized['heatmaps'])
+            else:
+                # Crops that are not rotated are written to the batch directly
+                out = (images[i], labels[i, 21:]) if turns == 0 else (None, None)
+                channels, points = heatmaps_to_arrays(sample['heatmaps'])
+                image, label, channels, points = self.crop.crop_arrays(sample['image'], sample['label'],
+                                                                       channels, points, *out)
+
+            for _ in range(turns):
+                image = image.transpose(2, 1).flip(2)
+                label = label.transpose(2, 1).flip(2)
+                channels = self.ROTATED_CHANNELS[channels]
+                # x of a turned point is taken from the height before the turn
+                points = np.column_stack((image.shape[2] - 1 - points[:, 1], points[:, 0]))
+
+            images[i] = image
+            labels[i, 21:] = label
+            labels[i, :21] = torch.from_numpy(DictToTensor.render(channels, points, height, width,
+                                                                  sample['scale']))
+            if self.jitter is not None:
+                factors[i] = self.jitter.get_factors(1)[0]
+
+        batch = {'image': images, 'label': labels, 'folder': [s.get('folder') for s in samples]}
+        if self.on_device:
+            batch['jitter'] = factors
+        else:
+            batch['image'] = self.finish(images, factors)
+
+        return batch
+
+    def finish(self, images, factors=None):
+        """
+        Jitter and normalize a batch of images, on any device
+        @Param images: (N, 3, H, W) images in [0, 255]
+        @Param factors: (N, 3) jitter factors of the batch, default new ones
+        @Return (N, 3, H, W) images
+        """
+        if self.jitter is not None:
+            images = self.jitter.jitter(images, factors)
+        if self.img_norm:
+            images = 2 * (images / 255.0) - 1
+
+        return images
@@ -0,0 +1,211 @@
+import os
+import math
+import random
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Sampler
+
+from utils.loaders.label_store import decode_heatmaps
+from utils.loaders.dataset_index import read_png_size
+
+'''
+Collate
+Batches of variable size FloorplanSVG samples. Plans of a batch are padded to
+the bucket multiple above the largest of them, heatmap points of all plans are
+packed into one (n, 3) array with offsets per plan, so batches are plain
+tensors that DataLoader workers can send and pin_memory can pin:
+  image    (N, 3, H, W) padded with image_fill
+  label    (N, C, H, W) padded with 0
+  sizes    (N, 2) height, width of every plan
+  points   (n, 3) heatmap points as (channel, x, y), int64, or float32 when
+           a plan has points between pixels, e.g. after ResizePaddedTorch
+  offsets  (N + 1,) points of plan i are points[offsets[i]:offsets[i + 1]]
+  scale    (N,) float64
+  folder   list of plan folders, None for samples without one
+Points and offsets are only in batches of samples with heatmaps and scale
+only in batches of samples with a scale, e.g. not after DictToTensor.
+'''
+
+BUCKET = 32
+
+
+def bucket_size(size, bucket=BUCKET):
+    return int(math.ceil(size / bucket) * bucket)
+
+
+class PaddedCollate(object):
+    """
+    collate_fn of FloorplanSVG samples of any size
+    @Param bucket: padded sizes are multiples of this
+    @Param image_fill: image value of the padding, 1 is white for normalized images
+    """
+
+    def __init__(self, bucket=BUCKET, image_fill=1.0):
+        self.bucket = bucket
+        self.image_fill = image_fill
+
+    def __call__(self, samples):
+        sizes = torch.tensor([s['image'].shape[1:] for s in samples], dtype=torch.int64).reshape(-1, 2)
+        height = bucket_size(int(sizes[:, 0].max()), self.bucket)
+        width = bucket_size(int(sizes[:, 1].max()), self.bucket)
+
+        n = len(samples)
+        image = samples[0]['image']
+        label = samples[0]['label']
+        images = torch.full((n, image.shape[0], height, width), self.image_fill, dtype=image.dtype)
+        labels = torch.zeros((n, label.shape[0], height, width), dtype=label.dtype)
+        for i, s in enumerate(samples):
+            h, w = s['image'].shape[1:]
+            images[i, :, :h, :w] = s['image']
+            labels[i, :, :h, :w] = s['label']
+
+        batch = {'image': images, 'label': labels, 'sizes': sizes,
+                 'folder': [s.get('folder') for s in samples]}
+        if 'heatmaps' in samples[0]:
+            batch['points'], batch['offsets'] = pack_heatmaps([s['heatmaps'] for s in samples])
+        if 'scale' in samples[0]:
+            batch['scale'] = torch.tensor([s['scale'] for s in samples], dtype=torch.float64)
+        return batch
+
+
+def pack_heatmaps(heatmaps):
+    """
+    Heatmap dicts of a batch as one array, points are not rounded
+    @Param heatmaps: list of dicts channel -> list of (x, y)
+    @Return (n, 3) int64 or float32 tensor of (channel, x, y), (N + 1,) int64 offsets
+    """
+    points = [np.array([(c, x, y) for c, coords in h.items() for x, y in coords]).reshape(-1, 3)
+              for h in heatmaps]
+    dtype = np.float32 if any(p.dtype.kind == 'f' for p in points) else np.int64
+    offsets = np.zeros(len(points) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(p) for p in points])
+    return torch.from_numpy(np.concatenate(points).astype(dtype)), torch.from_numpy(offsets)
+
+
+def get_sample(batch, i):
+    """
+    Plan i of a PaddedCollate batch without its padding, shaped like a batch
+    of one sample of the default collate
+    @Return dict with (1, 3, h, w) image, (1, C, h, w) label, folder list,
+            and heatmaps dict and scale if the batch has them
+    """
+    h, w = batch['sizes'][i].tolist()
+    sample = {'image': batch['image'][i:i + 1, :, :h, :w], 'label': batch['label'][i:i + 1, :, :h, :w],
+              'folder': [batch['folder'][i]]}
+    if 'points' in batch:
+        points = batch['points'][batch['offsets'][i]:batch['offsets'][i + 1]]
+        sample['heatmaps'] = decode_heatmaps(points.numpy())
+    if 'scale' in batch:
+        sample['scale'] = batch['scale'][i:i + 1]
+    return sample
+
+
+def iter_samples(loader):
+    """Plans of a PaddedCollate loader one by one, see get_sample"""
+    for batch in loader:
+        for i in range(len(batch['folder'])):
+            yield get_sample(batch, i)
+
+
+def plan_sizes(dataset):
+    """
+    Height and width of every plan of a FloorplanSVG, from the png headers
+    @Return (n, 2) int64 array
+    """
+    name = dataset.org_image_file_name if dataset.original_size else dataset.image_file_name
+    sizes = [read_png_size(dataset.data_folder + folder + name)[::-1] for folder in dataset.folders]
+    return np.array(sizes, dtype=np.int64).reshape(-1, 2)
+
+
+class BucketBatchSampler(Sampler):
+    """
+    Batches of plans of the same padded size, so little of a batch is padding
+    @Param sizes: (n, 2) height, width of the plans, e.g. plan_sizes
+    @Param batch_size: plans per batch
+    @Param bucket: as PaddedCollate
+    @Param shuffle: shuffle plans within a bucket and the order of the batches
+    @Param seed: random seed, batches change every epoch
+    @Param drop_last: drop the last, smaller batch of every bucket
+    """
+
+    def __init__(self, sizes, batch_size, bucket=BUCKET, shuffle=False, seed=None, drop_last=False):
+        sizes = np.asarray(sizes).reshape(-1, 2)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.rng = random.Random(seed)
+        self.buckets = {}
+        for i, (h, w) in enumerate(sizes.tolist()):
+            self.buckets.setdefault((bucket_size(h, bucket), bucket_size(w, bucket)), []).append(i)
+
+    def get_batches(self):
+        batches = []
+        for key in sorted(self.buckets):
+            indices = list(self.buckets[key])
+            if self.shuffle:
+                self.rng.shuffle(indices)
+            for i in range(0, len(indices), self.batch_size):
+                if not self.drop_last or i + self.batch_size <= len(indices):
+                    batches.append(indices[i:i + self.batch_size])
+        if self.shuffle:
+            self.rng.shuffle(batches)
+        return batches
+
+    def __iter__(self):
+        return iter(self.get_batches())
+
+    def __len__(self):
+        if self.drop_last:
+            return sum(len(b) // self.batch_size for b in self.buckets.values())
+        return sum(-(-len(b) // self.batch_size) for b in self.buckets.values())
+
+
+def available_cores():
+    """Cores this process may run on, cpu_count ignores affinity and cgroup cpusets"""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def get_loader(dataset, batch_size=8, num_workers=None, pin_memory=None, prefetch_factor=2,
+               bucket=BUCKET, sizes=None, shuffle=False, seed=None, image_fill=1.0, collate_fn=None,
+               persistent_workers=False):
+    """
+    DataLoader of a FloorplanSVG using all cores
+    @Param dataset: FloorplanSVG
+    @Param batch_size: plans per batch
+    @Param num_workers: loader processes, default the cores this process may use,
+                        at most one per batch
+    @Param pin_memory: pin batches for faster copies to the GPU, default if cuda is available
+    @Param prefetch_factor: batches loaded ahead by every worker
+    @Param bucket: as PaddedCollate
+    @Param sizes: plan sizes, batches plans of the same padded size with
+                  BucketBatchSampler if given, else batches follow the split order
+    @Param shuffle: shuffle the plans
+    @Param seed: random seed of BucketBatchSampler
+    @Param image_fill: as PaddedCollate
+    @Param collate_fn: other collate, e.g. BatchAugmentation, default PaddedCollate
+    @Param persistent_workers: keep the workers and their lmdb and memmap readers
+                               between epochs, for training
+    @Return DataLoader
+    """
+    if num_workers is None:
+        num_workers = available_cores()
+    # No more workers than batches, each worker loads whole batches
+    num_workers = min(num_workers, len(dataset) // batch_size or 1)
+    if pin_memory is None:
+        pin_memory = torch.cuda.is_available()
+    if collate_fn is None:
+        collate_fn = PaddedCollate(bucket, image_fill)
+
+    kwargs = {}
+    if num_workers > 0:
+        kwargs = {'prefetch_factor': prefetch_factor, 'persistent_workers': persistent_workers}
+
+    if sizes is not None:
+        batch_sampler = BucketBatchSampler(sizes, batch_size, bucket, shuffle, seed)
+        return DataLoader(dataset, batch_sampler=batch_sampler, num_workers=num_workers,
+                          collate_fn=collate_fn, pin_memory=pin_memory, **kwargs)
+
+    return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle, num_workers=num_workers,
+                      collate_fn=collate_fn, pin_memory=pin_memory, **kwargs)
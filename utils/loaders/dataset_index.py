@@ -0,0 +1,153 @@
+import os
+import random
+import struct
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+'''
+Dataset index
+Sizes of all CubiCasa plans, built once from the PNG headers and saved next to
+the data, so selecting plans by size doesn't read every image of the dataset.
+The index is rebuilt when a category folder changes.
+'''
+
+CATEGORIES = ['high_quality_architectural', 'high_quality', 'colorful']
+INDEX_FILE = 'cubicasa_index.npz'
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def read_png_size(path):
+    """
+    Width and height from the IHDR chunk, the first 24 bytes of a png file
+    @Param path: png file
+    @Return width, height
+    """
+    with open(path, 'rb') as f:
+        header = f.read(24)
+    if len(header) < 24 or header[:8] != PNG_SIGNATURE or header[12:16] != b'IHDR':
+        raise ValueError(path + " is not a png file")
+    return struct.unpack('>II', header[16:24])
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return -1
+
+
+def index_plan(data_path, category, plan):
+    """
+    Index entry of a plan
+    @Return width, height of F1_original.png, sizes in bytes of F1_original.png,
+            F1_scaled.png and model.svg, -1 for missing files
+    """
+    folder = os.path.join(data_path, category, plan)
+    width, height = read_png_size(os.path.join(folder, 'F1_original.png'))
+    return (width, height, file_size(os.path.join(folder, 'F1_original.png')),
+            file_size(os.path.join(folder, 'F1_scaled.png')), file_size(os.path.join(folder, 'model.svg')))
+
+
+def get_category_mtimes(data_path, categories):
+    return np.array([os.stat(os.path.join(data_path, c)).st_mtime_ns for c in categories], dtype=np.int64)
+
+
+class DatasetIndex(object):
+    """
+    Plans of the dataset with their sizes, sorted by category and folder
+    @Param data_path: CubiCasa data folder
+    @Param columns: dict of equally long arrays, categories, plans, widths,
+                    heights, original_bytes, scaled_bytes, svg_bytes
+    """
+
+    COLUMNS = ['categories', 'plans', 'widths', 'heights', 'original_bytes', 'scaled_bytes', 'svg_bytes']
+
+    def __init__(self, data_path, columns):
+        self.data_path = data_path
+        for name in self.COLUMNS:
+            setattr(self, name, columns[name])
+
+    def __len__(self):
+        return len(self.plans)
+
+    def subset(self, mask):
+        return DatasetIndex(self.data_path, {name: getattr(self, name)[mask] for name in self.COLUMNS})
+
+    def filter(self, width_below=None, height_below=None, categories=None):
+        """
+        Plans by F1_original size and category
+        @Param width_below: only plans narrower than this
+        @Param height_below: only plans lower than this
+        @Param categories: list of categories to keep
+        @Return DatasetIndex
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if width_below is not None:
+            mask &= self.widths < width_below
+        if height_below is not None:
+            mask &= self.heights < height_below
+        if categories is not None:
+            mask &= np.isin(self.categories, categories)
+        return self.subset(mask)
+
+    def sample(self, number, seed=None):
+        """
+        Seeded random plans, the same for the same index and seed
+        @Param number: plans to take
+        @Param seed: random seed
+        @Return DatasetIndex
+        """
+        rng = random.Random(seed)
+        return self.subset(np.array(rng.sample(range(len(self)), number), dtype=np.int64))
+
+    def folders(self):
+        """Plan folders as used by FloorplanSVG with an empty data_folder"""
+        return [self.data_path + '/' + c + '/' + p + '/' for c, p in zip(self.categories, self.plans)]
+
+
+def build_index(data_path, categories=CATEGORIES, workers=16):
+    """
+    Index all plans, their png headers are read on a thread pool
+    @Param data_path: CubiCasa data folder
+    @Param categories: category folders
+    @Param workers: reading threads
+    @Return DatasetIndex
+    """
+    entries = []
+    for category in categories:
+        with os.scandir(os.path.join(data_path, category)) as plans:
+            entries += sorted((category, plan.name) for plan in plans
+                              if os.path.isfile(os.path.join(plan.path, 'F1_original.png')))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        rows = list(pool.map(lambda e: index_plan(data_path, *e), entries))
+
+    rows = np.array(rows, dtype=np.int64).reshape(-1, 5)
+    columns = {'categories': np.array([c for c, _ in entries], dtype=str),
+               'plans': np.array([p for _, p in entries], dtype=str)}
+    for i, name in enumerate(DatasetIndex.COLUMNS[2:]):
+        columns[name] = rows[:, i]
+    return DatasetIndex(data_path, columns)
+
+
+def load_index(data_path, categories=CATEGORIES, index_file=INDEX_FILE, rebuild=False):
+    """
+    Saved index of the dataset, built and saved if missing or outdated
+    @Param data_path: CubiCasa data folder
+    @Param categories: category folders
+    @Param index_file: index file in data_path
+    @Param rebuild: build even if the saved index is current
+    @Return DatasetIndex
+    """
+    path = os.path.join(data_path, index_file)
+    mtimes = get_category_mtimes(data_path, categories)
+    if not rebuild and os.path.exists(path):
+        with np.load(path, allow_pickle=False) as saved:
+            if (list(saved['index_categories']) == list(categories)
+                    and np.array_equal(saved['category_mtimes'], mtimes)):
+                return DatasetIndex(data_path, {name: saved[name] for name in DatasetIndex.COLUMNS})
+
+    index = build_index(data_path, categories)
+    np.savez(path, index_categories=np.array(categories, dtype=str), category_mtimes=mtimes,
+             **{name: getattr(index, name) for name in DatasetIndex.COLUMNS})
+    return index
@@ -1,7 +1,7 @@
 import math
+import bisect
 import numpy as np
-from utils.loaders.svg_utils import PolygonWall, get_polygon, calc_distance, get_room_number, get_icon, get_icon_number, get_points, get_direction, get_gaussian2D
-from xml.dom import minidom
+from utils.loaders.svg_utils import PolygonWall, get_polygon, calc_distance, get_room_number, get_icon, get_icon_number, get_points, get_direction, get_gaussian2D, iter_groups, PointGrid, render_heatmaps
 from skimage.draw import polygon
 import cv2
 
@@ -359,7 +359,6 @@ class House:
         self.height = height
         self.width = width
         shape = height, width
-        svg = minidom.parse(path)
         self.walls = np.empty((height, width), dtype=np.uint8)
         self.walls.fill(0)
         self.wall_ids = np.empty((height, width), dtype=np.uint8)
@@ -386,7 +385,7 @@ class House:
 
         self.icon_areas = []
 
-        for e in svg.getElementsByTagName('g'):
+        for e in iter_groups(path):
             try: 
                 if e.getAttribute("id") == "Wall":
                     wall = PolygonWall(e, wall_id, shape)
@@ -602,137 +601,52 @@ class House:
 
         return tensor
 
+    def get_heatmap_points(self):
+        """
+        Points of the heatmap channels, junctions with rounded coordinates, then
+        opening and icon corners with truncated ones, points outside are dropped
+        @Return (n, 3) int64 array of (channel, x, y)
+        """
+        channels, coords = [], []
+        for cord, _, p_type in self.points:
+            channels.append(self.get_number(p_type) - 1)
+            coords.append(cord[:2])
+        coords = np.round(np.array(coords, dtype=np.float64).reshape(-1, 2))
+
+        corners = [self.opening_corners['left'], self.opening_corners['right'],
+                   self.opening_corners['up'], self.opening_corners['down'],
+                   self.icon_corners['upper_left'], self.icon_corners['upper_right'],
+                   self.icon_corners['lower_left'], self.icon_corners['lower_right']]
+        corner_coords = []
+        for channel, corner_list in enumerate(corners, 13):
+            channels += [channel] * len(corner_list)
+            corner_coords += [c[:2] for c in corner_list]
+        corner_coords = np.trunc(np.array(corner_coords, dtype=np.float64).reshape(-1, 2))
+
+        xy = np.concatenate((coords, corner_coords)).astype(np.int64)
+        points = np.column_stack((np.array(channels, dtype=np.int64), xy))
+        inside = (points[:, 2] < self.height) & (points[:, 1] < self.width)
+        return points[inside]
+
     def get_heatmap_dict(self):
-        # init dict
-        heatmaps = {}
-        for i in range(21):
-            heatmaps[i] = []
-
-        for p in self.points:
-            cord, _, p_type = p
-            x = int(np.round(cord[0]))
-            y = int(np.round(cord[1]))
-            channel = self.get_number(p_type)
-            if y < self.height and x < self.width:
-                heatmaps[channel-1] = heatmaps[channel-1] + [(x, y)]
-
-        channel = 13
-        for i in self.opening_corners['left']:
-            y = int(i[1])
-            x = int(i[0])
-            if y < self.height and x < self.width:
-                heatmaps[channel] = heatmaps[channel] + [(x, y)]
-        channel += 1
-        for i in self.opening_corners['right']:
-            y = int(i[1])
-            x = int(i[0])
-            if y < self.height and x < self.width:
-                heatmaps[channel] = heatmaps[channel] + [(x, y)]
-        channel += 1
-        for i in self.opening_corners['up']:
-            y = int(i[1])
-            x = int(i[0])
-            if y < self.height and x < self.width:
-                heatmaps[channel] = heatmaps[channel] + [(x, y)]
-        channel += 1
-        for i in self.opening_corners['down']:
-            y = int(i[1])
-            x = int(i[0])
-            if y < self.height and x < self.width:
-                heatmaps[channel] = heatmaps[channel] + [(x, y)]
-        channel += 1
-
-        for i in self.icon_corners['upper_left']:
-            y = int(i[1])
-            x = int(i[0])
-            if y < self.height and x < self.width:
-                heatmaps[channel] = heatmaps[channel] + [(x, y)]
-        channel += 1
-        for i in self.icon_corners['upper_right']:
-            y = int(i[1])
-            x = int(i[0])
-            if y < self.height and x < self.width:
-                heatmaps[channel] = heatmaps[channel] + [(x, y)]
-        channel += 1
-        for i in self.icon_corners['lower_left']:
-            y = int(i[1])
-            x = int(i[0])
-            if y < self.height and x < self.width:
-                heatmaps[channel] = heatmaps[channel] + [(x, y)]
-        channel += 1
-        for i in self.icon_corners['lower_right']:
-            y = int(i[1])
-            x = int(i[0])
-            if y < self.height and x < self.width:
-                heatmaps[channel] = heatmaps[channel] + [(x, y)]
+        heatmaps = {i: [] for i in range(21)}
+        for channel, x, y in self.get_heatmap_points().tolist():
+            heatmaps[channel].append((x, y))
 
         return heatmaps
 
-    def get_heatmaps(self):
-        heatmaps = np.zeros((21, self.height, self.width))
-        for p in self.points:
-            cord, _, p_type = p
-            x = int(np.round(cord[0]))
-            y = int(np.round(cord[1]))
-            channel = self.get_number(p_type)
-            if y < self.height and x < self.width:
-                heatmaps[channel-1, y, x] = 1
-
-        channel = 13
-        for i in self.opening_corners['left']:
-            y = int(i[1])
-            x = int(i[0])
-            if y < self.height and x < self.width:
-                heatmaps[channel, y, x] = 1
-        channel += 1
-        for i in self.opening_corners['right']:
-            y = int(i[1])
-            x = int(i[0])
-            if y < self.height and x < self.width:
-                heatmaps[channel, y, x] = 1
-        channel += 1
-        for i in self.opening_corners['up']:
-            y = int(i[1])
-            x = int(i[0])
-            if y < self.height and x < self.width:
-                heatmaps[channel, y, x] = 1
-        channel += 1
-        for i in self.opening_corners['down']:
-            y = int(i[1])
-            x = int(i[0])
-            if y < self.height and x < self.width:
-                heatmaps[channel, y, x] = 1
-        channel += 1
-
-        for i in self.icon_corners['upper_left']:
-            y = int(i[1])
-            x = int(i[0])
-            if y < self.height and x < self.width:
-                heatmaps[channel, y, x] = 1
-        channel += 1
-        for i in self.icon_corners['upper_right']:
-            y = int(i[1])
-            x = int(i[0])
-            if y < self.height and x < self.width:
-                heatmaps[channel, y, x] = 1
-        channel += 1
-        for i in self.icon_corners['lower_left']:
-            y = int(i[1])
-            x = int(i[0])
-            if y < self.height and x < self.width:
-                heatmaps[channel, y, x] = 1
-        channel += 1
-        for i in self.icon_corners['lower_right']:
-            y = int(i[1])
-            x = int(i[0])
-            if y < self.height and x < self.width:
-                heatmaps[channel, y, x] = 1
-
-        kernel = get_gaussian2D(13)
-        for i, h in enumerate(heatmaps):
-            heatmaps[i] = cv2.filter2D(h, -1, kernel)
+    def get_heatmaps(self, ndim=13):
+        """
+        Gaussian heatmaps of the points, as a filter2D of single pixel maps
+        @Param ndim: kernel size
+        @Return (21, height, width) float32 array
+        """
+        points = self.get_heatmap_points()
+        # Negative coordinates index from the end, as they did on the array
+        points[:, 1] %= self.width
+        points[:, 2] %= self.height
 
-        return heatmaps
+        return render_heatmaps(points, 21, self.height, self.width, get_gaussian2D(ndim))
 
     def _clip_outside(self, rr, cc):
         s = np.column_stack((rr, cc))
@@ -912,12 +826,18 @@ class House:
         lookuptable[12] = {0: 12, 1: 12, 2: 12, 3: 12, 4: 12,
                            5: 12, 6: 12, 7: 12, 8: 12, 9: 12, 10: 12, 11: 12, 12: 12}
 
+        # Only points in the grid cells around a point can be close to it
+        grid = PointGrid(wall_width)
+        for j, point2 in enumerate(points):
+            grid.add(j, point2[0])
+
         newPoints = []
         merged = [False] * len(points)
         for i, point1 in enumerate(points):
             if merged[i] is False:
                 pool = [point1]
-                for j, point2 in enumerate(points):
+                for j in sorted(grid.query(point1[0], wall_width)):
+                    point2 = points[j]
                     if j != i and merged[j] is False and self._are_close(point1[0], point2[0], wall_width):
                         merged[j] = True
                         pool.append(point2)
@@ -957,35 +877,67 @@ class House:
         new_walls = []
         num_walls = len(walls)
         remaining_walls = list(range(1, num_walls + 1))
+        walls_by_id = {}
+        for wall in reversed(walls):
+            walls_by_id[wall.id] = wall
+
+        # Walls only merge if one starts within 1.5 wall widths of the end of the other
+        radius = 1.5 * max([w.max_width for w in walls], default=0)
+        start_grid, end_grid = PointGrid(radius), PointGrid(radius)
+        for wall_id in remaining_walls:
+            wall = walls_by_id.get(wall_id)
+            start_grid.add(wall_id, wall.end_points[0])
+            end_grid.add(wall_id, wall.end_points[1])
 
         # getting pillars
         remaining_pillar_ids = []
         for p_id in range(1, num_walls + 1):
-            p_wall = self.find_wall_by_id(p_id, walls)
+            p_wall = walls_by_id.get(p_id)
             if p_wall.wall_is_pillar(self.avg_wall_width):
-                for wall_id in range(1, num_walls + 1):
-                    wall = self.find_wall_by_id(wall_id, walls)
+                for wall_id in self._merge_candidates(p_wall, start_grid, end_grid, radius):
+                    wall = walls_by_id.get(wall_id)
                     if p_wall.merge_possible(wall):
                         break
                 else:
                     remaining_walls.pop(remaining_walls.index(p_wall.id))
                     remaining_pillar_ids.append(p_wall.id)
 
+        for p_id in remaining_pillar_ids:
+            self._remove_from_grids(walls_by_id.get(p_id), start_grid, end_grid)
+
         while (len(remaining_walls) > 0):
             new_wall_id = remaining_walls.pop(0)
-            new_wall = self.find_wall_by_id(new_wall_id, walls)
+            new_wall = walls_by_id.get(new_wall_id)
+            self._remove_from_grids(new_wall, start_grid, end_grid)
 
             found = True
             while (found):
                 found = False
-                for merge_wall_id in remaining_walls:
-                    merged = self.find_wall_by_id(merge_wall_id, walls)
+                # Same walls in the same order as a scan over remaining_walls
+                # popping the merged ones, which skips the wall after a merged
+                # one, but only the walls near new_wall are tried
+                position = 0
+                candidates = self._merge_candidates(new_wall, start_grid, end_grid, radius)
+                i = 0
+                while i < len(candidates) and position < len(remaining_walls):
+                    merge_wall_id = candidates[i]
+                    i += 1
+                    if merge_wall_id < remaining_walls[position]:
+                        continue
+
+                    k = bisect.bisect_left(remaining_walls, merge_wall_id)
+                    position = k + 1
+                    merged = walls_by_id.get(merge_wall_id)
                     temp_wall = new_wall.merge_walls(merged)
 
                     if temp_wall is not None:
-                        remaining_walls.pop(remaining_walls.index(merged.id))
+                        remaining_walls.pop(k)
+                        self._remove_from_grids(merged, start_grid, end_grid)
                         new_wall = temp_wall
                         found = True
+                        # End points moved
+                        candidates = self._merge_candidates(new_wall, start_grid, end_grid, radius)
+                        i = 0
 
             new_walls.append(new_wall)
 
@@ -993,7 +945,7 @@ class House:
         new_wall_id = num_walls + 1
         self.pillar_walls = []
         for id in remaining_pillar_ids:
-            w = self.find_wall_by_id(id, walls)
+            w = walls_by_id.get(id)
             pws = w.split_pillar_wall(new_wall_id, self.avg_wall_width)
             new_wall_id += 4
             for pw in pws:
@@ -1001,6 +953,16 @@ class House:
 
         return new_walls
 
+    def _merge_candidates(self, wall, start_grid, end_grid, radius):
+        # Ids of walls that can end near the start or start near the end of wall, ascending
+        ids = set(end_grid.query(wall.end_points[0], radius))
+        ids.update(start_grid.query(wall.end_points[1], radius))
+        return sorted(ids)
+
+    def _remove_from_grids(self, wall, start_grid, end_grid):
+        start_grid.remove(wall.id, wall.end_points[0])
+        end_grid.remove(wall.id, wall.end_points[1])
+
     def get_number(self, x):
         return (x[1] - 1) * 4 + x[2]
 
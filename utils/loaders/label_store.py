@@ -0,0 +1,197 @@
+import os
+import multiprocessing
+import numpy as np
+import torch
+
+'''
+Label store
+Preprocessed CubiCasa split, built once so FloorplanSVG doesn't parse model.svg
+and rebuild the House of a plan in every epoch. A store is a folder of flat
+files read through memory maps:
+  images.bin   uint8 (3, h, w) images
+  labels.bin   uint8 (2, h, w) segmentation tensors
+  points.bin   int32 (n, 3) heatmap points as (channel, x, y)
+  index.npz    offsets, shapes and scales of every plan, written last
+'''
+
+STORE_FOLDER = 'cubi_store/'
+HEATMAP_CHANNELS = 21
+
+# Dataset of the builder processes, set by init_worker
+_dataset = None
+
+
+def get_store_path(data_folder, data_file, store_folder=STORE_FOLDER, original_size=False):
+    """
+    Folder of the store of a split
+    @Param data_folder: CubiCasa data folder
+    @Param data_file: split file, e.g. train.txt
+    @Param store_folder: folder of all stores, relative to data_folder
+    @Param original_size: if the store holds F1_original sized plans
+    @Return path
+    """
+    name = os.path.splitext(os.path.basename(data_file))[0]
+    if original_size:
+        name += '_original'
+    return os.path.join(data_folder + store_folder, name)
+
+
+def encode_heatmaps(heatmaps):
+    """
+    Heatmap dict to an array
+    @Param heatmaps: dict channel -> list of (x, y)
+    @Return (n, 3) int32 array of (channel, x, y)
+    """
+    points = [(channel, x, y) for channel, coords in heatmaps.items() for x, y in coords]
+    return np.array(points, dtype=np.int32).reshape(-1, 3)
+
+
+def decode_heatmaps(points, n_channels=HEATMAP_CHANNELS):
+    """
+    Array of encode_heatmaps to a heatmap dict
+    @Param points: (n, 3) array of (channel, x, y)
+    @Return dict channel -> list of (x, y)
+    """
+    heatmaps = {i: [] for i in range(n_channels)}
+    for channel, x, y in points.tolist():
+        heatmaps[int(channel)].append((x, y))
+    return heatmaps
+
+
+def init_worker(data_folder, data_file, original_size):
+    global _dataset
+    from utils.loaders.svg_loader import FloorplanSVG
+
+    _dataset = FloorplanSVG(data_folder, data_file, is_transform=False,
+                            format='txt', original_size=original_size)
+
+
+def read_plan(index):
+    """
+    Parse one plan in a builder process
+    @Return uint8 image, uint8 label, int32 points, scale
+    """
+    sample = _dataset.get_txt(index)
+    image = sample['image'].numpy().astype(np.uint8)
+    label = sample['label'].numpy().astype(np.uint8)
+    return image, label, encode_heatmaps(sample['heatmaps']), sample['scale']
+
+
+def build_label_store(data_folder, data_file, store_folder=STORE_FOLDER, original_size=False,
+                      processes=None, chunksize=4, info=False):
+    """
+    Parse all plans of a split in parallel and write them to a store
+    Plans are written in split file order as the processes return them, so only
+    a few parsed plans are held in memory.
+    @Param data_folder: CubiCasa data folder
+    @Param data_file: split file, e.g. train.txt
+    @Param store_folder: folder of all stores, relative to data_folder
+    @Param original_size: store F1_original sized plans, as FloorplanSVG(original_size=True)
+    @Param processes: builder processes, default number of cores
+    @Param chunksize: plans handed to a process at once
+    @Param info: print progress
+    @Return path to the store
+    """
+    from utils.loaders.svg_loader import FloorplanSVG
+
+    path = get_store_path(data_folder, data_file, store_folder, original_size)
+    os.makedirs(path, exist_ok=True)
+    index_path = os.path.join(path, 'index.npz')
+    if os.path.exists(index_path):
+        # A store without index is unfinished
+        os.remove(index_path)
+
+    folders = FloorplanSVG(data_folder, data_file, format='txt').folders
+    n = len(folders)
+    shapes = np.zeros((n, 2), dtype=np.int64)
+    image_offsets = np.zeros(n + 1, dtype=np.int64)
+    label_offsets = np.zeros(n + 1, dtype=np.int64)
+    point_offsets = np.zeros(n + 1, dtype=np.int64)
+    scales = np.zeros(n, dtype=np.float64)
+
+    pool = multiprocessing.Pool(processes, initializer=init_worker,
+                                initargs=(data_folder, data_file, original_size))
+    try:
+        with open(os.path.join(path, 'images.bin'), 'wb') as images, \
+                open(os.path.join(path, 'labels.bin'), 'wb') as labels, \
+                open(os.path.join(path, 'points.bin'), 'wb') as points:
+            for i, (image, label, plan_points, scale) in enumerate(pool.imap(read_plan, range(n), chunksize)):
+                shapes[i] = image.shape[1:]
+                scales[i] = scale
+                images.write(image.tobytes())
+                labels.write(label.tobytes())
+                points.write(plan_points.tobytes())
+                image_offsets[i + 1] = image_offsets[i] + image.size
+                label_offsets[i + 1] = label_offsets[i] + label.size
+                point_offsets[i + 1] = point_offsets[i] + len(plan_points)
+                if info and (i + 1) % 100 == 0:
+                    print(f"{i + 1}/{n} plans")
+    finally:
+        pool.close()
+        pool.join()
+
+    np.savez(index_path, folders=np.array(folders, dtype=str).reshape(-1), shapes=shapes,
+             image_offsets=image_offsets, label_offsets=label_offsets,
+             point_offsets=point_offsets, scales=scales,
+             original_size=np.array(original_size))
+    return path
+
+
+class LabelStore(object):
+    """
+    Reader of a store
+    Files are mapped on first use, so every DataLoader worker maps its own.
+    Image and label tensors are read from views of the maps, the only copy is
+    the conversion to float32 that FloorplanSVG.get_txt returns.
+    @Param path: store folder
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with np.load(os.path.join(path, 'index.npz'), allow_pickle=False) as index:
+            self.folders = index['folders']
+            self.shapes = index['shapes']
+            self.image_offsets = index['image_offsets']
+            self.label_offsets = index['label_offsets']
+            self.point_offsets = index['point_offsets']
+            self.scales = index['scales']
+        self._maps = None
+
+    def __len__(self):
+        return len(self.folders)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_maps'] = None
+        return state
+
+    def open(self):
+        self._maps = {}
+        for name, dtype in (('images', np.uint8), ('labels', np.uint8), ('points', np.int32)):
+            path = os.path.join(self.path, name + '.bin')
+            if os.path.getsize(path) == 0:
+                # Empty files can't be mapped, e.g. a split without points
+                self._maps[name] = np.zeros(0, dtype=dtype)
+            else:
+                # Copy on write, torch.from_numpy wants writable arrays
+                self._maps[name] = np.memmap(path, dtype=dtype, mode='c')
+
+    def get(self, index):
+        """
+        Sample of a plan, as FloorplanSVG.get_txt
+        @Param index: plan index in the split file
+        @Return dict with image, label, folder, heatmaps and scale
+        """
+        if self._maps is None:
+            self.open()
+        height, width = self.shapes[index]
+        image = self._maps['images'][self.image_offsets[index]:self.image_offsets[index + 1]]
+        label = self._maps['labels'][self.label_offsets[index]:self.label_offsets[index + 1]]
+        points = self._maps['points'][3 * self.point_offsets[index]:3 * self.point_offsets[index + 1]]
+
+        image = torch.from_numpy(image).view(3, height, width).float()
+        label = torch.from_numpy(label).view(-1, height, width).float()
+        heatmaps = decode_heatmaps(points.reshape(-1, 3))
+
+        return {'image': image, 'label': label, 'folder': str(self.folders[index]),
+                'heatmaps': heatmaps, 'scale': float(self.scales[index])}
@@ -0,0 +1,162 @@
+import os
+import struct
+import multiprocessing
+import lmdb
+import numpy as np
+import torch
+
+from utils.loaders.label_store import init_worker, read_plan, decode_heatmaps
+
+'''
+LMDB store
+Builder and reader of the cubi_lmdb/ database of FloorplanSVG(format='lmdb'),
+F1_original sized plans go to cubi_lmdb_original/. Plans are keyed by their
+folder, values have a fixed binary layout instead of pickled samples:
+  header   magic, height, width, label channels, points, scale
+  image    uint8 (3, h, w)
+  label    uint8 (channels, h, w)
+  points   int32 (points, 3) heatmap points as (channel, x, y)
+'''
+
+LMDB_FOLDER = 'cubi_lmdb/'
+MAGIC = b'CFP1'
+HEADER = struct.Struct('<4sIIIId')
+
+
+def get_lmdb_path(data_folder, lmdb_folder=LMDB_FOLDER, original_size=False):
+    """
+    Folder of the database
+    @Param data_folder: CubiCasa data folder
+    @Param lmdb_folder: database folder, relative to data_folder
+    @Param original_size: if the database holds F1_original sized plans
+    @Return path
+    """
+    path = data_folder + lmdb_folder
+    if original_size:
+        path = path.rstrip('/') + '_original/'
+    return path
+
+
+def encode_sample(image, label, points, scale):
+    """
+    Value of a plan
+    @Param image: (3, h, w) uint8 array
+    @Param label: (c, h, w) uint8 array
+    @Param points: (n, 3) int32 array of encode_heatmaps
+    @Param scale: scale of the heatmap points
+    @Return bytes
+    """
+    _, height, width = image.shape
+    header = HEADER.pack(MAGIC, height, width, label.shape[0], len(points), scale)
+    return b''.join((header, image.astype(np.uint8).tobytes(), label.astype(np.uint8).tobytes(),
+                     points.astype(np.int32).tobytes()))
+
+
+def decode_sample(value):
+    """
+    Arrays of a value, views of its buffer
+    @Param value: bytes or memoryview of encode_sample
+    @Return image, label, points, scale
+    """
+    magic, height, width, channels, n_points, scale = HEADER.unpack_from(value)
+    if magic != MAGIC:
+        raise ValueError("Not a floorplan value, rebuild the database with create_lmdb.py")
+    offset = HEADER.size
+    image = np.frombuffer(value, np.uint8, 3 * height * width, offset).reshape(3, height, width)
+    offset += image.size
+    label = np.frombuffer(value, np.uint8, channels * height * width, offset).reshape(channels, height, width)
+    offset += label.size
+    points = np.frombuffer(value, np.int32, 3 * n_points, offset).reshape(n_points, 3)
+    return image, label, points, scale
+
+
+def build_lmdb(data_folder, data_file, lmdb_folder=LMDB_FOLDER, original_size=False, processes=None,
+               chunksize=4, commit_size=256, map_size=200 * 1024 ** 3, info=False):
+    """
+    Parse all plans of a split in parallel and add them to the database
+    Processes parse the plans, this process only writes. Values are committed
+    every commit_size plans, one transaction per plan makes the writes sync bound.
+    Splits of the same size can be added to one database, plans are keyed by folder.
+    @Param data_folder: CubiCasa data folder
+    @Param data_file: split file, e.g. train.txt
+    @Param lmdb_folder: database folder, relative to data_folder
+    @Param original_size: store F1_original sized plans, as FloorplanSVG(original_size=True),
+                          in their own database, see get_lmdb_path
+    @Param processes: builder processes, default number of cores
+    @Param chunksize: plans handed to a process at once
+    @Param commit_size: plans per write transaction
+    @Param map_size: maximum size of the database
+    @Param info: print progress
+    @Return path to the database
+    """
+    from utils.loaders.svg_loader import FloorplanSVG
+
+    path = get_lmdb_path(data_folder, lmdb_folder, original_size)
+    folders = FloorplanSVG(data_folder, data_file, format='txt').folders
+    n = len(folders)
+
+    env = lmdb.open(path, map_size=map_size)
+    pool = multiprocessing.Pool(processes, initializer=init_worker,
+                                initargs=(data_folder, data_file, original_size))
+    try:
+        txn = env.begin(write=True)
+        for i, (image, label, points, scale) in enumerate(pool.imap(read_plan, range(n), chunksize)):
+            txn.put(folders[i].encode(), encode_sample(image, label, points, scale))
+            if (i + 1) % commit_size == 0:
+                txn.commit()
+                txn = env.begin(write=True)
+                if info:
+                    print(f"{i + 1}/{n} plans")
+        txn.commit()
+    finally:
+        pool.close()
+        pool.join()
+        env.close()
+    return path
+
+
+class LmdbStore(object):
+    """
+    Reader of the database
+    The environment is opened on first use in every process, lmdb environments
+    must not be shared by forked DataLoader workers. A worker keeps one read
+    transaction, values are decoded from its buffers without copying.
+    @Param path: database folder
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._pid = None
+        self._env = None
+        self._txn = None
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def open(self):
+        self._env = lmdb.open(self.path, readonly=True, max_readers=126, lock=False,
+                              readahead=True, meminit=False)
+        self._txn = self._env.begin(write=False, buffers=True)
+        self._pid = os.getpid()
+
+    def get(self, folder):
+        """
+        Sample of a plan, as FloorplanSVG.get_txt
+        @Param folder: plan folder as in the split file
+        @Return dict with image, label, folder, heatmaps and scale
+        """
+        if self._pid != os.getpid():
+            self.open()
+        value = self._txn.get(folder.encode())
+        if value is None:
+            raise KeyError(folder + " is not in " + self.path)
+        image, label, points, scale = decode_sample(value)
+
+        # The buffer is only valid during the transaction, astype copies out of it
+        sample = {'image': torch.from_numpy(image.astype(np.float32)),
+                  'label': torch.from_numpy(label.astype(np.float32)),
+                  'folder': folder, 'heatmaps': decode_heatmaps(points), 'scale': scale}
+        return sample
@@ -1,17 +1,18 @@
-import lmdb
-import pickle
 import torch
 from torch.utils.data import Dataset
 import cv2
 import numpy as np
 from numpy import genfromtxt
 from utils.loaders.house import House
+from utils.loaders.label_store import LabelStore, get_store_path, STORE_FOLDER
+from utils.loaders.lmdb_store import LmdbStore, LMDB_FOLDER, get_lmdb_path
 
 
 class FloorplanSVG(Dataset):
     def __init__(self, data_folder, data_file, is_transform=True,
                  augmentations=None, img_norm=True, format='txt',
-                 original_size=False, lmdb_folder='cubi_lmdb/'):
+                 original_size=False, lmdb_folder=LMDB_FOLDER,
+                 store_folder=STORE_FOLDER):
         self.img_norm = img_norm
         self.is_transform = is_transform
         self.augmentations = augmentations
@@ -24,16 +25,21 @@ class FloorplanSVG(Dataset):
         if format == 'txt':
             self.get_data = self.get_txt
         if format == 'lmdb':
-            self.lmdb = lmdb.open(data_folder+lmdb_folder, readonly=True,
-                                  max_readers=8, lock=False,
-                                  readahead=True, meminit=False)
+            # Built with create_lmdb.py, holds unnormalized images
+            self.lmdb = LmdbStore(get_lmdb_path(data_folder, lmdb_folder, original_size))
             self.get_data = self.get_lmdb
-            self.is_transform = False
 
         self.data_folder = data_folder
         # Load txt file to list
         self.folders = genfromtxt(data_folder + data_file, dtype='str')
 
+        if format == 'memmap':
+            # Built with create_label_store.py
+            self.store = LabelStore(get_store_path(data_folder, data_file, store_folder, original_size))
+            if len(self.store) != len(self.folders):
+                raise ValueError("Label store " + self.store.path + " doesn't match " + data_file)
+            self.get_data = self.store.get
+
     def __len__(self):
         """__len__"""
         return len(self.folders)
@@ -85,12 +91,7 @@ class FloorplanSVG(Dataset):
         return sample
 
     def get_lmdb(self, index):
-        key = self.folders[index].encode()
-        with self.lmdb.begin(write=False) as f:
-            data = f.get(key)
-
-        sample = pickle.loads(data)
-        return sample
+        return self.lmdb.get(self.folders[index])
 
     def transform(self, sample):
         fplan = sample['image']
@@ -1,17 +1,98 @@
 import math
 import numpy as np
-from xml.dom import minidom
+from xml.etree import ElementTree
 from skimage.draw import polygon
 from svgpathtools import parse_path
 from logging import warning
 
 
+class SvgElement(object):
+    """
+    Read only minidom like view of an ElementTree element, it has the part of
+    the minidom Element interface the svg helpers use.
+    @Param element: ElementTree element
+    @Param parent: SvgElement or ElementTree element of the parent, None for the root
+    """
+
+    def __init__(self, element, parent=None):
+        self.element = element
+        self.parent = parent
+
+    @property
+    def nodeName(self):
+        # Local name, minidom doesn't prefix the default namespace
+        return self.element.tag.rpartition('}')[2]
+
+    @property
+    def childNodes(self):
+        return [SvgElement(c, self) for c in self.element if isinstance(c.tag, str)]
+
+    @property
+    def parentNode(self):
+        if self.parent is None or isinstance(self.parent, SvgElement):
+            return self.parent
+        return SvgElement(self.parent)
+
+    def getAttribute(self, name):
+        # minidom returns an empty string for missing attributes
+        return self.element.get(name, '')
+
+
+def is_house_group(element):
+    """
+    If a group is one House or get_labels reads
+    @Param element: ElementTree element of a g tag
+    """
+    class_name = element.get('class', '')
+    return (element.get('id', '') in ('Wall', 'Railing', 'Window', 'Door')
+            or 'FixedFurniture ' in class_name or 'Space ' in class_name)
+
+
+def iter_groups(path, select=is_house_group):
+    """
+    Stream the selected g elements of an svg file in one pass
+    Groups come in document order, as from minidom getElementsByTagName('g').
+    A group is yielded when the outermost selected group around it is parsed,
+    its elements are freed when the caller asks for the next one, so only the
+    open part of the file is in memory.
+    @Param path: svg file
+    @Param select: function of an ElementTree g element, if it is yielded
+    @Return generator of SvgElement
+    """
+    # Open elements with if they are selected, the parents of what is parsed
+    open_elements = []
+    selected = []
+    open_selected = 0
+    for event, element in ElementTree.iterparse(path, events=('start', 'end')):
+        if event == 'start':
+            is_selected = element.tag.rpartition('}')[2] == 'g' and select(element)
+            if is_selected:
+                parent = open_elements[-1][0] if open_elements else None
+                selected.append(SvgElement(element, parent))
+                open_selected += 1
+            open_elements.append((element, is_selected))
+            continue
+
+        _, is_selected = open_elements.pop()
+        open_selected -= is_selected
+        if open_selected:
+            # Part of a selected group, needed until that group is done
+            continue
+
+        # Nested groups all started after the outermost one, document order
+        for group in selected:
+            yield group
+        selected = []
+
+        if open_elements:
+            open_elements[-1][0].remove(element)
+
+
 def get_labels(path, height, width):
-    svg = minidom.parse(path)
     walls = np.empty((height, width), dtype=np.uint8)
     walls.fill(len(rooms))
     icons = np.zeros((height, width), dtype=np.uint8)
-    for e in svg.getElementsByTagName('g'):
+    for e in iter_groups(path):
         if e.getAttribute("id") == "Wall":
             rr, cc = get_polygon(e)
             walls[rr, cc] = 0
@@ -302,6 +383,47 @@ def calc_distance(point_1, point_2):
                      math.pow(point_1[1] - point_2[1], 2))
 
 
+class PointGrid(object):
+    """
+    Grid hash of points, finds the points near a point without comparing it
+    to all of them. Cells are cell_size wide, a query looks at the cells that
+    overlap the square around the point, so it returns a superset of the
+    points within the radius.
+    @Param cell_size: cell width, best the query radius. If it isn't a
+                      positive number all points are in one cell
+    """
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size if 0 < cell_size < math.inf else None
+        self.cells = {}
+
+    def _cell(self, x, y):
+        if self.cell_size is None:
+            return 0, 0
+        return math.floor(x / self.cell_size), math.floor(y / self.cell_size)
+
+    def add(self, key, point):
+        self.cells.setdefault(self._cell(point[0], point[1]), []).append(key)
+
+    def remove(self, key, point):
+        self.cells[self._cell(point[0], point[1])].remove(key)
+
+    def query(self, point, radius):
+        """
+        Keys of the points that can be within radius of a point
+        @Param point: (x, y)
+        @Param radius: search radius
+        @Return list of keys
+        """
+        x0, y0 = self._cell(point[0] - radius, point[1] - radius)
+        x1, y1 = self._cell(point[0] + radius, point[1] + radius)
+        keys = []
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                keys.extend(self.cells.get((cx, cy), ()))
+        return keys
+
+
 def calc_center(points):
     return list(np.mean(np.array(points), axis=0))
 
@@ -324,6 +446,54 @@ def get_gaussian2D(ndim, sigma=0.25):
     return dst_data
 
 
+def reflect_positions(v, size, before, after):
+    # Positions of pixel v in the BORDER_REFLECT_101 padded line that reach
+    # the line through a kernel covering `before` pixels before and `after` after.
+    # The padding reflects again and again when the kernel is larger than the
+    # line, so v repeats every 2 * (size - 1) pixels, mirrored or not.
+    lo, hi = -after, size - 1 + before
+    if size == 1:
+        return list(range(lo, hi + 1))
+    period = 2 * (size - 1)
+    positions = set()
+    for start in (v, -v):
+        positions.update(range(start + math.ceil((lo - start) / period) * period, hi + 1, period))
+    return sorted(positions)
+
+
+def render_heatmaps(points, n_channels, height, width, kernel):
+    """
+    Heatmaps of points, equal to a cv2.filter2D with its default border of
+    single pixel maps, but the kernel is only added around the points. Kernels
+    larger than the maps are added at every reflection of the point.
+    @Param points: (n, 3) int array of (channel, x, y) inside the maps, a pixel
+                   is set once however many points fall on it
+    @Param n_channels: number of maps
+    @Param height, width: map size
+    @Param kernel: 2d filter kernel
+    @Return (n_channels, height, width) float32 array
+    """
+    heatmaps = np.zeros((n_channels, height, width), dtype=np.float32)
+    # filter2D correlates around the kernel center, so a point spreads the
+    # flipped kernel from `before` pixels before it to `after` pixels after
+    stamp = np.ascontiguousarray(kernel[::-1, ::-1], dtype=np.float32)
+    kh, kw = stamp.shape
+    after_y, after_x = kh // 2, kw // 2
+    before_y, before_x = kh - 1 - after_y, kw - 1 - after_x
+
+    points = np.unique(np.asarray(points, dtype=np.int64).reshape(-1, 3), axis=0)
+    for channel, x, y in points.tolist():
+        for my in reflect_positions(y, height, before_y, after_y):
+            for mx in reflect_positions(x, width, before_x, after_x):
+                y0, y1 = max(my - before_y, 0), min(my + after_y + 1, height)
+                x0, x1 = max(mx - before_x, 0), min(mx + after_x + 1, width)
+                if y0 < y1 and x0 < x1:
+                    heatmaps[channel, y0:y1, x0:x1] += stamp[y0 - my + before_y:y1 - my + before_y,
+                                                             x0 - mx + before_x:x1 - mx + before_x]
+
+    return heatmaps
+
+
 def draw_junction(index, point, width, height, axes):
     lineLength = 15
     lineWidth = 7
@@ -7,10 +7,8 @@ import numpy as np
 import math
 import torch
 from torch.nn.functional import sigmoid, softmax, interpolate
-from skimage import draw
-from utils import post_prosessing
-from utils.loaders.augmentations import RotateNTurns
-from utils.plotting import shp_mask
+from utils import post_prosessing, inference
+from utils.plotting import fill_polygon
 
 
 class runningScore(object):
@@ -112,23 +110,39 @@ def pixel_accuracy(label, pred):
 
 
 def polygons_to_tensor(polygons_val, types_val, room_polygons_val, room_types_val, size, split=[12, 11]):
-    ten = np.zeros((sum(split), size[0], size[1]))
+    ten = np.zeros((sum(split), size[0], size[1]), dtype=np.uint8)
 
     for i, pol_type in enumerate(room_types_val):
-        mask = shp_mask(room_polygons_val[i], np.arange(size[1]), np.arange(size[0]))
-        ten[pol_type['class']][mask] = 1
+        fill_polygon(ten[pol_type['class']], room_polygons_val[i], 1, top_left=True)
 
     for i, pol_type in enumerate(types_val):
         if pol_type['type'] == 'icon':
             d = split[0]
         else:
             d = 0
-        jj, ii = draw.polygon(polygons_val[i][:, 1], polygons_val[i][:, 0])
-        ten[pol_type['class'] + d][jj, ii] = 1
+        fill_polygon(ten[pol_type['class'] + d], polygons_val[i], 1)
 
     return ten
 
 
+def polygons_to_label_map(polygons_val, types_val, room_polygons_val, room_types_val, size):
+    """
+    Room and icon label maps of the polygons, the argmax of the room and icon
+    channels of polygons_to_tensor without building it
+    @Param size: height, width
+    @Return (2, height, width) uint8 array of rooms and icons
+    """
+    label_map = np.zeros((2, size[0], size[1]), dtype=np.uint8)
+    shapes = [(t['class'], 0, pol, True) for pol, t in zip(room_polygons_val, room_types_val)]
+    shapes += [(t['class'], int(t['type'] == 'icon'), pol, False) for pol, t in zip(polygons_val, types_val)]
+
+    # Lower classes are drawn last, a pixel keeps the lowest class of its polygons
+    for pol_class, channel, pol, top_left in sorted(shapes, key=lambda s: -s[0]):
+        fill_polygon(label_map[channel], pol, pol_class, top_left)
+
+    return label_map
+
+
 def get_evaluation_tensors(val, model, split, rotate=True, n_classes=44):
     images_val = val['image'].cuda()
     labels_val = val['label']
@@ -137,26 +151,7 @@ def get_evaluation_tensors(val, model, split, rotate=True, n_classes=44):
     img_size = (height, width)
 
     if rotate:
-        rot = RotateNTurns()
-        rotations = [(0, 0), (1, -1), (2, 2), (-1, 1)]
-        pred_count = len(rotations)
-        prediction = torch.zeros([pred_count, n_classes, height, width])
-        for i, r in enumerate(rotations):
-            forward, back = r
-            # We rotate first the image
-            rot_image = rot(images_val, 'tensor', forward)
-            pred = model(rot_image)
-            # We rotate prediction back
-            pred = rot(pred, 'tensor', back)
-            # We fix heatmaps
-            pred = rot(pred, 'points', back)
-            # We make sure the size is correct
-            pred = interpolate(pred, size=(height, width), mode='bilinear', align_corners=True)
-            # We add the prediction to output
-            prediction[i] = pred[0]
-            #logger.info("flip: " + str(i))
-
-        prediction = torch.mean(prediction, 0, True)
+        prediction = inference.predict(model, images_val, n_classes, img_size)
     else:
         prediction = model(images_val)
     '''
@@ -173,11 +168,9 @@ def get_evaluation_tensors(val, model, split, rotate=True, n_classes=44):
         (heatmaps, rooms, icons), 0.4, all_opening_types)
     #logger.info("Prediction post processing done")
 
-    predicted_classes = polygons_to_tensor(
+    pol_rooms, pol_icons = polygons_to_label_map(
         polygons, types, room_polygons, room_types, img_size)
     print(labels_val)
-    pol_rooms = np.argmax(predicted_classes[:split[1]], axis=0)
-    pol_icons = np.argmax(predicted_classes[split[1]:], axis=0)
     
     
     return labels_val[0].data.numpy(), np.concatenate(([rooms_seg], [icons_seg]), axis=0), np.concatenate(([pol_rooms], [pol_icons]), axis=0)
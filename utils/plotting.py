@@ -1,9 +1,9 @@
 import matplotlib.pyplot as plt
+import math
 from matplotlib import colors, cm
 import matplotlib.path as mplp
 import numpy as np
 import torch
-from skimage import draw
 from shapely.geometry import Polygon, Point
 
 
@@ -656,18 +656,13 @@ def polygons_to_image(polygons, types, room_polygons, room_types, height, width)
     pol_icon_seg = np.zeros((height, width))
 
     for i, pol in enumerate(room_polygons):
-
-        mask = shp_mask(pol, np.arange(width), np.arange(height))
-
-#         jj, ii = draw.polygon(pol[:, 1], pol[:, 0])
-        pol_room_seg[mask] = room_types[i]['class']
+        fill_polygon(pol_room_seg, pol, room_types[i]['class'], top_left=True)
 
     for i, pol in enumerate(polygons):
-        jj, ii = draw.polygon(pol[:, 1], pol[:, 0])
         if types[i]['type'] == 'wall':
-            pol_room_seg[jj, ii] = types[i]['class']
+            fill_polygon(pol_room_seg, pol, types[i]['class'])
         else:
-            pol_icon_seg[jj, ii] = types[i]['class']
+            fill_polygon(pol_icon_seg, pol, types[i]['class'])
 
     return pol_room_seg, pol_icon_seg
 
@@ -798,3 +793,91 @@ def shp_mask(shp, x, y, m=None):
                 2:] = shp_mask(shp, x[l // 2:], y[k // 2:], m[k // 2:, l // 2:])
 
     return m
+
+
+def polygon_rings(pol):
+    """
+    Rings of a polygon as arrays of x, y points
+    @Param pol: shapely Polygon or MultiPolygon, or (n, 2) array of x, y points
+    @Return list of (n, 2) float arrays
+    """
+    if isinstance(pol, np.ndarray):
+        return [pol.reshape(-1, 2).astype(np.float64)]
+    if hasattr(pol, 'geoms'):
+        return [ring for p in pol.geoms for ring in polygon_rings(p)]
+    return [np.asarray(r.coords, dtype=np.float64).reshape(-1, 2) for r in [pol.exterior] + list(pol.interiors)]
+
+
+def polygon_mask(pol, height, width, top_left=False):
+    """
+    Scanline rasterization of a polygon, pixel (x, y) is the point (x, y).
+    Rows cross the edges of all rings at once, so holes and multi polygons are
+    filled by the even odd rule.
+    By default pixels inside or on the boundary are set, as skimage draw.polygon.
+    With top_left only the boundary pixels with the polygon below and to
+    their right are set, polygons sharing an edge don't overlap. Off the
+    boundary the mask is the same as shp_mask.
+    @Param pol: as polygon_rings
+    @Param height, width: image size
+    @Param top_left: fill rule of the boundary
+    @Return mask of the bounding box in the image, its top, left; None if outside
+    """
+    # Closed rings, edges go from every point to the next
+    rings = [r if np.array_equal(r[0], r[-1]) else np.vstack((r, r[:1]))
+             for r in polygon_rings(pol) if len(r) > 1]
+    if not rings:
+        return None
+    points = np.concatenate(rings)
+    y_start, y_end = max(math.ceil(points[:, 1].min()), 0), min(math.floor(points[:, 1].max()), height - 1) + 1
+    x_start, x_end = max(math.ceil(points[:, 0].min()), 0), min(math.floor(points[:, 0].max()), width - 1) + 1
+    if y_start >= y_end or x_start >= x_end:
+        return None
+
+    x0, y0 = np.concatenate([r[:-1] for r in rings]).T
+    x1, y1 = np.concatenate([r[1:] for r in rings]).T
+    low, high = np.minimum(y0, y1), np.maximum(y0, y1)
+    rows = np.arange(y_start, y_end, dtype=np.float64)[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cross_x = x0 + (rows - y0) * (x1 - x0) / (y1 - y0)
+
+    # Spans between pairs of crossings, the lower vertex of an edge is on it
+    crossing = (low <= rows) & (rows < high)
+    xs = np.sort(np.where(crossing, cross_x, np.inf), axis=1)[:, :max(int(crossing.sum(1).max()), 2)]
+    left, right = xs[:, 0::2], xs[:, 1::2]
+    row, pair = np.nonzero(np.isfinite(left))
+    left, right = left[row, pair], right[row, pair]
+    starts = np.ceil(left)
+    ends = np.ceil(right) if top_left else np.floor(right) + 1
+
+    if not top_left:
+        # Boundary pixels the spans miss, on horizontal edges and the last row of edges
+        on_edge = (low <= rows) & (rows <= high) & (y0 != y1) & (cross_x == np.round(cross_x))
+        edge_row, edge = np.nonzero(on_edge)
+        flat = np.nonzero(y0 == y1)[0]
+        flat = flat[(y0[flat] == np.round(y0[flat])) & (y0[flat] >= y_start) & (y0[flat] < y_end)]
+        row = np.concatenate((row, edge_row, (y0[flat] - y_start).astype(np.int64)))
+        starts = np.concatenate((starts, cross_x[edge_row, edge], np.ceil(np.minimum(x0[flat], x1[flat]))))
+        ends = np.concatenate((ends, cross_x[edge_row, edge] + 1, np.floor(np.maximum(x0[flat], x1[flat])) + 1))
+
+    # Union of the spans of every row by a running count
+    starts = np.clip(starts, x_start, x_end).astype(np.int64) - x_start
+    ends = np.clip(ends, x_start, x_end).astype(np.int64) - x_start
+    keep = starts < ends
+    counts = np.zeros((y_end - y_start, x_end - x_start + 1), dtype=np.int32)
+    np.add.at(counts, (row[keep], starts[keep]), 1)
+    np.add.at(counts, (row[keep], ends[keep]), -1)
+    mask = np.cumsum(counts[:, :-1], axis=1) > 0
+
+    return mask, y_start, x_start
+
+
+def fill_polygon(image, pol, value, top_left=False):
+    """
+    Set the pixels of a polygon in a 2D image, see polygon_mask
+    @Return image
+    """
+    res = polygon_mask(pol, image.shape[0], image.shape[1], top_left)
+    if res is not None:
+        mask, y, x = res
+        image[y:y + mask.shape[0], x:x + mask.shape[1]][mask] = value
+    return image
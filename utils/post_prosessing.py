@@ -347,11 +347,7 @@ def merge_rectangles(rectangles, room_types):
 
     return room_polygons, new_room_types
 
-def get_polygons(predictions, threshold, all_opening_types):
-    heatmaps, room_seg, icon_seg = predictions
-    height = icon_seg.shape[1]
-    width = icon_seg.shape[2]
-
+def get_orientations(height, width):
     point_orientations = [[(2, ), (3, ), (0, ), (1, )],
                           [(0, 3), (0, 1), (1, 2), (2, 3)],
                           [(1, 2, 3), (0, 2, 3), (0, 1, 3), (0, 1, 2)],
@@ -360,26 +356,57 @@ def get_polygons(predictions, threshold, all_opening_types):
                           [width, height, width, 0],
                           [width, height, 0, height],
                           [0, height, 0, 0]]
+    return point_orientations, orientation_ranges
+
+
+def get_polygons(predictions, threshold, all_opening_types):
+    heatmaps, room_seg, icon_seg = predictions
 
+    walls = get_wall_stage(heatmaps, room_seg, threshold)
+    icons = get_icon_stage(heatmaps, icon_seg, threshold)
+    openings = get_opening_stage(heatmaps, icon_seg, walls, threshold, all_opening_types)
+    rooms = get_room_stage(room_seg, walls)
+
+    return combine_polygons(walls, icons, openings, rooms)
+
+
+# Stages of get_polygons. Walls and icons are independent, openings and rooms
+# only need the walls, so PolygonPool can run them concurrently.
+
+def get_wall_stage(heatmaps, room_seg, threshold):
+    height, width = room_seg.shape[1:]
+    point_orientations, orientation_ranges = get_orientations(height, width)
     wall_heatmaps = heatmaps[:13]
-    walls = np.empty([0, 4, 2], int)
     wall_layers = [2, 8]
-    walls, wall_types, wall_points, wall_lines, wall_point_orientation_lines_map = get_wall_polygon(wall_heatmaps, room_seg, threshold, wall_layers, point_orientations, orientation_ranges)
+    return get_wall_polygon(wall_heatmaps, room_seg, threshold, wall_layers, point_orientations, orientation_ranges)
+
 
-    icons = np.empty([0, 4, 2], int)
-    icons, icon_types = get_icon_polygon(heatmaps, icon_seg, threshold, point_orientations, orientation_ranges)
+def get_icon_stage(heatmaps, icon_seg, threshold):
+    height, width = icon_seg.shape[1:]
+    point_orientations, orientation_ranges = get_orientations(height, width)
+    return get_icon_polygon(heatmaps, icon_seg, threshold, point_orientations, orientation_ranges)
 
-    openings, opening_types = get_opening_polygon(heatmaps, walls, icon_seg, wall_points, wall_lines, wall_point_orientation_lines_map, threshold, point_orientations, orientation_ranges, all_opening_types)
+
+def get_opening_stage(heatmaps, icon_seg, walls, threshold, all_opening_types):
+    height, width = icon_seg.shape[1:]
+    point_orientations, orientation_ranges = get_orientations(height, width)
+    wall_polygons, _, wall_points, wall_lines, wall_point_orientation_lines_map = walls
+    return get_opening_polygon(heatmaps, wall_polygons, icon_seg, wall_points, wall_lines, wall_point_orientation_lines_map, threshold, point_orientations, orientation_ranges, all_opening_types)
+
+
+def get_room_stage(room_seg, walls):
+    _, _, wall_points, wall_lines, _ = walls
+    c, height, width = room_seg.shape
 
     # junction_points shape n, 2, coordinate order x, y
     junction_points = get_junction_points(wall_points, wall_lines)
     grid_polygons = get_rectangle_polygons(junction_points, (height, width))
 
-    c, h, w = room_seg.shape
+    room_seg = room_seg.copy()
     for i in range(c):
         if i in [2, 8]: # we ignore walls (2) and railings (8)
-            room_seg[i] = np.zeros((h, w))
-  
+            room_seg[i] = np.zeros((height, width))
+
     room_seg_2D = np.argmax(room_seg, axis=0)
     room_types = []
     grid_polygons_new = []
@@ -389,9 +416,16 @@ def get_polygons(predictions, threshold, all_opening_types):
             grid_polygons_new.append(pol)
             room_types.append({'type': 'room', 'class': room_class})
 
-    room_polygons, room_types = merge_rectangles(grid_polygons_new, room_types)
+    return merge_rectangles(grid_polygons_new, room_types)
+
+
+def combine_polygons(walls, icons, openings, rooms):
+    wall_polygons, wall_types = walls[:2]
+    icon_polygons, icon_types = icons
+    opening_polygons, opening_types = openings
+    room_polygons, room_types = rooms
 
-    polygons = np.concatenate([walls, icons, openings])
+    polygons = np.concatenate([wall_polygons, icon_polygons, opening_polygons])
     types = wall_types + icon_types + opening_types
 
     classes = {'door': [2], 'window': [1]}
@@ -402,6 +436,127 @@ def get_polygons(predictions, threshold, all_opening_types):
     return polygons, types, room_polygons, room_types
 
 
+def share_predictions(predictions):
+    """
+    Copy heatmaps, room and icon segmentation to one shared memory block
+    @Param predictions: (heatmaps, room_seg, icon_seg) numpy arrays
+    @Return SharedMemory (close and unlink it when done), spec for attach_predictions
+    """
+    from multiprocessing import shared_memory
+
+    arrays = [np.ascontiguousarray(a) for a in predictions]
+    shm = shared_memory.SharedMemory(create=True, size=max(1, sum(a.nbytes for a in arrays)))
+    spec, offset = [], 0
+    for a in arrays:
+        np.ndarray(a.shape, a.dtype, buffer=shm.buf, offset=offset)[...] = a
+        spec.append((offset, a.shape, a.dtype.str))
+        offset += a.nbytes
+    return shm, (shm.name, spec)
+
+
+def run_shared_stage(stage, spec, *args):
+    """
+    Run a get_polygons stage in a worker on predictions in shared memory
+    @Param stage: 'walls', 'icons', 'openings' or 'rooms'
+    @Param spec: spec of share_predictions
+    @Param args: stage arguments after the prediction arrays
+    @Return stage result, holds no reference to the shared memory
+    """
+    from multiprocessing import shared_memory
+
+    name, arrays = spec
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        heatmaps, room_seg, icon_seg = [np.ndarray(shape, dtype, buffer=shm.buf, offset=offset)
+                                        for offset, shape, dtype in arrays]
+        if stage == 'walls':
+            result = get_wall_stage(heatmaps, room_seg, *args)
+        elif stage == 'icons':
+            result = get_icon_stage(heatmaps, icon_seg, *args)
+        elif stage == 'openings':
+            result = get_opening_stage(heatmaps, icon_seg, *args)
+        else:
+            result = get_room_stage(room_seg, *args)
+        del heatmaps, room_seg, icon_seg
+    finally:
+        shm.close()
+    return result
+
+
+class PolygonPool(object):
+    """
+    Process pool for get_polygons
+    Wall and icon extraction of a plan run concurrently, openings and rooms
+    start as soon as the walls of their plan are done. Predictions are handed
+    to the workers through shared memory instead of being pickled per stage,
+    and one pool serves any number of plans.
+    @Param processes: number of worker processes, default number of cores
+    @Param max_plans: plans in shared memory at the same time in map
+    """
+
+    def __init__(self, processes=None, max_plans=None):
+        import os
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        self.processes = processes or os.cpu_count() or 1
+        self.max_plans = max_plans or 2 * self.processes
+        # Spawned, torch must not be forked
+        context = multiprocessing.get_context("spawn")
+        self.executor = ProcessPoolExecutor(max_workers=self.processes, mp_context=context)
+
+    def get_polygons(self, predictions, threshold, all_opening_types):
+        """Same as get_polygons, run on the pool"""
+        return self.map([predictions], threshold, all_opening_types)[0]
+
+    def map(self, predictions, threshold, all_opening_types):
+        """
+        get_polygons of many plans
+        @Param predictions: list of (heatmaps, room_seg, icon_seg)
+        @Return list of (polygons, types, room_polygons, room_types)
+        """
+        results = []
+        for start in range(0, len(predictions), self.max_plans):
+            results += self.map_shared(predictions[start:start + self.max_plans], threshold, all_opening_types)
+        return results
+
+    def map_shared(self, predictions, threshold, all_opening_types):
+        from concurrent.futures import as_completed
+
+        shared = []
+        try:
+            for p in predictions:
+                shared.append(share_predictions(p))
+            specs = [spec for _, spec in shared]
+
+            submit = self.executor.submit
+            walls = {submit(run_shared_stage, 'walls', spec, threshold): i for i, spec in enumerate(specs)}
+            icons = [submit(run_shared_stage, 'icons', spec, threshold) for spec in specs]
+
+            wall_results = [None] * len(specs)
+            openings, rooms = [None] * len(specs), [None] * len(specs)
+            for future in as_completed(walls):
+                i = walls[future]
+                wall_results[i] = future.result()
+                openings[i] = submit(run_shared_stage, 'openings', specs[i], wall_results[i], threshold, all_opening_types)
+                rooms[i] = submit(run_shared_stage, 'rooms', specs[i], wall_results[i])
+
+            return [combine_polygons(wall_results[i], icons[i].result(), openings[i].result(), rooms[i].result())
+                    for i in range(len(specs))]
+        finally:
+            for shm, _ in shared:
+                shm.close()
+                shm.unlink()
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
 
 def split_by_value(arr, max_val, skip=[]):
     res = np.zeros((max_val, arr.shape[0], arr.shape[1]), dtype=int)
@@ -573,21 +728,6 @@ def get_icon_polygon(heatmaps, icons_seg, threshold, point_orientations, orienta
     icons = find_icons(icon_points, gap, point_orientations, orientation_ranges, height, width, False)
     icons_good = drop_big_icons(icons, icon_points)
     
-    #-----DEBUGGING----------
-    
-    import pickle
-    file_name = "checker_db.pkl"
-    open_file = open(file_name, "wb")
-    pickle.dump(icons_good, open_file)
-    open_file.close()
-    
-    file_name = "checker_points_db.pkl"
-    open_file = open(file_name, "wb")
-    pickle.dump(icon_points, open_file)
-    open_file.close()
-    
-    #------DEBUGGING-----------
-    
     icons_good = icons
     icon_types_good = []
     icon_polygons = np.empty((0, 4, 2), dtype=int)
@@ -945,7 +1085,7 @@ def extract_wall_polygon(wall, wall_points, segmentation, seg_class):
         # widths = reject_outliers(widths)
         # if len(widths) == 0:
             # return None
-        wall_width = stats.mode(widths).mode[0]
+        wall_width = np.atleast_1d(stats.mode(widths).mode)[0]
         if wall_width > y2 - y1:
             wall_width = y2 - y1
         w_delta = int(wall_width / 2.0)
@@ -1001,7 +1141,7 @@ def extract_wall_polygon(wall, wall_points, segmentation, seg_class):
         # widths = reject_outliers(widths)
         # if len(widths) == 0:
             # return None
-        wall_width = stats.mode(widths).mode[0]
+        wall_width = np.atleast_1d(stats.mode(widths).mode)[0]
         if wall_width > x2 - x1:
             wall_width = x2 - x1
         w_delta = int(wall_width / 2.0)
@@ -0,0 +1,251 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+
+import numpy as np
+
+'''
+Result cache
+Content addressed on-disk cache of the CubiCasa workflow, so converting the
+same floorplan again skips super-resolution, inference and post-processing.
+Entries chain on each other:
+  sr          image hash + SR settings        -> upsampled image, SR decision
+  prediction  sr key + model checkpoint hash  -> prediction
+  polygons    prediction key + threshold      -> polygons, types, rooms
+so a new threshold reuses the prediction and a new checkpoint reuses the SR
+image. Entries are single compressed .npz files without pickled objects, the
+least recently used ones are removed when the cache grows over max_bytes.
+Predictions stay float32, with float16 the local maxima of flat heatmaps
+move and get_polygons finds different junctions than a fresh run.
+'''
+
+CACHE_DIR = "cache/"
+
+# Checkpoint hashes by (path, size, mtime), checkpoints are big and rarely change
+_file_hashes = {}
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """
+    sha256 of a file content
+    @Param path: file path
+    @Return hex digest
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    digest = _file_hashes.get(key)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                h.update(chunk)
+        digest = _file_hashes[key] = h.hexdigest()
+    return digest
+
+
+def make_key(kind, *parts):
+    """
+    Key of an entry
+    @Param kind: sr, prediction or polygons
+    @Param parts: json serializable values the entry depends on
+    @Return file name safe key
+    """
+    text = json.dumps(parts, sort_keys=True, default=str)
+    return kind + "-" + hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def encode_json(value):
+    # Polygon types hold numpy integers
+    text = json.dumps(value, default=lambda v: v.item() if hasattr(v, "item") else str(v))
+    return np.frombuffer(text.encode("utf-8"), dtype=np.uint8)
+
+
+def decode_json(array):
+    return json.loads(array.tobytes().decode("utf-8"))
+
+
+class ResultCache(object):
+    """
+    LRU on-disk cache of SR images, predictions and polygons
+    Can be passed to worker processes, it only holds its settings.
+    The size of the cache is counted from the writes, the directory is only
+    listed when the count crosses max_bytes or every rescan_bytes written, so
+    writes of other processes sharing the cache are noticed.
+    @Param cache_dir: directory of the entries
+    @Param max_bytes: total size of all entries, older entries are evicted above it
+    @Param rescan_bytes: bytes written between listings, default max_bytes / 8
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=2 * 1024 ** 3, rescan_bytes=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.rescan_bytes = rescan_bytes if rescan_bytes is not None else max(max_bytes // 8, 1)
+        self._lock = threading.Lock()
+        # Size of all entries as far as this instance knows, None until listed
+        self._total = None
+        self._written = 0
+
+    def __getstate__(self):
+        return {"cache_dir": self.cache_dir, "max_bytes": self.max_bytes, "rescan_bytes": self.rescan_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key + ".npz")
+
+    def get(self, key):
+        """
+        Read an entry and mark it as used
+        @Param key: entry key
+        @Return dict of arrays or None
+        """
+        path = self.entry_path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                entry = {name: data[name] for name in data.files}
+            os.utime(path)
+        except (OSError, ValueError):
+            # Missing, evicted meanwhile or partly written by a crashed process
+            return None
+        return entry
+
+    def put(self, key, **arrays):
+        """
+        Write an entry atomically, then evict old entries
+        @Param key: entry key
+        @Param arrays: numpy arrays to store
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.entry_path(key)
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(f, **arrays)
+            size = os.path.getsize(tmp)
+            try:
+                replaced = os.path.getsize(path)
+            except OSError:
+                replaced = 0
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+        with self._lock:
+            if self._total is not None:
+                self._total += size - replaced
+            self._written += size
+            check = self._total is None or self._total > self.max_bytes or self._written >= self.rescan_bytes
+        if check:
+            self.evict()
+
+    def evict(self):
+        """
+        Remove least recently used entries when the cache is over max_bytes,
+        down to 90% of it so the next writes don't evict again right away
+        """
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".npz"):
+                    try:
+                        stat = os.stat(os.path.join(self.cache_dir, name))
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, name))
+
+            total = sum(size for _, size, _ in entries)
+            target = self.max_bytes * 9 // 10 if total > self.max_bytes else self.max_bytes
+            for _, size, name in sorted(entries):
+                if total <= target:
+                    break
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
+                total -= size
+            self._total = total
+            self._written = 0
+
+    def size(self):
+        """Total size of all entries in bytes"""
+        if not os.path.isdir(self.cache_dir):
+            return 0
+        return sum(os.path.getsize(os.path.join(self.cache_dir, name))
+                   for name in os.listdir(self.cache_dir) if name.endswith(".npz"))
+
+    # Keys of the CubiCasa workflow
+
+    def get_keys(self, imgpath, SR, SR_policy, checkpoint, threshold, all_opening_types):
+        """
+        Keys of the sr, prediction and polygons entries of an image
+        @Param imgpath: image path, its content is hashed
+        @Param SR: super-resolution [scale, method] or None
+        @Param SR_policy: adaptive SR thresholds or None
+        @Param checkpoint: model checkpoint path, its content is hashed
+        @Param threshold: get_polygons threshold
+        @Param all_opening_types: get_polygons opening types
+        @Return dict kind -> key
+        """
+        sr_key = make_key("sr", file_hash(imgpath), SR, SR_policy)
+        prediction_key = make_key("prediction", sr_key, file_hash(checkpoint))
+        polygons_key = make_key("polygons", prediction_key, threshold, all_opening_types)
+        return {"sr": sr_key, "prediction": prediction_key, "polygons": polygons_key}
+
+    # SR entries
+
+    def get_sr(self, keys):
+        """@Return SR image or None, SR decision or None; None if not cached"""
+        entry = self.get(keys["sr"])
+        if entry is None:
+            return None
+        SR_img = entry["image"] if "image" in entry else None
+        return SR_img, decode_json(entry["decision"])
+
+    def put_sr(self, keys, SR_img, SR_decision):
+        arrays = {"decision": encode_json(SR_decision)}
+        if SR_img is not None:
+            arrays["image"] = SR_img
+        self.put(keys["sr"], **arrays)
+
+    # Prediction entries
+
+    def get_prediction(self, keys):
+        """@Return (1,44,h,w) float32 prediction tensor, prediction size; None if not cached"""
+        import torch
+
+        entry = self.get(keys["prediction"])
+        if entry is None:
+            return None
+        prediction = torch.from_numpy(entry["prediction"])
+        return prediction, tuple(int(v) for v in entry["size"])
+
+    def put_prediction(self, keys, prediction, img_size):
+        self.put(keys["prediction"], prediction=prediction.numpy(),
+                 size=np.array(img_size, dtype=np.int64))
+
+    # Polygon entries
+
+    def get_polygons(self, keys):
+        """@Return polygons, types, room_polygons, room_types as get_polygons; None if not cached"""
+        from shapely import wkb
+
+        entry = self.get(keys["polygons"])
+        if entry is None:
+            return None
+        offsets = entry["room_offsets"]
+        data = entry["room_wkb"].tobytes()
+        room_polygons = [wkb.loads(data[offsets[i]:offsets[i + 1]]) for i in range(len(offsets) - 1)]
+        return entry["polygons"], decode_json(entry["types"]), room_polygons, decode_json(entry["room_types"])
+
+    def put_polygons(self, keys, polygons, types, room_polygons, room_types):
+        from shapely import wkb
+
+        blobs = [wkb.dumps(p) for p in room_polygons]
+        offsets = np.cumsum([0] + [len(b) for b in blobs]).astype(np.int64)
+        self.put(keys["polygons"], polygons=np.asarray(polygons), types=encode_json(types),
+                 room_wkb=np.frombuffer(b"".join(blobs), dtype=np.uint8), room_offsets=offsets,
+                 room_types=encode_json(room_types))
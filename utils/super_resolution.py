@@ -0,0 +1,200 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+'''
+Super-resolution
+Upsampling of floorplan images with the OpenCV dnn_superres models in model/super-res/.
+Loaded models are cached and large images are upsampled in overlapping tiles on a
+thread pool, so memory stays bounded on big scans and latency scales with cores.
+choose_super_resolution decides per image if upsampling is worth its cost.
+'''
+
+MODEL_DIR = "model/super-res/"
+
+# method name -> model file prefix, file is <prefix><scale>.pb
+MODEL_FILES = {"edsr": "EDSR_x", "espcn": "ESPCN_x", "lapsrn": "LapSRN_x", "fsrcnn": "FSRCNN_x"}
+
+
+class SuperResolutionEngine(object):
+    """
+    Cached, tiled super-resolution
+    OpenCV dnn networks can't run forward from several threads at once, so every
+    worker thread keeps its own model per (method, scale). Models are read once
+    and reused for all later images.
+    @Param model_dir: directory holding the .pb model files
+    @Param tile_size: size of the tiles in input pixels, 0 upsamples in one piece
+    @Param overlap: context in input pixels added around every tile and cropped
+                    after upsampling, hides the tile seams
+    @Param workers: number of threads, default number of cores
+    """
+
+    def __init__(self, model_dir=MODEL_DIR, tile_size=512, overlap=16, workers=None):
+        self.model_dir = model_dir
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.workers = workers or os.cpu_count() or 1
+        self._local = threading.local()
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def model_path(self, method, scale):
+        """Path to the .pb file of a method and scale"""
+        if method not in MODEL_FILES:
+            raise ValueError(f"Unknown super-resolution method {method}, use one of {list(MODEL_FILES)}")
+        return os.path.join(self.model_dir, MODEL_FILES[method] + str(scale) + ".pb")
+
+    def get_model(self, method, scale):
+        """
+        Loaded model of the calling thread
+        @Param method: edsr, espcn, lapsrn or fsrcnn
+        @Param scale: upsampling factor
+        @Return cv2.dnn_superres.DnnSuperResImpl
+        """
+        models = getattr(self._local, "models", None)
+        if models is None:
+            models = self._local.models = {}
+
+        model = models.get((method, scale))
+        if model is None:
+            path = self.model_path(method, scale)
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Super-resolution model not found: {path}")
+            model = cv2.dnn_superres.DnnSuperResImpl_create()
+            model.readModel(path)
+            model.setModel(method, scale)
+            models[(method, scale)] = model
+        return model
+
+    def get_tiles(self, height, width):
+        """
+        Split an image in tiles
+        @Param height, width: input image size
+        @Return list of (tile, padded) boxes as (y0, y1, x0, x1), padded adds the overlap
+        """
+        tile_size = self.tile_size if self.tile_size > 0 else max(height, width)
+        tiles = []
+        for y0 in range(0, height, tile_size):
+            for x0 in range(0, width, tile_size):
+                y1, x1 = min(y0 + tile_size, height), min(x0 + tile_size, width)
+                padded = (max(0, y0 - self.overlap), min(height, y1 + self.overlap),
+                          max(0, x0 - self.overlap), min(width, x1 + self.overlap))
+                tiles.append(((y0, y1, x0, x1), padded))
+        return tiles
+
+    def upsample(self, img, method="lapsrn", scale=2):
+        """
+        Upsample an image
+        @Param img: (H, W, 3) uint8 image, channel order is kept
+        @Param method: edsr, espcn, lapsrn or fsrcnn, or bicubic / none (see choose_super_resolution)
+        @Param scale: upsampling factor
+        @Return (H*scale, W*scale, 3) uint8 image
+        """
+        img = np.ascontiguousarray(img, dtype=np.uint8)
+        height, width = img.shape[:2]
+        if method == "none" or scale == 1:
+            return img
+        if method == "bicubic":
+            return cv2.resize(img, (width * scale, height * scale), interpolation=cv2.INTER_CUBIC)
+
+        tiles = self.get_tiles(height, width)
+        if len(tiles) == 1:
+            return self.get_model(method, scale).upsample(img)
+
+        result = np.empty((height * scale, width * scale) + img.shape[2:], dtype=np.uint8)
+
+        def upsample_tile(boxes):
+            (y0, y1, x0, x1), (py0, py1, px0, px1) = boxes
+            out = self.get_model(method, scale).upsample(img[py0:py1, px0:px1])
+            # Crop the overlap away, every tile writes its own part of the result
+            oy, ox = (y0 - py0) * scale, (x0 - px0) * scale
+            result[y0 * scale:y1 * scale, x0 * scale:x1 * scale] = \
+                out[oy:oy + (y1 - y0) * scale, ox:ox + (x1 - x0) * scale]
+
+        list(self.executor().map(upsample_tile, tiles))
+        return result
+
+    def executor(self):
+        """Thread pool shared by all upsample calls"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+
+def estimate_line_thickness(img):
+    """
+    Estimate the mean width of the drawn lines
+    Dark pixels are separated with Otsu's threshold, for strokes the ink area is
+    about length * width and the ink boundary about 2 * length, so the width is
+    2 * area / boundary. One threshold and one erosion, cheap next to any SR model.
+    @Param img: (H, W, 3) or (H, W) uint8 image
+    @Return line width in pixels, 0 for an empty image
+    """
+    gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY) if img.ndim == 3 else img
+    _, ink = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    area = int(ink.sum())
+    if area == 0:
+        return 0.0
+
+    # Boundary pixels are ink pixels with a background 4-neighbour
+    cross = np.array([[0, 1, 0], [1, 1, 1], [0, 1, 0]], np.uint8)
+    inner = cv2.erode(ink, cross, borderType=cv2.BORDER_CONSTANT, borderValue=0)
+    boundary = area - int(inner.sum())
+    return 2.0 * area / max(boundary, 1)
+
+
+def choose_super_resolution(img, method="lapsrn", scale=2, skip_thickness=6.0, bicubic_thickness=4.0,
+                            min_size=768, max_size=2048):
+    """
+    Adaptive super-resolution policy
+    Sharp, large plans with thick lines don't gain anything from SR but would
+    feed scale^2 times the pixels into the network and post-processing.
+    @Param img: (H, W, 3) uint8 image
+    @Param method: learned SR method used for thin lines
+    @Param scale: upsampling factor
+    @Param skip_thickness: lines at least this wide (px) need no SR...
+    @Param min_size: ...if the shorter image side is at least this long (px)
+    @Param bicubic_thickness: lines at least this wide (px) use bicubic upsampling
+    @Param max_size: images with a shorter side of at least this (px) are never upsampled
+    @Return decision dict: method (none, bicubic or the learned method), scale,
+            line_thickness, height, width and reason
+    """
+    height, width = img.shape[:2]
+    thickness = estimate_line_thickness(img)
+    size = min(height, width)
+
+    if size >= max_size:
+        choice, reason = "none", f"shorter side {size}px >= max_size {max_size}px"
+    elif thickness >= skip_thickness and size >= min_size:
+        choice, reason = "none", f"lines {thickness:.1f}px >= {skip_thickness}px and shorter side {size}px >= {min_size}px"
+    elif thickness >= bicubic_thickness:
+        choice, reason = "bicubic", f"lines {thickness:.1f}px >= {bicubic_thickness}px"
+    else:
+        choice, reason = method, f"lines {thickness:.1f}px < {bicubic_thickness}px"
+
+    return {
+        "method": choice,
+        "scale": 1 if choice == "none" else scale,
+        "line_thickness": round(thickness, 2),
+        "height": height,
+        "width": width,
+        "reason": reason,
+    }
+
+
+_engine = None
+
+
+def get_engine():
+    """
+    Shared SuperResolutionEngine of this process
+    @Return SuperResolutionEngine
+    """
+    global _engine
+    if _engine is None:
+        _engine = SuperResolutionEngine()
+    return _engine